@@ -1,10 +1,17 @@
+import os
+import sys
+
 import cv2
-from MainWindow import find_objects
 import numpy as np
 
+# O núcleo da análise (find_objects, constantes) e a leitura de imagens ficam em src/assets/python
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'assets', 'python'))
+from analysis_core import find_objects # Sem passar pelo MainWindow, que carrega o PyQt5
+from image_source import load_image
+
 
 image_path = 'folha_teste.jpg'
-image = cv2.imread(image_path)
+image = load_image(image_path)
 if image is None:
     print('Imagem não encontrada:', image_path)
 else:
@@ -1,14 +1,21 @@
+import os
+import sys
+
 import cv2
-from MainWindow import find_objects # Importa a função `find_objects`
 import numpy as np
 
+# O núcleo da análise (find_objects, constantes) e a leitura de imagens ficam em src/assets/python
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'assets', 'python'))
+from analysis_core import find_objects # Sem passar pelo MainWindow, que carrega o PyQt5
+from image_source import load_image
+
 # Certifique-se de que o nome do arquivo de imagem está correto
 IMAGE_PATH = 'folha_teste.jpg'
 REAL_AREA_SQUARE_CM = 1.0  # Área real do quadrado de referência em cm²
 
 print("--- INICIANDO SCRIPT DE DEPURAÇÃO ---")
 
-image = cv2.imread(IMAGE_PATH)
+image = load_image(IMAGE_PATH)
 
 if image is None:
     print(f"ERRO CRÍTICO: A imagem não foi encontrada no caminho: '{IMAGE_PATH}'")
@@ -1,67 +1,29 @@
 
+import os
+import sys
+
 import cv2
 import numpy as np
 
+# O núcleo da análise (find_objects, constantes) e a leitura de imagens ficam em src/assets/python
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'assets', 'python'))
+from analysis_core import find_objects
+from image_source import load_image
+
 # --- DEFINIÇÕES E CONSTANTES ---
 # !! IMPORTANTE !! Coloque aqui o nome da imagem do seu teste
 IMAGE_PATH = 'folha_teste.jpg' 
 REAL_AREA_SQUARE_CM = 1.0  # Área real do quadrado de referência em cm²
 
-# Constantes do algoritmo C++ original
-amin = 1000
-amax = 10000000000
-cosAngle = 0.3
-
-# --- FUNÇÕES AUXILIARES ---
-
-def cosine_angle(pt1, pt2, pt0):
-    """Calcula o cosseno do ângulo entre três pontos."""
-    # Usa inteiros de 64 bits para evitar o 'overflow warning'
-    dx1 = np.int64(pt1[0]) - np.int64(pt0[0])
-    dy1 = np.int64(pt1[1]) - np.int64(pt0[1])
-    dx2 = np.int64(pt2[0]) - np.int64(pt0[0])
-    dy2 = np.int64(pt2[1]) - np.int64(pt0[1])
-    
-    denominator = np.sqrt(float((dx1*dx1 + dy1*dy1) * (dx2*dx2 + dy2*dy2))) + 1e-10
-    if denominator == 0: return 1.0
-    return float(dx1 * dx2 + dy1 * dy2) / denominator
-
-def find_objects(image):
-    """Encontra os contornos de quadrados e folhas."""
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
-    contours, _ = cv2.findContours(thresh, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
-
-    squares = []
-    leaves = []
-    for cnt in contours:
-        auxper = cv2.arcLength(cnt, True)
-        approx = cv2.approxPolyDP(cnt, auxper * 0.02, True)
-        auxarea = abs(cv2.contourArea(cnt))
-        
-        if amin < auxarea < amax:
-            if len(approx) == 4 and cv2.isContourConvex(approx):
-                max_cosine = 0
-                for j in range(2, 5):
-                    cosine = abs(cosine_angle(approx[j % 4][0], approx[j - 2][0], approx[j - 1][0]))
-                    max_cosine = max(max_cosine, cosine)
-                if max_cosine < cosAngle:
-                    squares.append(cnt)
-                else:
-                    leaves.append(cnt)
-            else:
-                leaves.append(cnt)
-    return squares, leaves
-
 # --- SCRIPT PRINCIPAL ---
 
 print("--- INICIANDO ANÁLISE FINAL v3 (Versão Corrigida) ---")
-image = cv2.imread(IMAGE_PATH)
+image = load_image(IMAGE_PATH)
 
 if image is None:
     print(f"ERRO: Imagem não encontrada em '{IMAGE_PATH}'")
 else:
-    squares, leaves = find_objects(image)
+    squares, leaves, _ = find_objects(image)
     print(f"Objetos encontrados: {len(squares)} quadrados, {len(leaves)} folhas.")
 
     leaves.sort(key=lambda c: cv2.contourArea(c), reverse=True)
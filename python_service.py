@@ -2,44 +2,13 @@ import cv2
 import numpy as np
 import base64
 import json
+import os
 import sys
-from io import BytesIO
-from PIL import Image
 
-# Constantes do algoritmo original
-amin = 1000
-amax = 10000000000
-cosAngle = 0.3
-
-def cosine_angle(pt1, pt2, pt0):
-    dx1 = pt1[0] - pt0[0]
-    dy1 = pt1[1] - pt0[1]
-    dx2 = pt2[0] - pt0[0]
-    dy2 = pt2[1] - pt0[1]
-    return (dx1*dx2 + dy1*dy2) / np.sqrt((dx1*dx1 + dy1*dy1)*(dx2*dx2 + dy2*dy2) + 1e-10)
-
-def find_objects(image):
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    _, thresh = cv2.threshold(gray, 60, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
-    contours, _ = cv2.findContours(thresh, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
-    square = []
-    leaves = []
-    for cnt in contours:
-        auxper = cv2.arcLength(cnt, True)
-        approx = cv2.approxPolyDP(cnt, auxper*0.02, True)
-        auxarea = abs(cv2.contourArea(cnt))
-        if len(approx) == 4 and amin < auxarea < amax and cv2.isContourConvex(approx):
-            max_cosine = 0
-            for j in range(2, 5):
-                cosine = abs(cosine_angle(approx[j%4][0], approx[j-2][0], approx[j-1][0]))
-                max_cosine = max(max_cosine, cosine)
-            if max_cosine < cosAngle:
-                square.append(cnt)
-            else:
-                leaves.append(cnt)
-        elif amin < auxarea < amax:
-            leaves.append(cnt)
-    return square, leaves, thresh
+# A detecção (find_objects, cosine_angle, amin/amax/cosAngle) é a mesma do app e do servidor,
+# em src/assets/python/analysis_core.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src', 'assets', 'python'))
+from analysis_core import amax, amin, cosAngle, cosine_angle, find_objects
 
 def analyze_image(base64_image, scale_area=1.0):
     try:
@@ -0,0 +1,566 @@
+# analysis_core.py
+# Núcleo da detecção de folhas e quadrados de referência, compartilhado por todos os pontos de
+# entrada (python_service.py, servidor, processamento em lote, benchmark, scripts de
+# codigo_python/ e o python_service.py da raiz). Depende só do OpenCV e do NumPy: quem precisa
+# apenas de find_objects não carrega interface gráfica (PyQt5), Flask nem PIL.
+import hashlib
+import os
+
+import cv2
+import numpy as np
+
+import instrumentation
+from instrumentation import stage
+
+# Constantes do algoritmo original. Podem ser ajustadas por variável de ambiente
+# (LIMA_MIN_AREA, LIMA_MAX_AREA, LIMA_MAX_SQUARE_COSINE) ou por chamada, nos argumentos
+# min_area, max_area e max_cosine das funções abaixo.
+amin = float(os.environ.get('LIMA_MIN_AREA', 1000))
+amax = float(os.environ.get('LIMA_MAX_AREA', 10000000000))
+cosAngle = float(os.environ.get('LIMA_MAX_SQUARE_COSINE', 0.3))
+
+def cosine_angle(pt1, pt2, pt0):
+    # Usa inteiros de 64 bits para evitar o 'overflow warning'
+    dx1 = np.int64(pt1[0]) - np.int64(pt0[0])
+    dy1 = np.int64(pt1[1]) - np.int64(pt0[1])
+    dx2 = np.int64(pt2[0]) - np.int64(pt0[0])
+    dy2 = np.int64(pt2[1]) - np.int64(pt0[1])
+    
+    denominator = np.sqrt(float((dx1*dx1 + dy1*dy1) * (dx2*dx2 + dy2*dy2))) + 1e-10
+    if denominator == 0: return 1.0 # Evita divisão por zero
+    return float(dx1 * dx2 + dy1 * dy2) / denominator
+
+def contour_areas(contours):
+    """Área de todos os contornos em uma única operação NumPy (fórmula do laço de Gauss).
+
+    As coordenadas são inteiras e a soma é feita em int64, portanto o resultado é exato e
+    idêntico ao de abs(cv2.contourArea(cnt)) para cada contorno.
+    """
+    if not contours:
+        return np.empty(0, dtype=np.float64)
+    lengths = np.fromiter((len(c) for c in contours), dtype=np.intp, count=len(contours))
+    starts = np.zeros(len(contours), dtype=np.intp)
+    np.cumsum(lengths[:-1], out=starts[1:])
+
+    pts = np.concatenate(contours).reshape(-1, 2).astype(np.int64)
+    # Índice do ponto seguinte de cada ponto, voltando ao início no fim de cada contorno
+    nxt = np.arange(1, len(pts) + 1)
+    nxt[starts + lengths - 1] = starts
+    x, y = pts[:, 0], pts[:, 1]
+    cross = x * y[nxt] - x[nxt] * y
+    return np.abs(np.add.reduceat(cross, starts)) / 2.0
+
+def max_corner_cosines(quads):
+    """Maior |cosseno| entre os cantos de vários quadriláteros de uma vez.
+
+    quads tem formato (N, 4, 2). Reproduz o laço original com cosine_angle(approx[j%4],
+    approx[j-2], approx[j-1]) para j = 2, 3, 4, com a mesma aritmética (int64 e depois float64).
+    """
+    quads = quads.astype(np.int64)
+    pt1 = quads[:, [2, 3, 0]]
+    pt2 = quads[:, [0, 1, 2]]
+    pt0 = quads[:, [1, 2, 3]]
+    d1 = pt1 - pt0
+    d2 = pt2 - pt0
+    numerator = (d1[..., 0] * d2[..., 0] + d1[..., 1] * d2[..., 1]).astype(np.float64)
+    norms = (d1[..., 0] * d1[..., 0] + d1[..., 1] * d1[..., 1]) * (d2[..., 0] * d2[..., 0] + d2[..., 1] * d2[..., 1])
+    denominator = np.sqrt(norms.astype(np.float64)) + 1e-10
+    return np.abs(numerator / denominator).max(axis=1)
+
+def classify_contours(contours, min_area=None, max_area=None, max_cosine=None):
+    """Separa os contornos em quadrados de referência e folhas, mantendo a ordem original.
+
+    Equivale ao laço original do LIMA-Desktop, mas o filtro de área (amin/amax), que descarta a
+    grande maioria dos contornos de ruído, é feito de uma vez para todos. Só os contornos que
+    passam pelo filtro pagam arcLength + approxPolyDP, e os cossenos de todos os quadriláteros
+    candidatos são calculados em uma única operação.
+
+    min_area, max_area (pixels²) e max_cosine (maior |cosseno| dos cantos de um quadrado)
+    substituem amin, amax e cosAngle nesta chamada.
+    """
+    min_area = amin if min_area is None else min_area
+    max_area = amax if max_area is None else max_area
+    areas = contour_areas(contours)
+    candidates = np.flatnonzero((areas > min_area) & (areas < max_area))
+    is_square = square_flags([contours[i] for i in candidates], max_cosine)
+
+    square = []
+    leaves = []
+    for i, flag in zip(candidates, is_square):
+        # Formas de 4 lados que não são quadrados também são folhas
+        (square if flag else leaves).append(contours[i])
+    return square, leaves
+
+def square_flags(contours, max_cosine=None):
+    """Quais contornos são quadrados de referência (4 vértices convexos, cantos quase retos)."""
+    max_cosine = cosAngle if max_cosine is None else max_cosine
+    quad_indices = []
+    quad_points = []
+    for i, cnt in enumerate(contours):
+        auxper = cv2.arcLength(cnt, True)
+        approx = cv2.approxPolyDP(cnt, auxper*0.02, True)
+        if len(approx) == 4 and cv2.isContourConvex(approx):
+            quad_indices.append(i)
+            quad_points.append(approx.reshape(4, 2))
+
+    flags = np.zeros(len(contours), dtype=bool)
+    if quad_points:
+        max_cosines = max_corner_cosines(np.stack(quad_points))
+        flags[quad_indices] = max_cosines < max_cosine
+    return flags
+
+def measure_leaf_pca(leaf):
+    """Largura e comprimento em pixels de uma folha (eixos da PCA), uma folha por vez.
+
+    Implementação de referência, alinhada com o C++; measure_leaves_pca produz o mesmo resultado
+    para várias folhas de uma vez.
+    """
+    # --- Lógica de PCA para Largura/Comprimento (Com cálculo manual do centroide) ---
+    if len(leaf) >= 5: # PCA requer um número mínimo de pontos
+        # Usa np.float64 para corresponder ao 'double' do C++
+        data_pts = leaf.reshape(-1, 2).astype(np.float64)
+
+        manual_mean = np.mean(data_pts, axis=0)
+        _, eigenvectors, _ = cv2.PCACompute2(data_pts, mean=None)
+
+        translated_pts = data_pts - manual_mean
+        rotated_pts = translated_pts @ eigenvectors
+
+        # ## CORREÇÃO CRÍTICA ##
+        # Converte os pontos para float32 ANTES de passar para a função boundingRect
+        rotated_pts_for_bounding = rotated_pts.astype(np.float32)
+        x, y, w, h = cv2.boundingRect(rotated_pts_for_bounding)
+
+        return w, h
+    # Fallback para contornos muito pequenos
+    rect_rot = cv2.minAreaRect(leaf)
+    return rect_rot[1]
+
+def measure_leaves_pca(leaves):
+    """Versão em lote de measure_leaf_pca: lista de (w_px, l_px) com os mesmos valores.
+
+    Os pontos de todas as folhas são concatenados em um único buffer com offsets. Médias,
+    covariâncias 2x2, autovetores e extremos rotacionados são calculados para todas as folhas
+    de uma vez. Os autovetores usam a forma fechada da rotação de Jacobi que o cv2.PCACompute2
+    aplica em 2x2 (mesma convenção de sinal e de ordenação), e o retângulo envolvente segue o
+    cv2.boundingRect para float32: floor(max) - floor(min) + 1.
+
+    A única diferença possível em relação ao cv2 é de arredondamento no último bit da
+    covariância. Quando isso poderia mudar o floor de algum extremo (ou quando os dois
+    autovalores são quase iguais), a folha é medida novamente com measure_leaf_pca.
+    """
+    extents = [None] * len(leaves)
+    pca_idx = [i for i, leaf in enumerate(leaves) if len(leaf) >= 5]
+    for i in range(len(leaves)):
+        if len(leaves[i]) < 5:
+            extents[i] = measure_leaf_pca(leaves[i])
+    if not pca_idx:
+        return extents
+
+    contours = [leaves[i] for i in pca_idx]
+    lengths = np.fromiter((len(c) for c in contours), dtype=np.intp, count=len(contours))
+    starts = np.zeros(len(contours), dtype=np.intp)
+    np.cumsum(lengths[:-1], out=starts[1:])
+    seg = np.repeat(np.arange(len(contours)), lengths)
+
+    pts = np.concatenate(contours).reshape(-1, 2)
+    # Soma inteira exata, igual à média do np.mean em float64
+    mean = np.add.reduceat(pts.astype(np.int64), starts) / lengths[:, None]
+    translated = pts.astype(np.float64) - mean[seg]
+    tx, ty = translated[:, 0], translated[:, 1]
+
+    # Covariância (normalizada por n, como no cv2.PCACompute2)
+    a00 = np.add.reduceat(tx * tx, starts) / lengths
+    a01 = np.add.reduceat(tx * ty, starts) / lengths
+    a11 = np.add.reduceat(ty * ty, starts) / lengths
+
+    # Uma rotação de Jacobi zera o termo fora da diagonal de uma matriz 2x2
+    with np.errstate(invalid='ignore', divide='ignore'):
+        y = (a11 - a00) * 0.5
+        t = np.abs(y) + np.hypot(a01, y)
+        s = np.hypot(a01, t)
+        c = t / s
+        s = a01 / s
+        t = (a01 / t) * a01
+        s = np.where(y < 0, -s, s)
+        t = np.where(y < 0, -t, t)
+        w0 = a00 - t
+        w1 = a11 + t
+    # Autovetores nas linhas, em ordem decrescente de autovalor: [[c, -s], [s, c]] ou as linhas trocadas
+    swap = w0 < w1
+    e00 = np.where(swap, s, c)
+    e01 = np.where(swap, c, -s)
+    e10 = np.where(swap, c, s)
+    e11 = np.where(swap, -s, c)
+
+    # translated @ eigenvectors, como no código original
+    rx = tx * e00[seg] + ty * e10[seg]
+    ry = tx * e01[seg] + ty * e11[seg]
+
+    # Margem de erro dos extremos: proporcional à escala da folha e ao condicionamento dos autovetores
+    radius = np.maximum.reduceat(np.maximum(np.abs(tx), np.abs(ty)), starts)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        delta = 1e-10 * (radius + 1.0) * (np.abs(w0) + np.abs(w1)) / np.abs(w0 - w1)
+
+    sizes = []
+    unsafe = ~np.isfinite(delta) | ~np.isfinite(c)
+    for coords in (rx, ry):
+        lo = np.minimum.reduceat(coords, starts)
+        hi = np.maximum.reduceat(coords, starts)
+        for v in (lo, hi):
+            with np.errstate(invalid='ignore'):
+                unsafe |= np.floor((v - delta).astype(np.float32)) != np.floor((v + delta).astype(np.float32))
+        sizes.append(np.floor(hi.astype(np.float32)) - np.floor(lo.astype(np.float32)) + 1)
+
+    for k, i in enumerate(pca_idx):
+        if unsafe[k]:
+            extents[i] = measure_leaf_pca(leaves[i])
+        else:
+            extents[i] = (int(sizes[0][k]), int(sizes[1][k]))
+    return extents
+
+def to_gray(image):
+    # Imagens já em escala de cinza (ex.: TIFF mapeado por image_source) são usadas sem cópia
+    return image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+def masked_otsu(gray, mask):
+    """Limiar de Otsu calculado só com os pixels onde mask != 0 (mesmo critério do cv2.THRESH_OTSU)."""
+    hist = cv2.calcHist([gray], [0], mask, [256], [0, 256]).ravel().astype(np.float64)
+    total = hist.sum()
+    if total == 0:
+        return 0.0
+    p = hist / total
+    omega = np.cumsum(p)
+    mu = np.cumsum(p * np.arange(256))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sigma = (mu[-1] * omega - mu) ** 2 / (omega * (1.0 - omega))
+    sigma[~np.isfinite(sigma)] = -1.0
+    return float(np.argmax(sigma))
+
+def binary_mask(image, mask=None):
+    """Máscara binária dos objetos (escuros sobre o papel claro) pelo limiar de Otsu."""
+    with stage("grayscale"):
+        gray = to_gray(image)
+
+    # Alinhado com o C++: Threshold de Otsu imediatamente após a conversão para escala de cinza.
+    # O valor 60 no C++ é ignorado quando THRESH_OTSU é usado, então usar 0 aqui está correto.
+    with stage("threshold"):
+        if mask is None:
+            _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+        else:
+            _, thresh = cv2.threshold(gray, masked_otsu(gray, mask), 255, cv2.THRESH_BINARY_INV)
+            cv2.bitwise_and(thresh, mask, dst=thresh)
+    return thresh
+
+def find_objects(image, mask=None, **thresholds):
+    """Detecta quadrados de referência e folhas; retorna (squares, leaves, máscara binária).
+
+    mask (mesmo tamanho da imagem, 0 fora da região) restringe a detecção a uma região de
+    forma qualquer: o limiar de Otsu usa só os pixels da região e nada fora dela vira contorno.
+    thresholds: min_area, max_area e max_cosine, repassados a classify_contours.
+    """
+    thresh = binary_mask(image, mask)
+
+    # Alinhado com o C++: Usa RETR_LIST para obter todos os contornos, incluindo internos.
+    # Isso é crucial para replicar o comportamento exato do C++.
+    with stage("findContours"):
+        contours, _ = cv2.findContours(thresh, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+    instrumentation.count("contours", len(contours))
+
+    with stage("classification"):
+        square, leaves = classify_contours(contours, **thresholds)
+
+    return square, leaves, thresh
+
+def find_objects_components(image, mask=None, min_area=None, max_area=None, max_cosine=None):
+    """Detecção por componentes conexos (modo 'components').
+
+    Uma única passada de cv2.connectedComponentsWithStats sobre a máscara de Otsu dá a área em
+    pixels, o retângulo envolvente e o centroide de todas as manchas de uma vez. Só as manchas
+    que passam pelo filtro de área (amin/amax) têm o contorno externo extraído, dentro do próprio
+    retângulo; o ruído nunca vira contorno.
+
+    Diferenças em relação a find_objects: a área de cada objeto é a contagem de pixels da mancha
+    (furos excluídos), e não a área do polígono do contorno; furos dentro de uma folha não viram
+    contornos (nem folhas) separados; o filtro de área usa a contagem de pixels; a ordem segue a
+    varredura da imagem, de cima para baixo. Retorna (squares, leaves, máscara binária,
+    (áreas dos quadrados, áreas das folhas)). mask e os limites como em find_objects.
+    """
+    min_area = amin if min_area is None else min_area
+    max_area = amax if max_area is None else max_area
+    thresh = binary_mask(image, mask)
+
+    with stage("connectedComponents"):
+        # O algoritmo de Grana (BBDT) calcula as estatísticas cerca de 2x mais rápido que o padrão
+        count, labels, stats, _ = cv2.connectedComponentsWithStatsWithAlgorithm(thresh, 8, cv2.CV_32S, cv2.CCL_GRANA)
+    instrumentation.count("components", count - 1)
+    areas = stats[:, cv2.CC_STAT_AREA]
+    # O rótulo 0 é o fundo
+    candidates = np.flatnonzero((areas > min_area) & (areas < max_area))
+    candidates = candidates[candidates > 0]
+
+    with stage("findContours"):
+        contours = []
+        for i in candidates:
+            x, y, w, h = (int(v) for v in stats[i, :4])
+            blob = (labels[y:y + h, x:x + w] == i).view(np.uint8)
+            found, _ = cv2.findContours(blob, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=(x, y))
+            contours.append(max(found, key=len))
+    instrumentation.count("contours", len(contours))
+
+    with stage("classification"):
+        is_square = square_flags(contours, max_cosine)
+    squares, leaves = [], []
+    square_areas, leaf_areas = [], []
+    for cnt, area, flag in zip(contours, areas[candidates], is_square):
+        if flag:
+            squares.append(cnt)
+            square_areas.append(float(area))
+        else:
+            leaves.append(cnt)
+            leaf_areas.append(float(area))
+    return squares, leaves, thresh, (square_areas, leaf_areas)
+
+# Modos de detecção: 'full' processa o quadro inteiro (padrão, igual ao C++), 'tiled' usa
+# find_objects_tiled, 'auto' escolhe 'tiled' para imagens acima de TILED_AUTO_MEGAPIXELS e
+# 'components' usa find_objects_components (áreas pela contagem de pixels).
+DETECTION_MODES = ('full', 'tiled', 'auto', 'components')
+TILED_AUTO_MEGAPIXELS = 40
+# Maior lado da imagem reduzida usada para o limiar de Otsu e a localização aproximada dos objetos
+TILED_COARSE_MAX_SIDE = 1024
+
+def find_objects_tiled(image, coarse_max_side=TILED_COARSE_MAX_SIDE, margin=4, max_grow=4, **thresholds):
+    """Versão de find_objects para fotos muito grandes (ex.: folhas A3 digitalizadas a 600 dpi).
+
+    O limiar de Otsu e a posição aproximada dos objetos vêm de uma amostra da imagem (um pixel
+    a cada `step` em cada direção; sem média entre vizinhos, o histograma da amostra preserva o
+    ruído do original e o limiar fica praticamente igual ao da imagem inteira). Depois,
+    cvtColor/threshold/findContours rodam em resolução total apenas dentro da região (ROI) de
+    cada objeto, com o mesmo limiar. Regiões que se sobrepõem são unidas, e um contorno cortado
+    pela borda da região (parte do objeto não apareceu na amostra) faz a região crescer e ser
+    processada de novo. O pico de memória passa a depender do maior objeto, e não da folha inteira.
+
+    O limiar da amostra pode diferir em alguns níveis do calculado na imagem inteira, objetos
+    mais finos que `step` pixels podem não ser encontrados e a ordem dos contornos segue a
+    posição (de cima para baixo); por isso este modo é opcional. Retorna (squares, leaves, None):
+    não existe uma máscara binária do quadro inteiro. thresholds como em find_objects.
+    """
+    h, w = image.shape[:2]
+    step = int(np.ceil(max(h, w) / coarse_max_side))
+    if step <= 1:
+        return find_objects(image, **thresholds)
+    min_area = thresholds.get('min_area')
+    min_area = amin if min_area is None else min_area
+
+    with stage("coarseDetection"):
+        small_gray = to_gray(np.ascontiguousarray(image[::step, ::step]))
+        otsu, small_thresh = cv2.threshold(small_gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+        del small_gray
+        _, _, stats, _ = cv2.connectedComponentsWithStats(small_thresh, connectivity=8)
+
+    # Descarta manchas cujo retângulo, em resolução total, nem comporta a área mínima de uma folha
+    boxes = []
+    for x, y, bw, bh, _ in stats[1:]:
+        if (bw + 2) * (bh + 2) * step * step <= min_area:
+            continue
+        boxes.append((max(0, (x - margin) * step), max(0, (y - margin) * step),
+                      min(w, (x + bw + margin) * step), min(h, (y + bh + margin) * step)))
+    boxes = _merge_boxes(boxes)
+    if sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in boxes) > 0.5 * h * w:
+        # Objetos (ou ruído) cobrem quase toda a folha: recortar não economiza nada
+        return find_objects(image, **thresholds)
+
+    grow = margin * step
+    squares, leaves = [], []
+    seen = set()
+    for box in boxes:
+        for attempt in range(max_grow + 1):
+            x0, y0, x1, y1 = box
+            roi = image[y0:y1, x0:x1]  # visão da imagem, sem cópia
+            with stage("grayscale"):
+                gray = to_gray(roi)
+            with stage("threshold"):
+                _, thresh = cv2.threshold(gray, otsu, 255, cv2.THRESH_BINARY_INV)
+            with stage("findContours"):
+                contours, _ = cv2.findContours(thresh, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE, offset=(x0, y0))
+            instrumentation.count("contours", len(contours))
+            del gray, thresh
+            with stage("classification"):
+                roi_squares, roi_leaves = classify_contours(contours, **thresholds)
+            cut = [c for c in roi_squares + roi_leaves if _touches_roi_border(c, box, w, h)]
+            if not cut or attempt == max_grow:
+                break
+            box = (max(0, x0 - grow), max(0, y0 - grow), min(w, x1 + grow), min(h, y1 + grow))
+
+        # Regiões que cresceram podem encontrar o mesmo objeto: o contorno é idêntico, então basta
+        # comparar o retângulo envolvente e o número de pontos
+        for found, target in ((roi_squares, squares), (roi_leaves, leaves)):
+            for cnt in found:
+                signature = cv2.boundingRect(cnt) + (len(cnt),)
+                if signature not in seen:
+                    seen.add(signature)
+                    target.append(cnt)
+
+    def position(cnt):
+        x, y, _, _ = cv2.boundingRect(cnt)
+        return y, x
+    squares.sort(key=position)
+    leaves.sort(key=position)
+    return squares, leaves, None
+
+def _merge_boxes(boxes):
+    # Une retângulos (x0, y0, x1, y1) que se sobrepõem até não haver mais sobreposição
+    merged = sorted(boxes)
+    changed = True
+    while changed:
+        changed = False
+        result = []
+        for box in merged:
+            for i, other in enumerate(result):
+                if box[0] < other[2] and other[0] < box[2] and box[1] < other[3] and other[1] < box[3]:
+                    result[i] = (min(box[0], other[0]), min(box[1], other[1]), max(box[2], other[2]), max(box[3], other[3]))
+                    changed = True
+                    break
+            else:
+                result.append(box)
+        merged = result
+    return merged
+
+def _touches_roi_border(cnt, box, width, height):
+    # Contorno encostado em uma borda da região que não é borda da imagem
+    x, y, bw, bh = cv2.boundingRect(cnt)
+    x0, y0, x1, y1 = box
+    return ((x <= x0 and x0 > 0) or (y <= y0 and y0 > 0) or
+            (x + bw >= x1 and x1 < width) or (y + bh >= y1 and y1 < height))
+
+def parse_roi(roi):
+    """Valida a região de interesse recebida na requisição.
+
+    Aceita um retângulo [x, y, largura, altura] (ou {"x", "y", "width", "height"}) ou um
+    polígono [[x, y], ...] com pelo menos 3 pontos, em pixels da imagem original. Retorna None,
+    ('rect', (x, y, largura, altura)) ou ('polygon', array Nx2 int32).
+    """
+    if roi is None:
+        return None
+    if isinstance(roi, dict):
+        roi = [roi.get(k) for k in ('x', 'y', 'width', 'height')]
+    try:
+        if len(roi) == 4 and all(np.isscalar(v) for v in roi):
+            x, y, width, height = (int(round(float(v))) for v in roi)
+            if width <= 0 or height <= 0:
+                raise ValueError
+            return 'rect', (x, y, width, height)
+        points = np.asarray(roi, dtype=np.float64)
+    except (TypeError, ValueError):
+        points = None
+    if points is None or points.ndim != 2 or points.shape[1] != 2 or len(points) < 3 or not np.isfinite(points).all():
+        raise ValueError("'roi' deve ser [x, y, largura, altura] ou uma lista de pelo menos 3 pontos [x, y]")
+    return 'polygon', np.round(points).astype(np.int32)
+
+def roi_key(roi, max_side=None):
+    # Identifica a região (e a redução) na chave do cache; vazio sem região nem redução
+    shape = parse_roi(roi)
+    key = ''
+    if shape is not None:
+        coords = shape[1] if shape[0] == 'rect' else shape[1].ravel().tolist()
+        key += '-roi' + hashlib.blake2b(repr((shape[0], tuple(coords))).encode(), digest_size=8).hexdigest()
+    if max_side:
+        key += f"-a{int(max_side)}"
+    return key
+
+def detect_in_region(image, roi=None, max_side=None, detection='full', pixel_areas=False, **thresholds):
+    """detect_objects restrito a uma região de interesse e/ou em resolução reduzida.
+
+    Limiar, contornos e classificação rodam só no retângulo envolvente da região (uma visão da
+    imagem, sem cópia); em um polígono, os pixels fora dele também são ignorados. max_side
+    reduz a região (INTER_AREA) até o maior lado ter esse tamanho antes da detecção. Os
+    contornos voltam nas coordenadas da imagem original, e as áreas mínima e máxima valem
+    sempre em pixels da imagem original.
+
+    Retorna (squares, leaves, region), com region = (x, y, largura, altura) do recorte
+    analisado, ou None quando não há região nem redução. Com polígono a detecção é a do quadro
+    inteiro ('full', ou 'components' se pedida) dentro do recorte. Com pixel_areas=True
+    devolve também as áreas em pixels como em detect_objects.
+    """
+    shape = parse_roi(roi)
+    if shape is None and not max_side:
+        squares, leaves, _, areas = detect_objects(image, detection, pixel_areas=True, **thresholds)
+        return (squares, leaves, None, areas) if pixel_areas else (squares, leaves, None)
+
+    h, w = image.shape[:2]
+    if shape is None:
+        x, y, rw, rh = 0, 0, w, h
+    elif shape[0] == 'rect':
+        x, y, rw, rh = shape[1]
+    else:
+        x, y, rw, rh = cv2.boundingRect(shape[1])
+    x0, y0, x1, y1 = max(0, x), max(0, y), min(w, x + rw), min(h, y + rh)
+    if x1 <= x0 or y1 <= y0:
+        raise ValueError("A região de interesse está fora da imagem")
+    region = image[y0:y1, x0:x1]
+
+    mask = None
+    if shape is not None and shape[0] == 'polygon':
+        mask = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+        cv2.fillPoly(mask, [shape[1] - np.array([x0, y0], dtype=np.int32)], 255)
+
+    sx = sy = 1.0
+    if max_side and max(x1 - x0, y1 - y0) > max_side:
+        scale = max_side / max(x1 - x0, y1 - y0)
+        size = (max(1, round((x1 - x0) * scale)), max(1, round((y1 - y0) * scale)))
+        sx, sy = size[0] / (x1 - x0), size[1] / (y1 - y0)
+        with stage("downsample"):
+            region = cv2.resize(region, size, interpolation=cv2.INTER_AREA)
+            if mask is not None:
+                mask = cv2.resize(mask, size, interpolation=cv2.INTER_NEAREST)
+        # Os limites de área são em pixels da imagem original
+        thresholds = dict(thresholds)
+        for name, default in (('min_area', amin), ('max_area', amax)):
+            value = thresholds.get(name)
+            thresholds[name] = (default if value is None else value) * sx * sy
+
+    if mask is not None and detection == 'components':
+        squares, leaves, _, areas = find_objects_components(region, mask=mask, **thresholds)
+    elif mask is not None:
+        squares, leaves, _ = find_objects(region, mask=mask, **thresholds)
+        areas = None
+    else:
+        squares, leaves, _, areas = detect_objects(region, detection, pixel_areas=True, **thresholds)
+
+    # De volta às coordenadas da imagem original (centro do pixel reduzido -> centro no original)
+    offset = np.array([x0, y0], dtype=np.int32)
+    if sx != 1.0 or sy != 1.0:
+        factor = np.array([1.0 / sx, 1.0 / sy])
+        def to_original(cnt):
+            return np.round((cnt + 0.5) * factor - 0.5).astype(np.int32) + offset
+    else:
+        def to_original(cnt):
+            return cnt + offset
+    squares = [to_original(c) for c in squares]
+    leaves = [to_original(c) for c in leaves]
+    region = (x0, y0, x1 - x0, y1 - y0)
+    if not pixel_areas:
+        return squares, leaves, region
+    if areas is not None and (sx != 1.0 or sy != 1.0):
+        areas = tuple([a / (sx * sy) for a in group] for group in areas)
+    return squares, leaves, region, areas
+
+def detect_objects(image, detection='full', pixel_areas=False, **thresholds):
+    """Escolhe entre find_objects, find_objects_tiled e find_objects_components conforme o modo.
+
+    Retorna (squares, leaves, máscara) e, com pixel_areas=True, também as áreas em pixels
+    (quadrados, folhas) do modo 'components', ou None nos demais (área do contorno).
+    """
+    if detection not in DETECTION_MODES:
+        raise ValueError(f"Modo de detecção inválido: {detection}")
+    if detection == 'auto':
+        detection = 'tiled' if image.shape[0] * image.shape[1] > TILED_AUTO_MEGAPIXELS * 1e6 else 'full'
+    if detection == 'components':
+        squares, leaves, thresh, areas = find_objects_components(image, **thresholds)
+    elif detection == 'tiled':
+        squares, leaves, thresh = find_objects_tiled(image, **thresholds)
+        areas = None
+    else:
+        squares, leaves, thresh = find_objects(image, **thresholds)
+        areas = None
+    return (squares, leaves, thresh, areas) if pixel_areas else (squares, leaves, thresh)
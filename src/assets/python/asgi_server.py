@@ -0,0 +1,572 @@
+# asgi_server.py
+# Modo de produção do servidor de análise: uma aplicação ASGI (uvicorn, hypercorn...) com as
+# mesmas rotas e o mesmo contrato do server.py, que continua sendo o servidor de desenvolvimento.
+#
+#   python asgi_server.py                 # uvicorn em 0.0.0.0:5000
+#   uvicorn asgi_server:app --port 5000   # ou qualquer servidor ASGI (um processo só: o pool
+#                                         # de análise já usa os núcleos)
+#
+# - /analyze, /analyze/raw (corpo binário) e /analyze/stream leem o corpo de forma assíncrona,
+#   à medida que ele chega. Em /analyze o campo "base64_image" é decodificado pedaço a pedaço
+#   durante o upload (Base64FieldReader): quando o último byte chega, a imagem já está em binário.
+# - A análise, a serialização e a compressão rodam em threads (que esperam pelo pool de
+#   processos do server.py), nunca no laço de eventos.
+# - As demais rotas (lote, jobs, recalibração, imagens, métricas, multipart, OPTIONS do CORS)
+#   são atendidas pela própria aplicação Flask do server.py, chamada em uma thread.
+# - Respostas JSON/NDJSON são comprimidas com br (se o pacote brotli estiver instalado) ou gzip,
+#   conforme o Accept-Encoding; a sequência de quadros é comprimida quadro a quadro.
+# - Conexões persistentes (keep-alive) e o desligamento gracioso ficam com o servidor ASGI; no
+#   desligamento (evento lifespan) os trabalhos aceitos terminam antes do pool ser encerrado.
+#
+# Variáveis de ambiente: LIMA_HOST, LIMA_PORT, LIMA_KEEP_ALIVE (segundos que uma conexão ociosa
+# fica aberta), LIMA_GRACEFUL_TIMEOUT (segundos para as requisições em andamento terminarem no
+# desligamento), LIMA_GZIP_LEVEL, LIMA_BROTLI_QUALITY e LIMA_COMPRESS_MIN_BYTES, além das do
+# server.py.
+import asyncio
+import base64
+import binascii
+import io
+import json
+import os
+import re
+import sys
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+from flask import Response
+from werkzeug.datastructures import MultiDict
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import uvicorn
+except ImportError:
+    uvicorn = None
+
+import instrumentation
+import server
+from python_service import error_result
+
+HOST = os.environ.get('LIMA_HOST', '0.0.0.0')
+PORT = int(os.environ.get('LIMA_PORT', 5000))
+KEEP_ALIVE = int(os.environ.get('LIMA_KEEP_ALIVE', 30))
+GRACEFUL_TIMEOUT = int(os.environ.get('LIMA_GRACEFUL_TIMEOUT', 30))
+# Nível 1 do gzip já recupera quase tudo o que o base64 da imagem processada permite
+GZIP_LEVEL = int(os.environ.get('LIMA_GZIP_LEVEL', 1))
+BROTLI_QUALITY = int(os.environ.get('LIMA_BROTLI_QUALITY', 4))
+COMPRESS_MIN_BYTES = int(os.environ.get('LIMA_COMPRESS_MIN_BYTES', 1024))
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson', 'text/plain')
+
+# Threads que esperam pelo pool: o bastante para a fila inteira dele e para as respostas do
+# cache, de modo que o limite de requisições em andamento continue sendo o do pool (429)
+request_threads = ThreadPoolExecutor(max_workers=server.pool.max_pending + server.pool.workers,
+                                     thread_name_prefix='lima-asgi')
+
+
+class ClientDisconnected(Exception):
+    """O cliente fechou a conexão antes de terminar de enviar o corpo."""
+
+
+# --- Corpo da requisição ---
+
+async def body_chunks(receive):
+    # Pedaços do corpo na ordem em que chegam
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise ClientDisconnected()
+        chunk = message.get("body", b"")
+        if chunk:
+            yield chunk
+        if not message.get("more_body", False):
+            return
+
+
+async def read_body(receive):
+    body = bytearray()
+    async for chunk in body_chunks(receive):
+        body += chunk
+    return bytes(body)
+
+
+class BodyReader:
+    """Lê o corpo em blocos e entrega linhas ou quadros binários assim que chegam por inteiro."""
+
+    def __init__(self, receive):
+        self.chunks = body_chunks(receive)
+        self.buffer = bytearray()
+        self.done = False
+
+    async def _fill(self):
+        try:
+            self.buffer += await self.chunks.__anext__()
+        except StopAsyncIteration:
+            self.done = True
+
+    async def read_exactly(self, size):
+        while len(self.buffer) < size and not self.done:
+            await self._fill()
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    async def lines(self):
+        scan = 0
+        while True:
+            end = self.buffer.find(b'\n', scan)
+            if end != -1:
+                line = bytes(self.buffer[:end])
+                del self.buffer[:end + 1]
+                scan = 0
+                if line.strip():
+                    yield line
+            elif self.done:
+                if self.buffer.strip():
+                    yield bytes(self.buffer)
+                return
+            else:
+                scan = len(self.buffer)
+                await self._fill()
+
+    async def binary_frames(self):
+        # Mesmo formato de server.binary_frames: 4 bytes big-endian com o tamanho e o quadro
+        while True:
+            header = await self.read_exactly(4)
+            if len(header) < 4:
+                return
+            yield await self.read_exactly(int.from_bytes(header, 'big'))
+
+
+# O valor do campo é decodificado enquanto chega; o restante do JSON (opções) é guardado
+_BASE64_FIELD = re.compile(rb'"base64_image"\s*:\s*"')
+_NOT_BASE64 = bytes(sorted(set(range(256)) - set(b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/=')))
+# Quebras de linha escapadas no JSON (base64 quebrado em linhas); "\/" vira "/" ao descartar a barra invertida
+_JSON_LINE_ESCAPES = (b'\\n', b'\\r', b'\\t')
+
+
+class Base64FieldReader:
+    """Recebe um corpo JSON em pedaços e decodifica o campo "base64_image" enquanto ele chega.
+
+    O JSON sem o valor do campo (que vira "") fica em head; fields() o decodifica no fim e
+    image_data() devolve os bytes da imagem, com o mesmo resultado de base64.b64decode sobre o
+    texto inteiro (caracteres fora do alfabeto são descartados, padding incorreto é um erro).
+    """
+
+    def __init__(self):
+        self.head = bytearray()
+        self.state = 'key'          # 'key' -> 'value' -> 'rest'
+        self.image = None           # bytearray decodificado, quando o campo aparece
+        self.pending = b''          # caracteres que ainda não completam um grupo de 4
+        self.error = None
+        self.seconds = 0.0
+
+    def feed(self, chunk):
+        start = time.perf_counter()
+        while chunk:
+            if self.state == 'key':
+                # A chave pode ter chegado partida entre dois pedaços
+                scan = max(0, len(self.head) - 64)
+                self.head += chunk
+                chunk = b''
+                match = _BASE64_FIELD.search(self.head, scan)
+                if match:
+                    chunk = bytes(self.head[match.end():])
+                    del self.head[match.end():]
+                    self.state = 'value'
+                    self.image = bytearray()
+            elif self.state == 'value':
+                end = chunk.find(b'"')
+                self._decode(chunk if end == -1 else chunk[:end], final=end != -1)
+                if end == -1:
+                    chunk = b''
+                else:
+                    # As aspas de fechamento voltam para o JSON
+                    self.state = 'rest'
+                    chunk = chunk[end:]
+            else:
+                self.head += chunk
+                chunk = b''
+        self.seconds += time.perf_counter() - start
+
+    def _decode(self, value, final):
+        if self.error is not None:
+            return
+        data = self.pending + value
+        tail = b''
+        if b'\\' in data:
+            if data.endswith(b'\\') and not final:
+                # Um escape partido entre dois pedaços: a barra espera pelo próximo
+                data, tail = data[:-1], b'\\'
+            for escape in _JSON_LINE_ESCAPES:
+                data = data.replace(escape, b'')
+        data = data.translate(None, _NOT_BASE64)
+        usable = len(data) if final else len(data) - len(data) % 4
+        try:
+            self.image += binascii.a2b_base64(data[:usable])
+        except binascii.Error as e:
+            self.error = e
+        self.pending = data[usable:] + tail
+
+    def fields(self):
+        """O JSON recebido, com "base64_image" vazio se o campo foi decodificado durante o upload."""
+        if self.state == 'value':
+            raise ValueError("JSON incompleto")
+        return json.loads(self.head)
+
+    def image_data(self, fields):
+        if self.image is None:
+            # O campo não veio como uma string de nível superior: decodificação convencional
+            return base64.b64decode(fields['base64_image'])
+        if self.error is not None:
+            raise self.error
+        return bytes(self.image)
+
+
+def query_args(scope):
+    # Query string como MultiDict, igual ao request.args do Flask
+    return MultiDict(parse_qsl(scope.get("query_string", b"").decode('latin-1'), keep_blank_values=True))
+
+
+def header(scope, name):
+    name = name.encode('latin-1')
+    values = [value.decode('latin-1') for key, value in scope["headers"] if key.lower() == name]
+    return ', '.join(values)
+
+
+def mimetype(scope):
+    return header(scope, 'content-type').split(';', 1)[0].strip().lower()
+
+
+# --- Compressão da resposta ---
+
+def choose_encoding(accept_encoding):
+    # br (se o brotli estiver instalado) ou gzip, o primeiro que o cliente aceitar
+    accepted = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for encoding in ('br', 'gzip'):
+        if encoding == 'br' and brotli is None:
+            continue
+        if accepted.get(encoding, accepted.get('*', 0.0)) > 0:
+            return encoding
+    return None
+
+
+class Compressor:
+    """Compressão incremental em gzip ou br; flush() entrega o que já foi comprimido (streaming)."""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._brotli = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._zlib = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self._brotli.process(data) if self.encoding == 'br' else self._zlib.compress(data)
+
+    def flush(self):
+        return self._brotli.flush() if self.encoding == 'br' else self._zlib.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._brotli.finish() if self.encoding == 'br' else self._zlib.flush(zlib.Z_FINISH)
+
+
+def is_compressible(headers):
+    content_type = next((value for key, value in headers if key.lower() == 'content-type'), '')
+    return content_type.split(';', 1)[0].strip() in COMPRESSIBLE_TYPES
+
+
+def encode_body(status, headers, chunks, encoding):
+    # Monta a resposta final: cabeçalhos ASGI, corpo (comprimido se valer a pena) e tamanho.
+    # Roda nas threads de request_threads: comprimir megabytes de base64 não trava o laço
+    headers = [(key, value) for key, value in headers if key.lower() not in ('content-length', 'content-encoding')]
+    if is_compressible(headers):
+        headers.append(('Vary', 'Accept-Encoding'))
+        if encoding is not None and sum(len(chunk) for chunk in chunks) >= COMPRESS_MIN_BYTES:
+            compressor = Compressor(encoding)
+            with instrumentation.stage("compression"):
+                chunks = [compressor.compress(chunk) for chunk in chunks] + [compressor.finish()]
+            chunks = [chunk for chunk in chunks if chunk]
+            headers.append(('Content-Encoding', encoding))
+    headers.append(('Content-Length', str(sum(len(chunk) for chunk in chunks))))
+    asgi_headers = [(key.lower().encode('latin-1'), value.encode('latin-1')) for key, value in headers]
+    return status, asgi_headers, chunks
+
+
+def encode_response(response, encoding):
+    # Uma Response do Flask (as mesmas funções do server.py) convertida para o envio ASGI;
+    # iter_encoded entrega as partes do resultado sem juntá-las em uma string
+    return encode_body(response.status_code, response.headers.to_wsgi_list(), list(response.iter_encoded()), encoding)
+
+
+async def send_encoded(send, encoded):
+    status, headers, chunks = encoded
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    for chunk in chunks:
+        await send({"type": "http.response.body", "body": chunk, "more_body": True})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def send_error(send, message, status, encoding):
+    await send_encoded(send, encode_response(server.json_error(message, status), encoding))
+
+
+def run_in_thread(fn, *args):
+    return asyncio.get_running_loop().run_in_executor(request_threads, fn, *args)
+
+
+# --- Rotas atendidas aqui ---
+
+def analyze_decoded(reader, fields, scale_area, options, encoding):
+    # Parte de /analyze que roda em thread: os bytes já decodificados vão para a mesma
+    # run_single_analysis do server.py (cache, pool e modo 'deferred')
+    with instrumentation.collect() as timings:
+        timings.stages["base64Decode"] = reader.seconds
+        try:
+            image_data = reader.image_data(fields)
+        except Exception as e:
+            response = Response(error_result(e), status=200, mimetype='application/json')
+        else:
+            response = server.run_single_analysis(image_data, scale_area, options)
+        encoded = encode_response(response, encoding)
+    server.observe_timings(timings)
+    return encoded
+
+
+def analyze_binary(image_data, scale_area, options, encoding):
+    with instrumentation.collect() as timings:
+        encoded = encode_response(server.run_single_analysis(image_data, scale_area, options), encoding)
+    server.observe_timings(timings)
+    return encoded
+
+
+async def analyze_endpoint(scope, receive, send, encoding):
+    print("\n>>> Requisição de análise recebida do aplicativo! <<<", flush=True)
+
+    reader = Base64FieldReader()
+    async for chunk in body_chunks(receive):
+        reader.feed(chunk)
+    try:
+        fields = reader.fields()
+    except ValueError as e:
+        return await send_error(send, f"JSON inválido: {e}", 400, encoding)
+    if not isinstance(fields, dict) or 'base64_image' not in fields:
+        return await send_error(send, "Nenhuma imagem em base64 fornecida", 400, encoding)
+
+    scale_area = fields.get('real_area_square', 1.0)
+    try:
+        options = server.analysis_options(fields)
+    except ValueError as e:
+        return await send_error(send, str(e), 400, encoding)
+
+    encoded = await run_in_thread(analyze_decoded, reader, fields, scale_area, options, encoding)
+    return await send_encoded(send, encoded)
+
+
+async def analyze_raw_endpoint(scope, receive, send, encoding):
+    # Corpo inteiro como application/octet-stream / image/* (o multipart vai para o Flask)
+    print("\n>>> Requisição de análise (binária) recebida do aplicativo! <<<", flush=True)
+
+    image_data = await read_body(receive)
+    if not image_data:
+        return await send_error(send, "Nenhuma imagem fornecida", 400, encoding)
+    args = query_args(scope)
+    try:
+        options = server.analysis_options(args)
+    except ValueError as e:
+        return await send_error(send, str(e), 400, encoding)
+
+    scale_area = args.get('real_area_square', 1.0, type=float)
+    encoded = await run_in_thread(analyze_binary, image_data, scale_area, options, encoding)
+    return await send_encoded(send, encoded)
+
+
+async def analyze_stream_endpoint(scope, receive, send, encoding):
+    # Mesmo protocolo de server.analyze_stream_endpoint; aqui cada quadro (linha NDJSON ou
+    # quadro binário) é analisado assim que termina de chegar, nos dois formatos
+    print("\n>>> Sequência de quadros recebida do aplicativo! <<<", flush=True)
+    try:
+        stream, leaf_layout = server.frame_stream_from_args(query_args(scope))
+    except ValueError as e:
+        return await send_error(send, str(e), 400, encoding)
+
+    headers = [(b'content-type', b'application/x-ndjson'), (b'vary', b'Accept-Encoding')]
+    compressor = None
+    if encoding is not None:
+        compressor = Compressor(encoding)
+        headers.append((b'content-encoding', encoding.encode('latin-1')))
+    await send({"type": "http.response.start", "status": 200, "headers": headers})
+
+    binary = mimetype(scope) == 'application/octet-stream'
+    reader = BodyReader(receive)
+    frames = reader.binary_frames() if binary else reader.lines()
+    index = 0
+    async for frame in frames:
+        line = (await run_in_thread(server.stream_frame_line, stream, index, frame, binary, leaf_layout)).encode()
+        if compressor is not None:
+            # Z_SYNC_FLUSH: o cliente descomprime cada quadro sem esperar pelos próximos
+            line = compressor.compress(line) + compressor.flush()
+        await send({"type": "http.response.body", "body": line, "more_body": True})
+        index += 1
+    await send({"type": "http.response.body", "body": compressor.finish() if compressor is not None else b""})
+
+
+# --- Demais rotas: a aplicação Flask em uma thread ---
+
+def wsgi_environ(scope, body):
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode('utf-8').decode('latin-1'),
+        "PATH_INFO": scope["path"].encode('utf-8').decode('latin-1'),
+        "QUERY_STRING": scope.get("query_string", b"").decode('latin-1'),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+        "CONTENT_LENGTH": str(len(body)),
+    }
+    server_address = scope.get("server") or ('localhost', PORT)
+    environ["SERVER_NAME"], environ["SERVER_PORT"] = server_address[0], str(server_address[1])
+    if scope.get("client"):
+        environ["REMOTE_ADDR"] = scope["client"][0]
+    for key, value in scope["headers"]:
+        name = key.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            name = 'HTTP_' + name
+            environ[name] = environ[name] + ',' + value if name in environ else value
+    return environ
+
+
+def call_flask(environ, encoding):
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started["status"], started["headers"] = int(status.split(' ', 1)[0]), headers
+
+    body = server.app(environ, start_response)
+    try:
+        chunks = [chunk for chunk in body if chunk]
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+    return encode_body(started["status"], started["headers"], chunks, encoding)
+
+
+async def flask_endpoint(scope, receive, send, encoding):
+    body = await read_body(receive)
+    encoded = await run_in_thread(call_flask, wsgi_environ(scope, body), encoding)
+    await send_encoded(send, encoded)
+
+
+def native_route(scope):
+    # Rotas atendidas sem passar pelo Flask; o restante (e formatos que só o Flask trata, como
+    # multipart e JSON com outro Content-Type) vai para flask_endpoint
+    if scope["method"] != 'POST':
+        return None
+    path, content_type = scope["path"], mimetype(scope)
+    if path == '/analyze' and content_type == 'application/json':
+        return analyze_endpoint
+    if path == '/analyze/raw' and content_type != 'multipart/form-data':
+        return analyze_raw_endpoint
+    if path == '/analyze/stream':
+        return analyze_stream_endpoint
+    return None
+
+
+# --- Aplicação ASGI ---
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            pool = server.pool
+            print(f">>> Servidor de análise L.I.M.A. (ASGI) rodando em http://{HOST}:{PORT} <<<")
+            print(f">>> Análises executadas em {pool.workers} processos (fila máxima: {pool.max_pending}; "
+                  f"{pool.cv2_threads} threads do OpenCV e {pool.blas_threads} do BLAS por processo). <<<", flush=True)
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            # O servidor ASGI já parou de aceitar conexões e esperou as requisições em
+            # andamento; os trabalhos assíncronos aceitos terminam antes do pool ser encerrado
+            await asyncio.get_running_loop().run_in_executor(None, shutdown)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+def shutdown():
+    print(">>> Encerrando: aguardando os trabalhos em andamento... <<<", flush=True)
+    server.job_executor.shutdown(wait=True)
+    request_threads.shutdown(wait=True)
+    server.pool.shutdown(wait=True)
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+
+    encoding = choose_encoding(header(scope, 'accept-encoding'))
+    endpoint = native_route(scope)
+    if endpoint is None:
+        # O Flask registra as próprias métricas de requisição
+        try:
+            await flask_endpoint(scope, receive, send, encoding)
+        except ClientDisconnected:
+            pass
+        return
+
+    start = time.perf_counter()
+    status = 499
+    # CORS como o flask_cors configurado no server.py: a origem do aplicativo Ionic é ecoada
+    origin = header(scope, 'origin').encode('latin-1')
+
+    async def send_and_record(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+            if origin:
+                message["headers"] = message["headers"] + [(b'access-control-allow-origin', origin), (b'vary', b'Origin')]
+        await send(message)
+
+    try:
+        await endpoint(scope, receive, send_and_record, encoding)
+    except ClientDisconnected:
+        pass
+    finally:
+        server.request_seconds.observe(scope["path"], value=time.perf_counter() - start)
+        server.requests_total.inc(scope["path"], str(status))
+
+
+def main():
+    if uvicorn is None:
+        print("O modo de produção precisa de um servidor ASGI: pip install uvicorn "
+              "(ou rode 'hypercorn asgi_server:app')", file=sys.stderr)
+        return 1
+    uvicorn.run(app, host=HOST, port=PORT, lifespan='on', timeout_keep_alive=KEEP_ALIVE,
+                timeout_graceful_shutdown=GRACEFUL_TIMEOUT)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
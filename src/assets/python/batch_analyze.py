@@ -0,0 +1,379 @@
+# batch_analyze.py
+# Análise em lote de diretórios de imagens para experimentos.
+#
+# Uso:
+#   python batch_analyze.py fotos/ "outras/*.jpg" --out resultados --real-area-square 1.0
+#
+# Percorre diretórios (ou padrões glob), processa as imagens em paralelo e grava, à medida
+# que cada imagem termina, uma linha por folha (leaves.csv) e uma linha por imagem
+# (images.csv). Se a execução for interrompida, rodar o mesmo comando novamente pula as
+# imagens que já estão em images.csv. Com --format parquet (requer pyarrow), cada execução
+# grava novos arquivos leaves-NNNN.parquet / images-NNNN.parquet no diretório de saída.
+# Ao final, summary.json traz as estatísticas de todas as folhas do diretório de saída (média,
+# desvio, mínimo, máximo e quantis aproximados de cada medida): na retomada, as das imagens já
+# concluídas são refeitas a partir das linhas gravadas, com os valores arredondados das colunas.
+import argparse
+import csv
+import glob
+import json
+import multiprocessing
+import os
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from image_source import load_image
+from python_service import DETECTION_MODES, calibrate, measure_image
+from running_stats import LeafStats
+from thread_budget import configure_worker, limit_blas_env, plan_threads
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp')
+
+LEAF_COLUMNS = [
+    "image", "leaf_id", "area", "perimeter", "width", "length", "width_to_length_ratio",
+    "area_px", "perimeter_px", "width_px", "length_px",
+]
+IMAGE_COLUMNS = [
+    "image", "status", "error", "number_of_leaves", "number_of_squares", "real_area_square",
+    "total_area", "average_area", "std_area", "average_perimeter", "std_perimeter",
+    "average_width", "std_width", "average_length", "std_length", "average_width_to_length_ratio",
+]
+# Colunas de leaves.csv na ordem dos campos de LeafStats, para refazer o resumo na retomada
+STAT_COLUMNS = ("area", "perimeter", "width", "length", "width_to_length_ratio")
+
+
+def find_images(inputs, recursive=True):
+    """Expande diretórios e padrões glob em uma lista ordenada e sem repetições de imagens."""
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            pattern = os.path.join(item, '**', '*') if recursive else os.path.join(item, '*')
+            candidates = glob.iglob(pattern, recursive=recursive)
+        else:
+            candidates = glob.iglob(item, recursive=True)
+        paths.extend(os.path.normpath(p) for p in candidates
+                     if p.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(p))
+    return sorted(set(paths))
+
+
+def analyze_path(path, real_area_square=1.0, reference_index=0, detection='full', decode_max_side=None):
+    """Analisa uma imagem do disco e devolve (linhas das folhas, linha da imagem, LeafStats).
+
+    Executada nos processos de trabalho; só as linhas e as estatísticas (e não a imagem) voltam
+    ao processo principal. Em caso de erro as estatísticas são None.
+    """
+    try:
+        # O arquivo é mapeado com mmap (TIFF sem compressão vira uma visão dos pixels, sem cópia)
+        image = load_image(path, decode_max_side)
+        if image is None:
+            raise ValueError("Não foi possível decodificar a imagem")
+
+        measurements = measure_image(image, detection)
+        del image
+        # Sem o log legível por imagem: o progresso do lote já é impresso pelo processo principal
+        leaf_stats = LeafStats(quantiles=True)
+        result = calibrate(measurements, real_area_square, reference_index, verbose=False, leaf_stats=leaf_stats)
+    except Exception as e:
+        return [], {"image": path, "status": "error", "error": str(e)}, None
+
+    leaf_rows = []
+    for i, metric in enumerate(result["leaves"]):
+        w_px, l_px = measurements.extents_px[i]
+        leaf_rows.append({
+            "image": path,
+            "leaf_id": metric["id"],
+            "area": metric["area"],
+            "perimeter": metric["perimeter"],
+            "width": metric["width"],
+            "length": metric["length"],
+            "width_to_length_ratio": metric["widthToLengthRatio"],
+            "area_px": measurements.areas_px[i],
+            "perimeter_px": measurements.perimeters_px[i],
+            "width_px": min(w_px, l_px),
+            "length_px": max(w_px, l_px),
+        })
+
+    agg = result["aggregatedMetrics"]
+    image_row = {
+        "image": path,
+        "status": "ok",
+        "error": "",
+        "number_of_leaves": result["numberOfLeaves"],
+        "number_of_squares": len(measurements.squares),
+        "real_area_square": real_area_square,
+        "total_area": agg["totalArea"],
+        "average_area": float(agg["averageArea"]),
+        "std_area": float(agg["standardDeviationArea"]),
+        "average_perimeter": float(agg["averagePerimeter"]),
+        "std_perimeter": float(agg["standardDeviationPerimeter"]),
+        "average_width": float(agg["averageWidth"]),
+        "std_width": float(agg["standardDeviationWidth"]),
+        "average_length": float(agg["averageLength"]),
+        "std_length": float(agg["standardDeviationLength"]),
+        "average_width_to_length_ratio": float(agg["averageWidthToLengthRatio"]),
+    }
+    return leaf_rows, image_row, leaf_stats
+
+
+class CsvSink:
+    """Grava leaves.csv e images.csv incrementalmente, com retomada."""
+
+    def __init__(self, out_dir):
+        self.leaves_path = os.path.join(out_dir, 'leaves.csv')
+        self.images_path = os.path.join(out_dir, 'images.csv')
+        self._leaves_file = self._leaves = self._images_file = self._images = None
+
+    def prepare_resume(self):
+        # Imagens concluídas com sucesso em execuções anteriores. As que falharam são tentadas de novo
+        # (suas linhas são removidas, assim como folhas de imagens que não chegaram a ser concluídas).
+        done = set()
+        if os.path.exists(self.images_path):
+            with open(self.images_path, newline='', encoding='utf-8') as f:
+                done = {row["image"] for row in csv.DictReader(f) if row.get("status") == "ok"}
+            self._drop_rows(self.images_path, IMAGE_COLUMNS, done)
+        if os.path.exists(self.leaves_path):
+            self._drop_rows(self.leaves_path, LEAF_COLUMNS, done)
+        return done
+
+    @staticmethod
+    def _drop_rows(path, columns, keep_images):
+        with open(path, newline='', encoding='utf-8') as f:
+            rows = [row for row in csv.DictReader(f) if row.get("image") in keep_images]
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(rows)
+        os.replace(tmp_path, path)
+
+    def load_stats(self, leaf_stats):
+        # Depois de prepare_resume() os arquivos só têm as imagens concluídas com sucesso
+        if os.path.exists(self.images_path):
+            with open(self.images_path, newline='', encoding='utf-8') as f:
+                leaf_stats.images += sum(1 for _ in csv.DictReader(f))
+        if os.path.exists(self.leaves_path):
+            with open(self.leaves_path, newline='', encoding='utf-8') as f:
+                for row in csv.DictReader(f):
+                    leaf_stats.add(*(float(row[c]) for c in STAT_COLUMNS))
+
+    def reset(self):
+        for path in (self.leaves_path, self.images_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def open(self):
+        self._leaves_file, self._leaves = self._open_writer(self.leaves_path, LEAF_COLUMNS)
+        self._images_file, self._images = self._open_writer(self.images_path, IMAGE_COLUMNS)
+
+    @staticmethod
+    def _open_writer(path, columns):
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        f = open(path, 'a', newline='', encoding='utf-8')
+        writer = csv.DictWriter(f, fieldnames=columns, extrasaction='ignore')
+        if new_file:
+            writer.writeheader()
+        return f, writer
+
+    def write(self, leaf_rows, image_row):
+        # As folhas são gravadas antes da linha da imagem: uma imagem em images.csv sempre tem
+        # todas as suas folhas em leaves.csv.
+        self._leaves.writerows(leaf_rows)
+        self._leaves_file.flush()
+        self._images.writerow(image_row)
+        self._images_file.flush()
+
+    def close(self):
+        for f in (self._leaves_file, self._images_file):
+            if f is not None:
+                f.close()
+
+
+class ParquetSink:
+    """Grava arquivos Parquet em partes (um novo par de arquivos por execução), com retomada."""
+
+    def __init__(self, out_dir, rows_per_group=2000):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("O formato parquet requer o pacote pyarrow (pip install pyarrow)")
+        self.pa = pa
+        self.pq = pq
+        self.out_dir = out_dir
+        self.rows_per_group = rows_per_group
+        text_columns = {"image", "status", "error"}
+        int_columns = {"leaf_id", "number_of_leaves", "number_of_squares"}
+        self.schemas = {
+            name: pa.schema([(c, pa.string() if c in text_columns else pa.int64() if c in int_columns else pa.float64())
+                             for c in columns])
+            for name, columns in (("leaves", LEAF_COLUMNS), ("images", IMAGE_COLUMNS))
+        }
+        self._writers = {}
+        self._buffers = {"leaves": [], "images": []}
+
+    def _parts(self, name):
+        return sorted(glob.glob(os.path.join(self.out_dir, f'{name}-*.parquet')))
+
+    def prepare_resume(self):
+        # Imagens concluídas com sucesso em execuções anteriores. As que falharam são tentadas de novo.
+        done = set()
+        for path in self._parts('images'):
+            try:
+                table = self.pq.read_table(path, columns=["image", "status"]).to_pydict()
+            except Exception as e:
+                # Parte sem rodapé (execução interrompida à força): suas imagens serão refeitas
+                print(f"AVISO: ignorando {path}: {e}", file=sys.stderr)
+                continue
+            done.update(image for image, status in zip(table["image"], table["status"]) if status == "ok")
+        return done
+
+    def load_stats(self, leaf_stats):
+        # Só as partes cujo images-NNNN.parquet é legível: as imagens das outras serão refeitas
+        for images_path in self._parts('images'):
+            try:
+                table = self.pq.read_table(images_path, columns=["image", "status"]).to_pydict()
+            except Exception:
+                continue
+            done = {image for image, status in zip(table["image"], table["status"]) if status == "ok"}
+            leaf_stats.images += len(done)
+            leaves_path = os.path.join(self.out_dir, 'leaves-' + os.path.basename(images_path)[len('images-'):])
+            if not done or not os.path.exists(leaves_path):
+                continue
+            leaves = self.pq.read_table(leaves_path, columns=["image", *STAT_COLUMNS]).to_pydict()
+            for i, image in enumerate(leaves["image"]):
+                if image in done:
+                    leaf_stats.add(*(leaves[c][i] for c in STAT_COLUMNS))
+
+    def reset(self):
+        for path in self._parts('leaves') + self._parts('images'):
+            os.remove(path)
+
+    def open(self):
+        part = len(self._parts('images'))
+        for name in ("leaves", "images"):
+            path = os.path.join(self.out_dir, f'{name}-{part:04d}.parquet')
+            self._writers[name] = self.pq.ParquetWriter(path, self.schemas[name])
+
+    def _flush(self, name):
+        rows = self._buffers[name]
+        if rows:
+            self._writers[name].write_table(self.pa.Table.from_pylist(rows, schema=self.schemas[name]))
+            rows.clear()
+
+    def write(self, leaf_rows, image_row):
+        # Os buffers são descarregados juntos, folhas primeiro, como no CsvSink
+        self._buffers["leaves"].extend(leaf_rows)
+        self._buffers["images"].append(image_row)
+        if len(self._buffers["leaves"]) >= self.rows_per_group or len(self._buffers["images"]) >= self.rows_per_group:
+            self._flush("leaves")
+            self._flush("images")
+
+    def close(self):
+        for name in ("leaves", "images"):
+            if name in self._writers:
+                self._flush(name)
+                self._writers[name].close()
+
+
+def run(paths, sink, workers=None, real_area_square=1.0, reference_index=0, max_in_flight=None, detection='full',
+        decode_max_side=None, leaf_stats=None, cv2_threads=None, blas_threads=None):
+    """Processa as imagens em paralelo, gravando cada resultado assim que fica pronto.
+
+    No máximo max_in_flight imagens (padrão: 2 por processo) estão em andamento ao mesmo tempo,
+    então o uso de memória não depende do tamanho do diretório. As estatísticas de cada imagem
+    são combinadas em leaf_stats (um LeafStats), se fornecido. cv2_threads e blas_threads
+    limitam as threads de cada processo (padrão: núcleos divididos entre os processos).
+    """
+    workers, cv2_threads, blas_threads = plan_threads(workers, cv2_threads, blas_threads)
+    max_in_flight = max_in_flight or workers * 2
+    pending = iter(paths)
+    in_flight = set()
+    processed = failed = 0
+
+    # 'spawn' para que os processos carreguem o NumPy já com o limite de threads do BLAS
+    # (com 'fork' herdariam as threads criadas neste processo)
+    limit_blas_env(blas_threads)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=configure_worker, initargs=(cv2_threads, blas_threads)) as executor:
+        while True:
+            for path in pending:
+                in_flight.add(executor.submit(analyze_path, path, real_area_square, reference_index, detection,
+                                              decode_max_side))
+                if len(in_flight) >= max_in_flight:
+                    break
+            if not in_flight:
+                break
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                leaf_rows, image_row, image_stats = future.result()
+                sink.write(leaf_rows, image_row)
+                if leaf_stats is not None and image_stats is not None:
+                    leaf_stats.merge(image_stats)
+                processed += 1
+                if image_row["status"] != "ok":
+                    failed += 1
+                    print(f"ERRO em {image_row['image']}: {image_row['error']}", file=sys.stderr)
+                if processed % 50 == 0 or processed == len(paths):
+                    print(f"{processed}/{len(paths)} imagens processadas", file=sys.stderr, flush=True)
+    return processed, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Análise em lote de imagens de folhas (L.I.M.A.)")
+    parser.add_argument('inputs', nargs='+', help="diretórios ou padrões glob de imagens")
+    parser.add_argument('--out', default='resultados', help="diretório de saída (padrão: resultados)")
+    parser.add_argument('--format', choices=('csv', 'parquet'), default='csv')
+    parser.add_argument('--real-area-square', type=float, default=1.0, help="área real do quadrado de referência (cm²)")
+    parser.add_argument('--reference-square-id', type=int, default=1, help="quadrado usado como referência (1 = primeiro detectado)")
+    parser.add_argument('--detection', choices=DETECTION_MODES, default='full',
+                        help="detecção de objetos: full, tiled (fotos muito grandes), auto ou components (componentes conexos)")
+    parser.add_argument('--decode-max-side', type=int, default=None,
+                        help="decodifica JPEGs grandes em 1/2, 1/4 ou 1/8 da resolução, mantendo ao menos este maior lado")
+    parser.add_argument('--workers', type=int, default=None, help="número de processos (padrão: um por núcleo)")
+    parser.add_argument('--cv2-threads', type=int, default=None,
+                        help="threads do OpenCV por processo (padrão: núcleos divididos entre os processos)")
+    parser.add_argument('--blas-threads', type=int, default=None, help="threads do BLAS por processo (padrão: 1)")
+    parser.add_argument('--no-recursive', action='store_true', help="não percorre subdiretórios")
+    parser.add_argument('--no-resume', action='store_true', help="descarta resultados anteriores e reprocessa tudo")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.out, exist_ok=True)
+    sink = ParquetSink(args.out) if args.format == 'parquet' else CsvSink(args.out)
+
+    paths = find_images(args.inputs, recursive=not args.no_recursive)
+    leaf_stats = LeafStats(quantiles=True)
+    if args.no_resume:
+        sink.reset()
+    else:
+        done = sink.prepare_resume()
+        sink.load_stats(leaf_stats)
+        skipped = sum(1 for p in paths if p in done)
+        paths = [p for p in paths if p not in done]
+        if skipped:
+            print(f"Retomando: {skipped} imagens já concluídas foram puladas", file=sys.stderr)
+    print(f"{len(paths)} imagens a processar", file=sys.stderr, flush=True)
+
+    sink.open()
+    try:
+        processed, failed = run(paths, sink, args.workers, args.real_area_square, args.reference_square_id - 1,
+                               detection=args.detection, decode_max_side=args.decode_max_side, leaf_stats=leaf_stats,
+                               cv2_threads=args.cv2_threads, blas_threads=args.blas_threads)
+    finally:
+        sink.close()
+    write_summary(os.path.join(args.out, 'summary.json'), leaf_stats)
+    print(f"Concluído: {processed} imagens ({failed} com erro). Resultados em {args.out}", file=sys.stderr)
+    if leaf_stats.count:
+        area = leaf_stats.fields["area"]
+        print(f"{leaf_stats.count} folhas; área média {area.mean:.4f} cm² (desvio {area.std:.4f}, "
+              f"mediana ~{area.quantile(0.5):.4f})", file=sys.stderr)
+
+
+def write_summary(path, leaf_stats):
+    # Gravado à parte e renomeado, para não deixar um resumo pela metade se o processo morrer
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(leaf_stats.summary(), f, indent=2)
+    os.replace(tmp_path, path)
+
+
+if __name__ == '__main__':
+    main()
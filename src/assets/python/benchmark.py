@@ -0,0 +1,370 @@
+# benchmark.py
+# Benchmark reprodutível do pipeline de análise de folhas.
+#
+# Uso:
+#   python benchmark.py                                   # cenários 'quick', resultado em ./benchmarks/
+#   python benchmark.py --preset full --repeat 20
+#   python benchmark.py --scenario 6000x4000:40:8 --targets find_objects,analyze_image
+#   python benchmark.py --compare benchmarks/anterior.json   # falha (código 1) se houver regressão
+#   python benchmark.py --targets pool_analyze --concurrency 4 --workers 4 --cv2-threads 1
+#
+# Cada cenário é uma folha sintética gerada com semente fixa: resolução, número de folhas,
+# nível de ruído e um quadrado de referência. São medidos find_objects, a etapa de medição
+# (áreas, perímetros e PCA), analyze_image completo (base64 -> JSON) e, opcionalmente, o
+# endpoint /analyze do servidor (via cliente de teste do Flask, com o pool de processos real)
+# e pool_analyze: --concurrency análises simultâneas no pool de processos (com --workers,
+# --cv2-threads e --blas-threads), medindo a latência de cada uma e a vazão do conjunto.
+# Cada cenário roda em um processo novo, para que o pico de memória (RSS) seja só dele (no
+# alvo http_analyze a análise roda nos processos do pool, cuja memória não entra nessa conta).
+import argparse
+import base64
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2
+import numpy as np
+
+import instrumentation
+from analysis_core import find_objects
+from python_service import analyze_image, analyze_image_bytes, measure_image
+from thread_budget import available_cpus
+
+TARGETS = ('find_objects', 'measure', 'analyze_image', 'http_analyze', 'pool_analyze')
+DEFAULT_TARGETS = ('find_objects', 'measure', 'analyze_image')
+
+# largura x altura : folhas : ruído (desvio padrão, em níveis de cinza)
+PRESETS = {
+    'quick': ['1600x1200:5:4', '4000x3000:12:8', '6000x4000:30:8'],
+    'full': [
+        '1600x1200:5:0', '1600x1200:5:12',
+        '4000x3000:12:4', '4000x3000:40:8', '4000x3000:12:20',
+        '6000x4000:30:8', '8000x6000:60:8', '10000x7000:80:8',
+    ],
+}
+
+# Diferença relativa da mediana a partir da qual --compare aponta regressão
+DEFAULT_TOLERANCE = 0.10
+
+
+def parse_scenario(spec):
+    size, leaves, noise = spec.split(':')
+    width, height = (int(v) for v in size.lower().split('x'))
+    return {"name": spec, "width": width, "height": height, "leaves": int(leaves), "noise": float(noise)}
+
+
+def make_sheet(width, height, leaves, noise, seed=0, holes=False, shapes=None):
+    """Gera uma folha sintética (BGR) com um quadrado de referência e `leaves` folhas.
+
+    As folhas são elipses com o contorno levemente ondulado, em tons de verde, distribuídas em
+    uma grade para não se tocarem. O ruído gaussiano imita a textura do papel e do sensor.
+    holes=True faz um furo redondo no centro de cada folha (como um dano de inseto). shapes,
+    se informada, recebe o que foi desenhado: ("square", (x0, y0, x1, y1)) e, por folha,
+    ("leaf", polígono, (centro, raio) do furo ou None).
+    """
+    rng = np.random.default_rng(seed)
+    image = np.full((height, width, 3), 238, np.uint8)
+
+    # Quadrado de referência no canto superior esquerdo (lado ~1/12 do menor lado da folha)
+    side = max(40, min(width, height) // 12)
+    margin = side // 2
+    cv2.rectangle(image, (margin, margin), (margin + side, margin + side), (25, 25, 25), -1)
+    if shapes is not None:
+        shapes.append(("square", (margin, margin, margin + side, margin + side)))
+
+    # Grade de células à direita do quadrado, uma folha por célula
+    left = 2 * margin + side
+    cols = max(1, int(np.ceil(np.sqrt(leaves * (width - left) / height))))
+    rows = max(1, int(np.ceil(leaves / cols)))
+    cell_w, cell_h = (width - left - margin) / cols, (height - 2 * margin) / rows
+    angles = np.linspace(0, 2 * np.pi, 180, endpoint=False)
+    for i in range(leaves):
+        r, c = divmod(i, cols)
+        cx = left + (c + 0.5) * cell_w + rng.uniform(-0.05, 0.05) * cell_w
+        cy = margin + (r + 0.5) * cell_h + rng.uniform(-0.05, 0.05) * cell_h
+        half = 0.42 * min(cell_w, cell_h)
+        a = half * rng.uniform(0.7, 1.0)
+        b = a * rng.uniform(0.25, 0.6)
+        wobble = 1 + 0.04 * np.sin(angles * rng.integers(3, 9) + rng.uniform(0, np.pi))
+        theta = rng.uniform(0, np.pi)
+        x = a * wobble * np.cos(angles)
+        y = b * wobble * np.sin(angles)
+        pts = np.stack([cx + x * np.cos(theta) - y * np.sin(theta), cy + x * np.sin(theta) + y * np.cos(theta)], axis=1)
+        color = (int(rng.integers(20, 60)), int(rng.integers(90, 140)), int(rng.integers(20, 60)))
+        polygon = np.round(pts).astype(np.int32)
+        cv2.fillPoly(image, [polygon], color)
+        hole = None
+        if holes:
+            hole = ((int(round(cx)), int(round(cy))), max(3, int(b * 0.35)))
+            cv2.circle(image, hole[0], hole[1], (238, 238, 238), -1)
+        if shapes is not None:
+            shapes.append(("leaf", polygon, hole))
+
+    if noise > 0:
+        # Em blocos de linhas, para não alocar uma cópia em ponto flutuante da imagem inteira
+        for y0 in range(0, height, 512):
+            block = image[y0:y0 + 512]
+            block[:] = np.clip(block + rng.normal(0, noise, block.shape), 0, 255).astype(np.uint8)
+    return image
+
+
+def percentiles(samples):
+    ms = np.asarray(samples) * 1000
+    return {
+        "n": len(samples),
+        "meanMs": round(float(ms.mean()), 3),
+        "p50Ms": round(float(np.percentile(ms, 50)), 3),
+        "p90Ms": round(float(np.percentile(ms, 90)), 3),
+        "p99Ms": round(float(np.percentile(ms, 99)), 3),
+        "minMs": round(float(ms.min()), 3),
+    }
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux informa em KiB, macOS em bytes
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def time_target(fn, repeat, warmup):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def time_concurrent(pool, fn, args, concurrency, repeat, warmup):
+    # Rodadas de `concurrency` trabalhos submetidos juntos; devolve a latência de cada trabalho
+    # (da submissão da rodada até o trabalho terminar) e o tempo total das rodadas medidas
+    samples = []
+    elapsed = 0.0
+    for round_index in range(warmup + repeat):
+        start = time.perf_counter()
+        futures = [pool.submit(fn, *args, block=True) for _ in range(concurrency)]
+        latencies = []
+        for future in as_completed(futures):
+            pool.wait(future)
+            latencies.append(time.perf_counter() - start)
+        if round_index >= warmup:
+            samples.extend(latencies)
+            elapsed += time.perf_counter() - start
+    return samples, elapsed
+
+
+def run_scenario(scenario, targets, repeat, warmup, seed, pool_settings=None):
+    """Executado em um processo novo; devolve o resultado do cenário."""
+    # Sem o log legível por análise: os prints custariam tempo e poluiriam a saída
+    os.environ['LIMA_VERBOSE_LOG'] = '0'
+    import python_service
+    python_service.VERBOSE_LOG = False
+
+    image = make_sheet(scenario["width"], scenario["height"], scenario["leaves"], scenario["noise"], seed)
+    ok, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 92])
+    if not ok:
+        raise RuntimeError("Falha ao codificar a imagem sintética")
+    base64_image = base64.b64encode(encoded).decode('ascii')
+    megapixels = scenario["width"] * scenario["height"] / 1e6
+    baseline_rss = peak_rss_mb()
+
+    result = dict(scenario, megapixels=round(megapixels, 2), jpegBytes=int(encoded.nbytes), targets={})
+
+    squares, leaves, _ = find_objects(image)
+    result["detectedLeaves"] = len(leaves)
+    result["detectedSquares"] = len(squares)
+
+    measured = {}
+    if 'find_objects' in targets:
+        measured['find_objects'] = time_target(lambda: find_objects(image), repeat, warmup)
+    if 'measure' in targets:
+        # Só a etapa de medição (áreas, perímetros e PCA), lida das medições por etapa
+        samples = []
+        for i in range(warmup + repeat):
+            with instrumentation.collect() as timings:
+                measure_image(image)
+            if i >= warmup:
+                samples.append(timings.stages.get("areasPerimeters", 0.0) + timings.stages.get("pca", 0.0))
+        measured['measure'] = samples
+    if 'analyze_image' in targets:
+        stage_totals = {}
+        def analyze():
+            with instrumentation.collect() as timings:
+                analyze_image(base64_image, 1.0)
+            for name, seconds in timings.stages.items():
+                stage_totals[name] = stage_totals.get(name, 0.0) + seconds
+        measured['analyze_image'] = time_target(analyze, repeat, warmup)
+        runs = repeat + warmup
+        result["stagesMs"] = {name: round(seconds * 1000 / runs, 3) for name, seconds in stage_totals.items()}
+    if 'http_analyze' in targets:
+        os.environ.setdefault('LIMA_WORKERS', '1')
+        os.environ['LIMA_CACHE_ENTRIES'] = '0'
+        import server
+        client = server.app.test_client()
+        payload = {"base64_image": base64_image, "real_area_square": 1.0}
+        def post():
+            response = client.post('/analyze', json=payload)
+            # Uma resposta de erro seria "rápida" e mascararia o tempo real
+            if response.status_code != 200 or "error" in response.get_json():
+                raise RuntimeError(f"/analyze falhou: {response.status_code} {response.get_data(as_text=True)[:200]}")
+        try:
+            measured['http_analyze'] = time_target(post, repeat, warmup)
+        finally:
+            server.pool.shutdown()
+    throughput = {}
+    if 'pool_analyze' in targets:
+        from worker_pool import AnalysisPool
+        settings = pool_settings or {}
+        concurrency = settings.get("concurrency", 1)
+        pool = AnalysisPool(workers=settings.get("workers"), max_pending=concurrency, job_timeout=None,
+                            cv2_threads=settings.get("cv2Threads"), blas_threads=settings.get("blasThreads"))
+        result["pool"] = {"workers": pool.workers, "cv2Threads": pool.cv2_threads,
+                          "blasThreads": pool.blas_threads, "concurrency": concurrency}
+        try:
+            samples, elapsed = time_concurrent(pool, analyze_image_bytes, (encoded.tobytes(), 1.0), concurrency,
+                                               repeat, max(warmup, 1))
+        finally:
+            pool.shutdown()
+        measured['pool_analyze'] = samples
+        throughput['pool_analyze'] = len(samples) / elapsed
+
+    for name, samples in measured.items():
+        stats = percentiles(samples)
+        mean_s = stats["meanMs"] / 1000
+        # Com trabalhos simultâneos a vazão não é o inverso da latência média
+        images_per_sec = throughput.get(name, 1 / mean_s if mean_s > 0 else None)
+        stats["imagesPerSec"] = round(images_per_sec, 3) if images_per_sec else None
+        stats["megapixelsPerSec"] = round(megapixels * images_per_sec, 2) if images_per_sec else None
+        result["targets"][name] = stats
+
+    result["peakRssMb"] = peak_rss_mb()
+    result["peakRssAboveStartMb"] = round(result["peakRssMb"] - baseline_rss, 1)
+    return result
+
+
+def environment():
+    # Com alterações não commitadas o commit ganha o sufixo -dirty (ex.: 3c281ec-dirty): o
+    # resultado não é do código daquele commit
+    try:
+        commit = subprocess.run(['git', 'describe', '--always', '--dirty', '--abbrev=7'], capture_output=True,
+                                text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+                                timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "timestamp": datetime.datetime.now().isoformat(timespec='seconds'),
+        "gitCommit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "opencvThreads": cv2.getNumThreads(),
+        "cpuCount": os.cpu_count(),
+        "availableCpus": available_cpus(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+    }
+
+
+def compare(current, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Compara as medianas com um resultado anterior; devolve a lista de regressões."""
+    previous = {s["name"]: s for s in baseline["scenarios"]}
+    regressions = []
+    print(f"\nComparação com {baseline['environment'].get('gitCommit')} ({baseline['environment'].get('timestamp')}):")
+    for scenario in current["scenarios"]:
+        old = previous.get(scenario["name"])
+        if old is None:
+            continue
+        for target, stats in scenario["targets"].items():
+            old_stats = old["targets"].get(target)
+            if not old_stats or not old_stats["p50Ms"]:
+                continue
+            change = stats["p50Ms"] / old_stats["p50Ms"] - 1
+            flag = ''
+            if change > tolerance:
+                flag = '  <-- REGRESSÃO'
+                regressions.append((scenario["name"], target, change))
+            print(f"  {scenario['name']:<20} {target:<14} {old_stats['p50Ms']:>10.2f} -> {stats['p50Ms']:>10.2f} ms ({change:+.1%}){flag}")
+        if old.get("detectedLeaves") != scenario.get("detectedLeaves"):
+            print(f"  {scenario['name']:<20} folhas detectadas: {old.get('detectedLeaves')} -> {scenario.get('detectedLeaves')}  <-- MUDOU")
+            regressions.append((scenario["name"], "detectedLeaves", None))
+    return regressions
+
+
+def print_report(results):
+    print(f"\n{'cenário':<20} {'MP':>6} {'folhas':>7} {'alvo':<14} {'p50 ms':>10} {'p90 ms':>10} {'p99 ms':>10} {'img/s':>8} {'MP/s':>8} {'RSS MB':>8}")
+    for s in results["scenarios"]:
+        for target, t in s["targets"].items():
+            print(f"{s['name']:<20} {s['megapixels']:>6} {s['detectedLeaves']:>3}/{s['leaves']:<3} {target:<14} "
+                  f"{t['p50Ms']:>10.2f} {t['p90Ms']:>10.2f} {t['p99Ms']:>10.2f} {t['imagesPerSec']:>8.2f} "
+                  f"{t['megapixelsPerSec']:>8.1f} {s['peakRssMb']:>8.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark do pipeline de análise de folhas (L.I.M.A.)")
+    parser.add_argument('--preset', choices=sorted(PRESETS), default='quick')
+    parser.add_argument('--scenario', action='append', help="LARGURAxALTURA:FOLHAS:RUÍDO (pode repetir; substitui o preset)")
+    parser.add_argument('--targets', default=','.join(DEFAULT_TARGETS), help=f"alvos separados por vírgula: {', '.join(TARGETS)}")
+    parser.add_argument('--repeat', type=int, default=10, help="medições por alvo (padrão: 10)")
+    parser.add_argument('--warmup', type=int, default=1, help="execuções descartadas antes de medir (padrão: 1)")
+    parser.add_argument('--seed', type=int, default=0, help="semente das folhas sintéticas (padrão: 0)")
+    parser.add_argument('--out', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks'),
+                        help="diretório onde o resultado JSON é gravado (padrão: benchmarks/ ao lado deste script)")
+    parser.add_argument('--concurrency', type=int, default=4, help="pool_analyze: análises simultâneas (padrão: 4)")
+    parser.add_argument('--workers', type=int, default=None, help="pool_analyze: processos do pool (padrão: automático)")
+    parser.add_argument('--cv2-threads', type=int, default=None, help="pool_analyze: threads do OpenCV por processo")
+    parser.add_argument('--blas-threads', type=int, default=None, help="pool_analyze: threads do BLAS por processo")
+    parser.add_argument('--compare', help="resultado anterior (JSON) para comparar as medianas")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help="aumento relativo da mediana tolerado (padrão: 0.10)")
+    args = parser.parse_args(argv)
+
+    targets = [t.strip() for t in args.targets.split(',') if t.strip()]
+    unknown = set(targets) - set(TARGETS)
+    if unknown:
+        parser.error(f"alvos desconhecidos: {', '.join(sorted(unknown))}")
+    scenarios = [parse_scenario(s) for s in (args.scenario or PRESETS[args.preset])]
+
+    pool_settings = {"workers": args.workers, "cv2Threads": args.cv2_threads, "blasThreads": args.blas_threads,
+                     "concurrency": args.concurrency}
+    results = {"environment": environment(), "settings": {"repeat": args.repeat, "warmup": args.warmup,
+               "seed": args.seed, "targets": targets, "pool": pool_settings}, "scenarios": []}
+    # Um processo novo por cenário: o pico de RSS não acumula os cenários anteriores. O
+    # ProcessPoolExecutor (e não multiprocessing.Pool) porque o alvo http_analyze cria o pool de
+    # processos do servidor, e processos 'daemon' não podem ter filhos.
+    context = multiprocessing.get_context('spawn')
+    for scenario in scenarios:
+        print(f"Cenário {scenario['name']}...", file=sys.stderr, flush=True)
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as worker:
+            results["scenarios"].append(
+                worker.submit(run_scenario, scenario, targets, args.repeat, args.warmup, args.seed,
+                              pool_settings).result())
+
+    print_report(results)
+
+    os.makedirs(args.out, exist_ok=True)
+    stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+    path = os.path.join(args.out, f"benchmark-{stamp}-{results['environment']['gitCommit'] or 'local'}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print(f"\nResultado gravado em {path}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regressões acima de {args.tolerance:.0%}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,91 @@
+# contour_vectors.py
+# Contornos das folhas e dos quadrados como polilinhas simplificadas, para o cliente desenhar a
+# imagem processada por conta própria (como o drawContoursAndLabelsOnImage do aplicativo) em vez
+# de receber o PNG anotado de vários MB em "processedImage".
+#
+# Cada contorno é simplificado com cv2.approxPolyDP (tolerância em pixels) e enviado em um dos
+# formatos:
+#   'points'  [x0, y0, x1, y1, ...] em coordenadas absolutas (o "contour" do LeafMetric do app);
+#   'delta'   [x0, y0, x1 - x0, y1 - y0, ...]: o primeiro ponto absoluto e depois as diferenças
+#             entre pontos seguidos, números pequenos que ocupam poucos dígitos no JSON;
+#   'packed'  os mesmos valores do 'delta' em binário little-endian (int16, ou int32 em imagens
+#             com mais de 32767 pixels de lado), em base64: no cliente,
+#             new Int16Array(bytes.buffer) seguido de v[i] += v[i - 2] para i >= 2.
+# As coordenadas são as da imagem decodificada (a original, exceto com decode_max_side), a
+# mesma em que a imagem processada seria desenhada.
+import base64
+
+import cv2
+import numpy as np
+
+from instrumentation import stage
+
+CONTOUR_FORMATS = ('none', 'points', 'delta', 'packed')
+# Tolerância padrão do approxPolyDP: 1 pixel fica abaixo da espessura da linha desenhada
+DEFAULT_CONTOUR_EPSILON = 1.0
+
+_INT16 = np.iinfo(np.int16)
+
+
+def simplify(contour, epsilon=DEFAULT_CONTOUR_EPSILON):
+    """Pontos (N x 2, int32) do contorno simplificado; epsilon 0 mantém todos os pontos."""
+    contour = np.asarray(contour)
+    if contour.dtype != np.int32:
+        contour = np.round(contour).astype(np.int32)
+    if epsilon > 0 and len(contour) > 2:
+        contour = cv2.approxPolyDP(contour, epsilon, True)
+    return contour.reshape(-1, 2)
+
+
+def delta_encode(points):
+    # O primeiro ponto fica absoluto; os seguintes viram a diferença para o anterior
+    deltas = points.astype(np.int32)
+    deltas[1:] -= points[:-1]
+    return deltas.ravel()
+
+
+def delta_decode(values):
+    """Inverso de delta_encode: os pontos absolutos (N x 2) a partir dos valores planos."""
+    return np.cumsum(np.asarray(values, np.int64).reshape(-1, 2), axis=0)
+
+
+def _pack(values, dtype):
+    return base64.b64encode(values.astype(dtype).tobytes()).decode('ascii')
+
+
+def contour_vectors(measurements, fmt='delta', epsilon=None):
+    """Contornos das folhas e dos quadrados de um PixelMeasurements no formato fmt.
+
+    Devolve {"format", "epsilon", "leaves": [...], "squares": [...]}, com um item por folha
+    (na ordem dos ids) e por quadrado (na ordem de "referenceSquares"); no formato 'packed'
+    também "dtype" ('int16' ou 'int32').
+    """
+    if fmt not in CONTOUR_FORMATS or fmt == 'none':
+        raise ValueError(f"Formato de contornos inválido: {fmt}")
+    epsilon = DEFAULT_CONTOUR_EPSILON if epsilon is None else float(epsilon)
+    if epsilon < 0:
+        raise ValueError("'contour_epsilon' não pode ser negativo")
+
+    with stage("contourVectors"):
+        groups = {name: [simplify(c, epsilon) for c in contours]
+                  for name, contours in (("leaves", measurements.leaves), ("squares", measurements.squares))}
+        vectors = {"format": fmt, "epsilon": epsilon}
+        if fmt == 'points':
+            for name, polylines in groups.items():
+                vectors[name] = [points.ravel().tolist() for points in polylines]
+            return vectors
+
+        encoded = {name: [delta_encode(points) for points in polylines] for name, polylines in groups.items()}
+        if fmt == 'delta':
+            for name, polylines in encoded.items():
+                vectors[name] = [values.tolist() for values in polylines]
+            return vectors
+
+        # int16 enquanto todos os valores couberem (imagens de até 32767 pixels de lado)
+        values = [v for polylines in encoded.values() for v in polylines if len(v)]
+        fits = all(_INT16.min <= v.min() and v.max() <= _INT16.max for v in values)
+        dtype = '<i2' if fits else '<i4'
+        vectors["dtype"] = 'int16' if fits else 'int32'
+        for name, polylines in encoded.items():
+            vectors[name] = [_pack(v, dtype) for v in polylines]
+        return vectors
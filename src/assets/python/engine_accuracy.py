@@ -0,0 +1,131 @@
+# engine_accuracy.py
+# Compara as medidas dos modos de detecção com a verdade das folhas sintéticas do benchmark.
+#
+# Uso:
+#   python engine_accuracy.py                                # cenários padrão, com e sem furos
+#   python engine_accuracy.py --scenario 4000x3000:40:8 --engines full,components
+#
+# A área verdadeira de cada folha é a dos pixels desenhados (o polígono preenchido, menos o
+# furo), convertida em cm² pelo quadrado de referência desenhado (lado + 1 pixels), com
+# real_area_square = 1. Cada folha detectada é associada à folha desenhada que contém o centro
+# do seu retângulo envolvente; detecções a mais na mesma folha (o contorno de um furo, no modo
+# 'full') contam como "extras" e entram na área total, como na resposta da análise.
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from benchmark import environment, make_sheet, parse_scenario
+from python_service import DETECTION_MODES, calibrate, measure_image
+
+DEFAULT_SCENARIOS = ['1600x1200:5:4', '4000x3000:12:8', '4000x3000:40:8', '4000x3000:40:40', '4000x3000:40:70']
+
+
+def true_areas(shapes, height, width):
+    # Área de cada folha em cm², pelos pixels desenhados por make_sheet
+    x0, y0, x1, y1 = next(shape[1] for shape in shapes if shape[0] == "square")
+    square_px = (x1 - x0 + 1) * (y1 - y0 + 1)
+    areas = []
+    canvas = np.zeros((height, width), np.uint8)
+    for kind, *shape in shapes:
+        if kind != "leaf":
+            continue
+        polygon, hole = shape
+        x, y, w, h = cv2.boundingRect(polygon)
+        canvas[y:y + h, x:x + w] = 0
+        cv2.fillPoly(canvas, [polygon], 1)
+        if hole is not None:
+            cv2.circle(canvas, hole[0], hole[1], 0, -1)
+        areas.append(int(np.count_nonzero(canvas[y:y + h, x:x + w])) / square_px)
+    return areas
+
+
+def evaluate(image, shapes, engine):
+    leaves_drawn = [s[1] for s in shapes if s[0] == "leaf"]
+    truth = true_areas(shapes, *image.shape[:2])
+
+    start = time.perf_counter()
+    measurements = measure_image(image, engine)
+    seconds = time.perf_counter() - start
+    result = calibrate(measurements, 1.0, 0, verbose=False)
+
+    # Detecções por folha desenhada, da maior para a menor
+    matched = {}
+    unmatched = 0
+    for contour, leaf in zip(measurements.leaves, result["leaves"]):
+        x, y, w, h = cv2.boundingRect(contour)
+        center = (x + w / 2, y + h / 2)
+        owner = next((i for i, polygon in enumerate(leaves_drawn)
+                      if cv2.pointPolygonTest(polygon, center, False) >= 0), None)
+        if owner is None:
+            unmatched += 1
+        else:
+            matched.setdefault(owner, []).append(leaf["area"])
+
+    errors = []
+    extras = 0
+    for i, areas in matched.items():
+        areas.sort(reverse=True)
+        errors.append(areas[0] / truth[i] - 1)
+        extras += len(areas) - 1
+    errors = np.array(errors)
+    total = result["aggregatedMetrics"]["totalArea"]
+    return {
+        "engine": engine,
+        "seconds": round(seconds, 4),
+        "detected": result["numberOfLeaves"],
+        "missing": len(truth) - len(matched),
+        "extras": extras + unmatched,
+        "meanAbsErrorPct": round(float(np.abs(errors).mean()) * 100, 3) if len(errors) else None,
+        "maxAbsErrorPct": round(float(np.abs(errors).max()) * 100, 3) if len(errors) else None,
+        "biasPct": round(float(errors.mean()) * 100, 3) if len(errors) else None,
+        "totalAreaErrorPct": round((total / sum(truth) - 1) * 100, 3),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Exatidão das áreas por modo de detecção (L.I.M.A.)")
+    parser.add_argument('--scenario', action='append', help="LARGURAxALTURA:FOLHAS:RUÍDO (pode repetir)")
+    parser.add_argument('--engines', default='full,components', help="modos separados por vírgula")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks', 'engines'),
+                        help="diretório onde o resultado JSON é gravado")
+    args = parser.parse_args(argv)
+
+    engines = [e.strip() for e in args.engines.split(',') if e.strip()]
+    unknown = set(engines) - set(DETECTION_MODES)
+    if unknown:
+        parser.error(f"modos desconhecidos: {', '.join(sorted(unknown))}")
+
+    rows = []
+    for spec in args.scenario or DEFAULT_SCENARIOS:
+        scenario = parse_scenario(spec)
+        for holes in (False, True):
+            shapes = []
+            image = make_sheet(scenario["width"], scenario["height"], scenario["leaves"], scenario["noise"],
+                               args.seed, holes=holes, shapes=shapes)
+            for engine in engines:
+                row = dict(evaluate(image, shapes, engine), scenario=spec, holes=holes, leaves=scenario["leaves"])
+                rows.append(row)
+                print(f"{spec:<18} {'furos' if holes else '':<6} {engine:<11} {row['seconds'] * 1000:>8.1f} ms "
+                      f"folhas {row['detected']:>3}/{row['leaves']:<3} extras {row['extras']:>3} "
+                      f"erro médio {row['meanAbsErrorPct']:>6.2f}% máx {row['maxAbsErrorPct']:>6.2f}% "
+                      f"viés {row['biasPct']:>+6.2f}% total {row['totalAreaErrorPct']:>+7.2f}%")
+
+    os.makedirs(args.out, exist_ok=True)
+    results = {"environment": environment(), "seed": args.seed, "rows": rows}
+    stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+    path = os.path.join(args.out, f"accuracy-{stamp}-{results['environment']['gitCommit'] or 'local'}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print(f"\nResultado gravado em {path}", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,150 @@
+# frame_stream.py
+# Análise de uma sequência de quadros (câmera do celular apontada para a folha, rajada de
+# fotos). Quadros seguidos de uma cena parada quase não mudam, então em vez de repetir
+# find_objects do zero em cada um:
+#   - o limiar de Otsu do último quadro-chave é reaproveitado enquanto a cena não muda (a
+#     miniatura em cinza do quadro fica próxima da do quadro-chave);
+#   - um quadro cuja máscara binária quase não mudou em relação ao último quadro medido não é
+#     medido de novo: vale o resultado anterior;
+#   - sem quadrado de referência visível (mão na frente, borrão), a calibração do último quadro
+#     em que ele apareceu continua valendo enquanto a cena não muda.
+# A cada keyframe_interval quadros o limiar é recalculado mesmo com a cena parada.
+#
+# O estado levado de um quadro ao outro (StreamState) é pequeno e atravessa o pool de processos
+# via pickle; quem mantém o último resultado é FrameStream, no processo que recebe os quadros.
+import cv2
+import numpy as np
+
+from analysis_core import classify_contours, to_gray
+from image_source import load_image
+from instrumentation import stage
+from python_service import calibrate, measure_contours
+
+# Maior lado da miniatura em cinza que identifica a cena
+SCENE_SIDE = 64
+# Maior lado da máscara reduzida comparada entre quadros
+MASK_SIDE = 256
+# Diferença média (níveis de cinza) da miniatura a partir da qual a cena mudou
+DEFAULT_SCENE_TOLERANCE = 6.0
+# Fração da máscara reduzida que precisa mudar para o quadro ser medido de novo
+DEFAULT_MASK_TOLERANCE = 0.002
+DEFAULT_KEYFRAME_INTERVAL = 30
+
+
+class StreamState:
+    """O que um quadro precisa saber dos anteriores."""
+
+    def __init__(self):
+        self.frames = 0
+        self.threshold = None       # limiar de Otsu do último quadro-chave
+        self.scene = None           # miniatura em cinza do último quadro-chave
+        self.since_keyframe = 0
+        self.mask = None            # máscara reduzida do último quadro medido
+        self.reference = None       # (contorno, área px, perímetro px) do último quadrado de referência
+
+
+def _reduce(image, max_side):
+    # Redução por um fator inteiro (o caminho rápido do INTER_AREA: média de blocos fator x fator)
+    factor = -(-max(image.shape[:2]) // max_side)
+    if factor <= 1:
+        return image
+    return cv2.resize(image, None, fx=1 / factor, fy=1 / factor, interpolation=cv2.INTER_AREA)
+
+
+def analyze_frame(image_data, state, real_area_square=1.0, reference_index=0,
+                  scene_tolerance=DEFAULT_SCENE_TOLERANCE, mask_tolerance=DEFAULT_MASK_TOLERANCE,
+                  keyframe_interval=DEFAULT_KEYFRAME_INTERVAL):
+    """Analisa um quadro da sequência; devolve (informações do quadro, resultado ou None, estado).
+
+    O resultado é o de calibrate() (sem imagem processada) ou None quando a máscara quase não
+    mudou e o resultado do quadro anterior continua valendo. image_data é qualquer entrada de
+    image_source.load_image. state (um StreamState) é atualizado e devolvido.
+    """
+    # Só a escala de cinza é usada: JPEG/PNG são decodificados direto nela
+    with stage("imdecode"):
+        image = load_image(image_data, gray=True)
+    if image is None:
+        raise ValueError("Não foi possível decodificar o quadro")
+
+    with stage("grayscale"):
+        gray = to_gray(image)
+    scene = _reduce(gray, SCENE_SIDE)
+
+    # A cena mudou (câmera moveu, luz mudou) se a miniatura se afastou da do quadro-chave
+    scene_changed = (state.scene is None or state.scene.shape != scene.shape
+                     or float(cv2.absdiff(scene, state.scene).mean()) > scene_tolerance)
+    keyframe = scene_changed or state.since_keyframe >= keyframe_interval
+    with stage("threshold"):
+        if keyframe:
+            state.threshold, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+            state.scene = scene
+            state.since_keyframe = 0
+        else:
+            _, thresh = cv2.threshold(gray, state.threshold, 255, cv2.THRESH_BINARY_INV)
+            state.since_keyframe += 1
+    if scene_changed:
+        # A calibração de outra cena não vale mais (a distância da câmera pode ter mudado)
+        state.reference = None
+
+    mask = _reduce(thresh, MASK_SIDE)
+    mask_change = None
+    if state.mask is not None and state.mask.shape == mask.shape:
+        # Pixels da máscara reduzida que mudaram de lado (ou quase: a redução suaviza as bordas)
+        mask_change = np.count_nonzero(cv2.absdiff(mask, state.mask) > 127) / mask.size
+
+    info = {"index": state.frames, "keyframe": keyframe, "threshold": state.threshold,
+            "maskChange": mask_change, "remeasured": True, "calibrationReused": False}
+    state.frames += 1
+    if not keyframe and mask_change is not None and mask_change <= mask_tolerance:
+        info["remeasured"] = False
+        return info, None, state
+    state.mask = mask
+
+    with stage("findContours"):
+        contours, _ = cv2.findContours(thresh, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+    with stage("classification"):
+        squares, leaves = classify_contours(contours)
+    measurements = measure_contours(squares, leaves)
+
+    if measurements.squares:
+        if 0 <= reference_index < len(measurements.squares):
+            state.reference = (measurements.squares[reference_index], measurements.square_areas_px[reference_index],
+                               measurements.square_perimeters_px[reference_index])
+    elif state.reference is not None:
+        # Quadrado fora de vista com a cena parada: usa a calibração do último quadro em que apareceu
+        square, area_px, perimeter_px = state.reference
+        measurements.squares = [square]
+        measurements.square_areas_px = [area_px]
+        measurements.square_perimeters_px = [perimeter_px]
+        reference_index = 0
+        info["calibrationReused"] = True
+
+    result = calibrate(measurements, real_area_square, reference_index, verbose=False)
+    return info, result, state
+
+
+def _run_here(fn, *args):
+    return fn(*args)
+
+
+class FrameStream:
+    """Uma sequência de quadros: guarda o estado entre eles e o último resultado medido.
+
+    run(fn, *args) executa analyze_frame (ex.: no pool de processos do servidor); por padrão
+    roda no próprio processo. process() devolve {"frame": informações, "result": ...}.
+    """
+
+    def __init__(self, real_area_square=1.0, reference_index=0, run=None, scene_tolerance=DEFAULT_SCENE_TOLERANCE,
+                 mask_tolerance=DEFAULT_MASK_TOLERANCE, keyframe_interval=DEFAULT_KEYFRAME_INTERVAL):
+        self.options = (real_area_square, reference_index, scene_tolerance, mask_tolerance, keyframe_interval)
+        self.run = run or _run_here
+        self.state = StreamState()
+        self.result = None
+        self.remeasured = 0
+
+    def process(self, image_data):
+        info, result, self.state = self.run(analyze_frame, image_data, self.state, *self.options)
+        if result is not None:
+            self.result = result
+            self.remeasured += 1
+        return {"frame": info, "result": self.result}
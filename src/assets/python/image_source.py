@@ -0,0 +1,197 @@
+# image_source.py
+# Entrada de imagens para a análise sem cópias desnecessárias: caminhos de arquivo (lidos via
+# mmap), buffers JPEG/PNG em memória, TIFF sem compressão e arquivos raw (mapeados direto como
+# ndarray) e arrays já decodificados (usados como estão).
+import io
+import mmap
+import os
+
+import cv2
+import numpy as np
+
+# Fatores de redução aceitos pelo cv2.imdecode. Em JPEG a redução acontece na própria
+# decodificação (escala da DCT), então a imagem inteira nunca chega a existir na memória.
+REDUCED_DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+GRAY_DECODE_FLAGS = {
+    1: cv2.IMREAD_GRAYSCALE,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+TIFF_MAGIC = (b'II*\x00', b'MM\x00*')
+
+# Modos do PIL que podem ser usados diretamente: modo -> (canais, conversão para BGR)
+_RAW_TIFF_MODES = {
+    'L': (1, None),
+    'RGB': (3, cv2.COLOR_RGB2BGR),
+    'BGR': (3, None),
+}
+
+
+def map_file(path):
+    """Mapeia o arquivo na memória (somente leitura); o conteúdo é lido do cache de páginas do
+    sistema sob demanda, sem um buffer intermediário do tamanho do arquivo."""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def close_mapping(mapping):
+    """Fecha um arquivo mapeado com map_file, sem esperar o coletor de lixo.
+
+    As views do mapeamento (ex.: de raw_pixels) precisam ter sido soltas antes; se alguma
+    ainda estiver viva, o mapeamento fica aberto até ela ser coletada.
+    """
+    if isinstance(mapping, mmap.mmap):
+        try:
+            mapping.close()
+        except BufferError:
+            pass
+
+
+def raw_pixels(buffer, width, height, channels=3, offset=0):
+    """Pixels de um arquivo raw (8 bits, BGR ou cinza, sem cabeçalho após offset) mapeado com
+    map_file, como ndarray somente leitura sobre o próprio mapeamento."""
+    shape = (height, width, channels) if channels > 1 else (height, width)
+    count = height * width * channels
+    return np.frombuffer(buffer, np.uint8, count=count, offset=offset).reshape(shape)
+
+
+class _BufferReader(io.RawIOBase):
+    # Arquivo somente leitura sobre um buffer (mmap, bytes): o PIL lê apenas o cabeçalho,
+    # e cada leitura copia só o trecho pedido
+    def __init__(self, buffer):
+        self._view = memoryview(buffer).cast('B')
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        n = max(0, min(len(b), len(self._view) - self._pos))
+        b[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: len(self._view)}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+
+def image_size(buffer):
+    """(largura, altura) lidas do cabeçalho, sem decodificar a imagem; None se não reconhecida."""
+    # O PIL só é carregado quando necessário (TIFF ou decodificação reduzida)
+    from PIL import Image
+    try:
+        with Image.open(_BufferReader(buffer)) as im:
+            return im.size
+    except Exception:
+        return None
+
+
+def tiff_view(buffer):
+    """ndarray que referencia os pixels de um TIFF sem compressão, ou None se não for possível.
+
+    Aceita TIFF de 8 bits em cinza, RGB ou BGR, com as faixas (strips) gravadas em sequência no
+    arquivo. Em cinza (e BGR) o resultado é uma visão do buffer, sem cópia; em RGB a única cópia
+    é a conversão para a ordem BGR usada pelo OpenCV.
+    """
+    from PIL import Image
+    try:
+        with Image.open(_BufferReader(buffer)) as im:
+            width, height = im.size
+            tiles = sorted(im.tile, key=lambda t: t[1][1])
+    except Exception:
+        return None
+    if not tiles or any(t[0] != 'raw' for t in tiles):
+        return None
+
+    rawmode, stride, orientation = (tuple(tiles[0][3]) + (0, 1))[:3]
+    if rawmode not in _RAW_TIFF_MODES or stride not in (0, None) or orientation != 1:
+        return None
+    channels, conversion = _RAW_TIFF_MODES[rawmode]
+    row_bytes = width * channels
+
+    # As faixas precisam ocupar a largura toda e estar contíguas no arquivo
+    offset = tiles[0][2]
+    expected = offset
+    for _, (x0, y0, x1, y1), tile_offset, args in tiles:
+        if (x0, x1) != (0, width) or tile_offset != expected or tuple(args)[:1] != (rawmode,):
+            return None
+        expected += (y1 - y0) * row_bytes
+    if expected - offset != height * row_bytes or expected > len(buffer):
+        return None
+
+    pixels = np.frombuffer(buffer, np.uint8, count=height * row_bytes, offset=offset)
+    pixels = pixels.reshape((height, width, channels) if channels > 1 else (height, width))
+    return cv2.cvtColor(pixels, conversion) if conversion is not None else pixels
+
+
+def reduction_for(size, max_side):
+    """Maior fator de redução (2, 4 ou 8) que ainda deixa o maior lado com pelo menos max_side pixels."""
+    if not max_side or size is None:
+        return 1
+    for factor in (8, 4, 2):
+        if max(size) / factor >= max_side:
+            return factor
+    return 1
+
+
+def as_pixels(image):
+    """Valida um array já decodificado: BGR ou cinza, 8 bits. Só copia se precisar converter."""
+    if image.dtype != np.uint8:
+        raise ValueError(f"Imagem deve ter 8 bits por canal (recebido {image.dtype})")
+    if image.ndim == 3 and image.shape[2] == 1:
+        return image[:, :, 0]
+    if image.ndim == 3 and image.shape[2] == 4:
+        return cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+    if image.ndim == 2 or (image.ndim == 3 and image.shape[2] == 3):
+        return image
+    raise ValueError(f"Formato de imagem não suportado: {image.shape}")
+
+
+def load_image(source, max_side=None, gray=False):
+    """Carrega a imagem para a análise a partir de um caminho, buffer ou ndarray.
+
+    - ndarray: usado como está (BGR ou cinza, 8 bits), sem recodificação;
+    - caminho: mapeado com mmap;
+    - TIFF sem compressão: os pixels são referenciados direto no buffer (ver tiff_view);
+    - JPEG/PNG/TIFF comprimido: cv2.imdecode lendo o buffer sem cópias.
+
+    max_side permite decodificar em resolução reduzida (1/2, 1/4 ou 1/8), desde que o maior lado
+    continue com pelo menos max_side pixels. As medidas em pixels passam a ser da imagem reduzida;
+    como a calibração usa a razão com o quadrado de referência, as medidas reais se mantêm, mas
+    contornos abaixo da área mínima (amin) na imagem reduzida são descartados.
+    gray=True decodifica JPEG/PNG direto em escala de cinza (em JPEG, só o canal de luminância:
+    cerca de 1/3 mais rápido); ndarray e TIFF mapeado continuam como estão.
+    Retorna None se a imagem não puder ser decodificada.
+    """
+    if isinstance(source, np.ndarray):
+        return as_pixels(source)
+    if isinstance(source, (str, os.PathLike)):
+        source = map_file(source)
+    if len(source) == 0:
+        return None
+
+    if bytes(source[:4]) in TIFF_MAGIC:
+        pixels = tiff_view(source)
+        if pixels is not None:
+            return pixels
+
+    factor = reduction_for(image_size(source), max_side) if max_side else 1
+    flags = GRAY_DECODE_FLAGS if gray else REDUCED_DECODE_FLAGS
+    return cv2.imdecode(np.frombuffer(source, np.uint8), flags[factor])
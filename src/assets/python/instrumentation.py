@@ -0,0 +1,175 @@
+# instrumentation.py
+# Tempo gasto em cada etapa da análise (decodificação, limiar, contornos, PCA, imagem
+# processada, JSON...) e métricas no formato de texto do Prometheus para o endpoint /metrics.
+# analyze_image_bytes registra as suas medições nas que estiverem ativas (collect) na thread de
+# quem a chamou, inclusive as da etapa feita no pool; com timings=True elas também vão no
+# campo "timings" do resultado.
+import threading
+import time
+from contextlib import contextmanager
+
+_local = threading.local()
+
+
+class StageTimings:
+    """Tempos (em segundos), contagens e tamanhos (em bytes) de uma análise.
+
+    As três partes são dicts simples para atravessar o pool de processos via pickle: a etapa
+    executada no processo de trabalho devolve as suas medições, que são somadas às do servidor.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.counts = {}
+        self.sizes = {}
+
+    def merge(self, other):
+        for target, source in ((self.stages, other.stages), (self.counts, other.counts), (self.sizes, other.sizes)):
+            for name, value in source.items():
+                target[name] = target.get(name, 0) + value
+
+    def as_dict(self):
+        return {
+            "stagesMs": {name: round(seconds * 1000, 3) for name, seconds in self.stages.items()},
+            "counts": dict(self.counts),
+            "bytes": dict(self.sizes),
+        }
+
+
+def current():
+    """Medições ativas nesta thread, ou None se ninguém está coletando."""
+    return getattr(_local, 'timings', None)
+
+
+@contextmanager
+def collect(timings=None):
+    """Ativa a coleta nesta thread; stage(), count() e size() registram em timings."""
+    previous = current()
+    _local.timings = timings if timings is not None else StageTimings()
+    try:
+        yield _local.timings
+    finally:
+        _local.timings = previous
+
+
+@contextmanager
+def stage(name):
+    # Sem coleta ativa o custo é só o da verificação
+    timings = current()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.stages[name] = timings.stages.get(name, 0.0) + time.perf_counter() - start
+
+
+def count(name, value):
+    timings = current()
+    if timings is not None:
+        timings.counts[name] = timings.counts.get(name, 0) + value
+
+
+def size(name, nbytes):
+    timings = current()
+    if timings is not None:
+        timings.sizes[name] = timings.sizes.get(name, 0) + nbytes
+
+
+# --- Métricas no formato do Prometheus ---
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join('%s="%s"' % (n, str(v).replace('\\', '\\\\').replace('"', '\\"')) for n, v in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, value=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Gauge:
+    # Valor lido no momento da coleta (ex.: estatísticas do cache)
+    def __init__(self, name, help_text, read):
+        self.name = name
+        self.help_text = help_text
+        self.read = read
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge", f"{self.name} {self.read()}"]
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # valores dos rótulos -> [contagens por faixa, soma, total]
+        self._lock = threading.Lock()
+
+    def observe(self, *label_values, value):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, (counts, total, n) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, c in zip(self.buckets, counts):
+                    cumulative += c
+                    labels = _labels(self.labels + ('le',), label_values + (repr(float(bound)),))
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _labels(self.labels + ('le',), label_values + ('+Inf',))
+                lines.append(f"{self.name}_bucket{labels} {n}")
+                lines.append(f"{self.name}_sum{_labels(self.labels, label_values)} {total}")
+                lines.append(f"{self.name}_count{_labels(self.labels, label_values)} {n}")
+        return lines
+
+
+class Registry:
+    """Conjunto de métricas expostas em /metrics."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,86 @@
+# job_store.py
+# Trabalhos assíncronos do servidor (POST /jobs): o cliente envia a imagem uma única vez,
+# recebe um id e consulta o estado depois, em vez de manter uma requisição longa aberta.
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'error'
+
+
+class JobStoreFullError(Exception):
+    """Há trabalhos demais na fila ou em execução (max_jobs)."""
+
+
+class JobStore:
+    """Estado dos trabalhos em memória, com expiração (ttl) após o término.
+
+    Cada trabalho é um dict com "status", os instantes "createdAt", "startedAt" e "finishedAt"
+    (segundos desde a época) e, ao terminar, "result" (string JSON), "image" (bytes da imagem
+    processada) e "imageMimeType". Trabalhos terminados há mais de ttl segundos são removidos;
+    se ainda assim houver mais de max_jobs, os terminados mais antigos saem primeiro. Trabalhos
+    na fila ou em execução nunca são removidos, então create() falha com JobStoreFullError
+    quando todos os max_jobs estão ativos.
+    """
+
+    def __init__(self, ttl=3600, max_jobs=256):
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict()  # id -> trabalho, do mais antigo para o mais recente
+        self._lock = threading.Lock()
+
+    def create(self, **fields):
+        now = time.time()
+        with self._lock:
+            self._purge(now)
+            if len(self._jobs) >= self.max_jobs:
+                # Abre espaço removendo os terminados mais antigos
+                for old_id in [i for i, job in self._jobs.items() if job["finishedAt"] is not None]:
+                    del self._jobs[old_id]
+                    if len(self._jobs) < self.max_jobs:
+                        break
+            if len(self._jobs) >= self.max_jobs:
+                raise JobStoreFullError(f"Limite de {self.max_jobs} trabalhos ativos atingido")
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = dict(fields, status=QUEUED, createdAt=now, startedAt=None, finishedAt=None)
+        return job_id
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            if fields.get("status") == RUNNING:
+                fields.setdefault("startedAt", time.time())
+            elif fields.get("status") in (DONE, FAILED):
+                fields.setdefault("finishedAt", time.time())
+            job.update(fields)
+
+    def get(self, job_id):
+        with self._lock:
+            self._purge(time.time())
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def _purge(self, now):
+        # Chamado com o lock; remove os trabalhos terminados há mais de ttl segundos
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job["finishedAt"] is not None and now - job["finishedAt"] > self.ttl]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job["status"]] = counts.get(job["status"], 0) + 1
+            return counts
+
+
+def job_store_from_env():
+    """Cria o armazenamento a partir de LIMA_JOB_TTL (segundos) e LIMA_MAX_JOBS."""
+    ttl = float(os.environ.get('LIMA_JOB_TTL', 3600))
+    max_jobs = int(os.environ.get('LIMA_MAX_JOBS', 256))
+    return JobStore(ttl=ttl, max_jobs=max_jobs)
@@ -2,234 +2,603 @@ import cv2
 import numpy as np
 import base64
 import json
+import os
+import re
 import sys
-from io import BytesIO
-from PIL import Image
-
-# Constantes do algoritmo original
-amin = 1000
-amax = 10000000000
-cosAngle = 0.3
-
-def cosine_angle(pt1, pt2, pt0):
-    # Usa inteiros de 64 bits para evitar o 'overflow warning'
-    dx1 = np.int64(pt1[0]) - np.int64(pt0[0])
-    dy1 = np.int64(pt1[1]) - np.int64(pt0[1])
-    dx2 = np.int64(pt2[0]) - np.int64(pt0[0])
-    dy2 = np.int64(pt2[1]) - np.int64(pt0[1])
-    
-    denominator = np.sqrt(float((dx1*dx1 + dy1*dy1) * (dx2*dx2 + dy2*dy2))) + 1e-10
-    if denominator == 0: return 1.0 # Evita divisão por zero
-    return float(dx1 * dx2 + dy1 * dy2) / denominator
-
-def find_objects(image):
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-
-    # Alinhado com o C++: Threshold de Otsu imediatamente após a conversão para escala de cinza.
-    # O valor 60 no C++ é ignorado quando THRESH_OTSU é usado, então usar 0 aqui está correto.
-    _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
-
-    # Alinhado com o C++: Usa RETR_LIST para obter todos os contornos, incluindo internos.
-    # Isso é crucial para replicar o comportamento exato do C++.
-    contours, _ = cv2.findContours(thresh, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
-
-    square = []
-    leaves = []
-
-    for cnt in contours:
-        auxper = cv2.arcLength(cnt, True)
-        approx = cv2.approxPolyDP(cnt, auxper*0.02, True)
-        auxarea = abs(cv2.contourArea(cnt))
-        # Lógica de classificação alinhada com o LIMA-Desktop original
-        if len(approx) == 4 and amin < auxarea < amax and cv2.isContourConvex(approx):
-            max_cosine = 0
-            for j in range(2, 5):
-                cosine = abs(cosine_angle(approx[j%4][0], approx[j-2][0], approx[j-1][0]))
-                max_cosine = max(max_cosine, cosine)
-            if max_cosine < cosAngle:
-                square.append(cnt) # É um quadrado
-            else:
-                leaves.append(cnt) # É uma forma de 4 lados, mas não um quadrado, então é uma folha
-        elif amin < auxarea < amax:
-            leaves.append(cnt) # Não tem 4 lados, então é uma folha
-
-    return square, leaves, thresh
 
-def analyze_image(base64_image, real_area_square=1.0):
+import instrumentation
+import serialization
+# A detecção fica no núcleo compartilhado; os nomes continuam disponíveis por este módulo
+from analysis_core import (DETECTION_MODES, TILED_AUTO_MEGAPIXELS, amax, amin, classify_contours, contour_areas,
+                           cosAngle, cosine_angle, detect_in_region, detect_objects, find_objects,
+                           find_objects_components, find_objects_tiled,
+                           max_corner_cosines, measure_leaf_pca, measure_leaves_pca, parse_roi, roi_key, to_gray)
+from contour_vectors import CONTOUR_FORMATS, contour_vectors
+from image_source import close_mapping, load_image, map_file, raw_pixels
+from instrumentation import stage
+from running_stats import LeafStats
+from serialization import LEAF_LAYOUTS
+
+# Log legível da análise no stderr (LIMA_VERBOSE_LOG=0 desliga). Em imagens com muitas folhas
+# o laço de prints custa tempo; o servidor e o processamento em lote o desligam por padrão.
+VERBOSE_LOG = os.environ.get('LIMA_VERBOSE_LOG', '1') != '0'
+
+# Formatos aceitos para a imagem processada: extensão do cv2.imencode, MIME, flag e qualidade padrão.
+# No WebP o padrão do OpenCV (100) é sem perdas, por isso a qualidade padrão é explícita.
+OVERLAY_FORMATS = {
+    'png': ('.png', 'image/png', None, None),
+    'jpeg': ('.jpg', 'image/jpeg', cv2.IMWRITE_JPEG_QUALITY, 95),
+    'webp': ('.webp', 'image/webp', cv2.IMWRITE_WEBP_QUALITY, 80),
+}
+# 'none' omite a imagem; 'deferred' também, mas o servidor guarda o upload para gerá-la depois
+OVERLAY_MODES = tuple(OVERLAY_FORMATS) + ('none', 'deferred')
+
+def render_overlay(image, squares, leaves, fmt='png', max_side=None, quality=None):
+    """Desenha os contornos sobre a imagem e a codifica; retorna o buffer codificado."""
+    ext, _, quality_flag, default_quality = OVERLAY_FORMATS[fmt]
+
+    # Reduz a imagem antes de desenhar: além de um arquivo menor, a codificação fica
+    # proporcionalmente mais barata. Os contornos são reescalados para a nova resolução.
+    with stage("overlayDraw"):
+        h, w = image.shape[:2]
+        scale = min(1.0, max_side / max(h, w)) if max_side else 1.0
+        if image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        if scale < 1.0:
+            image = cv2.resize(image, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+            leaves = [np.round(c * scale).astype(np.int32) for c in leaves]
+            squares = [np.round(c * scale).astype(np.int32) for c in squares]
+
+        if leaves:
+            cv2.polylines(image, leaves, True, (0, 0, 255), 2)
+        if squares:
+            cv2.polylines(image, squares, True, (0, 255, 0), 2)
+
+    params = []
+    if quality_flag is not None:
+        params = [quality_flag, int(quality if quality is not None else default_quality)]
+    with stage("overlayEncode"):
+        ok, buffer = cv2.imencode(ext, image, params)
+    if not ok:
+        raise ValueError(f"Falha ao codificar a imagem processada como {fmt}")
+    instrumentation.size("overlay", buffer.nbytes)
+    return buffer
+
+def render_overlay_bytes(image_data, fmt='png', max_side=None, quality=None, measurements=None, detection='full',
+                         decode_max_side=None, roi=None, analysis_max_side=None):
+    """Gera somente a imagem processada a partir dos bytes originais (usado no modo 'deferred').
+
+    Se as medidas da imagem já estiverem em cache, os contornos são reaproveitados e a detecção
+    não é refeita.
+    """
+    with stage("imdecode"):
+        image = load_image(image_data, decode_max_side)
+    if image is None:
+        return None
+    if measurements is None:
+        squares, leaves, region = detect_in_region(image, roi, analysis_max_side, detection)
+    else:
+        squares, leaves, region = measurements.squares, measurements.leaves, measurements.region
+    image, squares, leaves = overlay_region(image, squares, leaves, region)
+    return render_overlay(drawable(image, image_data), squares, leaves, fmt, max_side, quality).tobytes()
+
+def overlay_region(image, squares, leaves, region):
+    # Com uma região de interesse, a imagem processada mostra só o recorte analisado: os contornos
+    # (nas coordenadas da imagem original) são deslocados para o recorte
+    if region is None:
+        return image, squares, leaves
+    x, y, w, h = region
+    offset = np.array([x, y], dtype=np.int32)
+    return image[y:y + h, x:x + w], [c - offset for c in squares], [c - offset for c in leaves]
+
+def drawable(image, image_data):
+    # render_overlay desenha sobre a imagem: copia quando os pixels são do chamador (ndarray
+    # recebido) ou de um arquivo mapeado somente leitura
+    if not image.flags.writeable or (isinstance(image_data, np.ndarray) and np.shares_memory(image, image_data)):
+        return image.copy()
+    return image
+
+class PixelMeasurements:
+    """Medidas de uma imagem em pixels, independentes do real_area_square.
+
+    Guarda os contornos, as áreas, os perímetros e a largura/comprimento (PCA) de cada folha,
+    além da geometria de todos os quadrados detectados. É tudo o que depende do OpenCV:
+    calibrate() converte essas medidas para cm em O(folhas), com qualquer área de referência
+    e usando qualquer um dos quadrados, sem processar a imagem novamente. region é o recorte
+    (x, y, largura, altura) analisado quando houve região de interesse ou redução.
+    """
+
+    # Medidas gravadas no cache em disco antes da região de interesse não têm o atributo
+    region = None
+
+    def __init__(self, squares, leaves, areas_px, perimeters_px, extents_px, square_areas_px, square_perimeters_px,
+                 region=None):
+        self.region = region
+        self.squares = squares
+        self.leaves = leaves
+        self.areas_px = areas_px
+        self.perimeters_px = perimeters_px
+        self.extents_px = extents_px
+        self.square_areas_px = square_areas_px
+        self.square_perimeters_px = square_perimeters_px
+
+    def reference_squares(self):
+        # Quadrados que podem ser escolhidos como referência (id = índice + 1)
+        return [
+            {"id": i + 1, "areaPx": area, "perimeterPx": perimeter}
+            for i, (area, perimeter) in enumerate(zip(self.square_areas_px, self.square_perimeters_px))
+        ]
+
+    def calibrate(self, real_area_square=1.0, reference_index=0):
+        return calibrate(self, real_area_square, reference_index)
+
+def measure_image(image, detection='full', roi=None, analysis_max_side=None):
+    """Mede a imagem em pixels; devolve um PixelMeasurements.
+
+    roi e analysis_max_side restringem a detecção a uma região e/ou a fazem em resolução
+    reduzida (ver analysis_core.detect_in_region); as medidas são sempre em pixels da imagem.
+    """
+    # Encontrar objetos na imagem
+    squares, leaves, region, pixel_areas = detect_in_region(image, roi, analysis_max_side, detection, pixel_areas=True)
+    return measure_contours(squares, leaves, region, pixel_areas)
+
+def measure_contours(squares, leaves, region=None, pixel_areas=None):
+    """Mede em pixels os contornos já classificados; devolve um PixelMeasurements.
+
+    pixel_areas (áreas dos quadrados, áreas das folhas), do modo 'components', substitui a área
+    do polígono de cada contorno pela contagem de pixels.
+    """
+    instrumentation.count("leaves", len(leaves))
+    instrumentation.count("squares", len(squares))
+
+    with stage("areasPerimeters"):
+        if pixel_areas is None:
+            areas_px = contour_areas(leaves).tolist()
+            square_areas_px = [cv2.contourArea(sq) for sq in squares]
+        else:
+            square_areas_px, areas_px = (list(group) for group in pixel_areas)
+        # Usar o contorno original (não suavizado) para todas as medições garante consistência.
+        perimeters_px = [cv2.arcLength(leaf, True) for leaf in leaves]
+        square_perimeters_px = [cv2.arcLength(sq, True) for sq in squares]
+    with stage("pca"):
+        # Largura/comprimento em pixels de todas as folhas de uma vez (mesmo resultado de measure_leaf_pca)
+        extents_px = measure_leaves_pca(leaves)
+
+    return PixelMeasurements(
+        squares=squares,
+        leaves=leaves,
+        areas_px=areas_px,
+        perimeters_px=perimeters_px,
+        extents_px=extents_px,
+        square_areas_px=square_areas_px,
+        square_perimeters_px=square_perimeters_px,
+        region=region,
+    )
+
+def measure_image_bytes(image_data, measurements=None, overlay='png', overlay_max_side=None, overlay_quality=None, detection='full',
+                        decode_max_side=None, roi=None, analysis_max_side=None):
+    """Etapa da análise que usa o OpenCV: decodifica a imagem, mede (se measurements não foi
+    informado) e gera a imagem processada pedida. image_data pode ser qualquer entrada aceita
+    por image_source.load_image (bytes, caminho, ndarray).
+
+    Retorna {"measurements": ..., "processedImage": base64 ou None, "timings": StageTimings} ou
+    {"error": ...}. É a função executada nos processos do pool; o resultado é pequeno, exceto
+    pela imagem processada. Os tempos das etapas voltam junto para o servidor somá-los aos seus.
+    """
     try:
-        # Decodificar a imagem base64
-        image_data = base64.b64decode(base64_image)
-        image = cv2.imdecode(np.frombuffer(image_data, np.uint8), cv2.IMREAD_COLOR)
+        with instrumentation.collect() as timings:
+            with stage("imdecode"):
+                image = load_image(image_data, decode_max_side)
 
-        if image is None:
-            return json.dumps({"error": "Não foi possível decodificar a imagem"})
+            if image is None:
+                return {"error": "Não foi possível decodificar a imagem"}
 
-        # Encontrar objetos na imagem
-        squares, leaves, thresh = find_objects(image)
+            if measurements is None:
+                measurements = measure_image(image, detection, roi, analysis_max_side)
 
-        # Lógica de calibração e escala
-        scaling_factor_area = 1.0
-        scaling_factor_linear = 1.0
-        if squares:
-            reference_square = squares[0]
-
-            # --- LÓGICA DE ESCALA 100% ALINHADA COM O C++ ---
-            # 1. Fator de escala LINEAR (baseado no PERÍMETRO)
-            pixels_per_square = cv2.arcLength(reference_square, True)
-            real_side_square = np.sqrt(real_area_square)
-            scaling_factor_linear = real_side_square / (pixels_per_square / 4.0)
-
-            # 2. Fator de escala de ÁREA (baseado na ÁREA DO CONTORNO)
-            pixels_area_square = cv2.contourArea(reference_square)
-            if pixels_area_square > 0:
-                scaling_factor_area = real_area_square / pixels_area_square
-        else:
-            print("AVISO: Nenhum quadrado de referência foi detectado. Todas as formas são tratadas como folhas.", file=sys.stderr)
-
-        # Calcular métricas para cada folha (após a calibração)
-        leaf_metrics = []
-        all_areas_cm = []
-        all_perimeters_cm = []
-        all_widths_cm = []
-        all_lengths_cm = []
-        all_ratios = []
-
-        # Ordenar folhas por área (da maior para a menor) para consistência
-        # leaves.sort(key=cv2.contourArea, reverse=True) # Removido para alinhar com a lógica C++ que não ordena explicitamente aqui
-
-        for i, leaf in enumerate(leaves):
-            # Medidas em pixels
-            area_px = cv2.contourArea(leaf)
-
-            # Usar o contorno original (não suavizado) para todas as medições garante consistência.
-            perimeter_px = cv2.arcLength(leaf, True)
-
-            # CÓDIGO FINAL E CORRIGIDO
-            # --- Lógica de PCA para Largura/Comprimento (Com cálculo manual do centroide) ---
-            if len(leaf) >= 5: # PCA requer um número mínimo de pontos
-                # Usa np.float64 para corresponder ao 'double' do C++
-                data_pts = leaf.reshape(-1, 2).astype(np.float64)
-
-                manual_mean = np.mean(data_pts, axis=0)
-                _, eigenvectors, _ = cv2.PCACompute2(data_pts, mean=None)
-                
-                translated_pts = data_pts - manual_mean
-                rotated_pts = translated_pts @ eigenvectors
-                
-                # ## CORREÇÃO CRÍTICA ##
-                # Converte os pontos para float32 ANTES de passar para a função boundingRect
-                rotated_pts_for_bounding = rotated_pts.astype(np.float32)
-                x, y, w, h = cv2.boundingRect(rotated_pts_for_bounding)
-                
-                w_px, l_px = w, h
-            else: # Fallback para contornos muito pequenos
-                rect_rot = cv2.minAreaRect(leaf)
-                (w_px, l_px) = rect_rot[1]
-
-            # Aplica o fator de escala linear (calculado via perímetro para alinhar com o C++)
-            area_cm = area_px * scaling_factor_area
-            perimeter_cm = perimeter_px * scaling_factor_linear
-            width_cm = min(w_px, l_px) * scaling_factor_linear
-            length_cm = max(w_px, l_px) * scaling_factor_linear
-            ratio = width_cm / length_cm if length_cm != 0 else 0
-
-            # Adiciona as métricas calculadas
-            all_areas_cm.append(area_cm)
-            all_perimeters_cm.append(perimeter_cm)
-            all_widths_cm.append(width_cm)
-            all_lengths_cm.append(length_cm)
-            all_ratios.append(ratio)
-
-            leaf_metrics.append({
-                "id": i + 1, # ID da folha
-                "area": round(area_cm, 4), # 4 casas decimais
-                "perimeter": round(perimeter_cm, 4), # 4 casas decimais
-                "width": round(width_cm, 4), # 4 casas decimais
-                "length": round(length_cm, 5), # 5 casas decimais
-                "widthToLengthRatio": round(ratio, 6)
-            })
-
-        # Calcular métricas agregadas
-        num_leaves = len(leaves)
-        total_area = sum(all_areas_cm)
-        avg_area = np.mean(all_areas_cm) if num_leaves > 0 else 0
-        std_area = np.std(all_areas_cm) if num_leaves > 0 else 0
-        avg_perimeter = np.mean(all_perimeters_cm) if num_leaves > 0 else 0
-        std_perimeter = np.std(all_perimeters_cm) if num_leaves > 0 else 0
-        avg_width = np.mean(all_widths_cm) if num_leaves > 0 else 0
-        std_width = np.std(all_widths_cm) if num_leaves > 0 else 0
-        avg_length = np.mean(all_lengths_cm) if num_leaves > 0 else 0
-        std_length = np.std(all_lengths_cm) if num_leaves > 0 else 0
-        avg_ratio = np.mean(all_ratios) if num_leaves > 0 else 0
-
-        # Criar resultado da análise
-        result = {
-            "numberOfLeaves": num_leaves,
-            "leaves": leaf_metrics,
-            "aggregatedMetrics": {
-                "totalArea": total_area,
-                "averageArea": avg_area,
-                "standardDeviationArea": std_area,
-                "averagePerimeter": avg_perimeter,
-                "standardDeviationPerimeter": std_perimeter,
-                "averageWidth": avg_width,
-                "standardDeviationWidth": std_width,
-                "averageLength": avg_length,
-                "standardDeviationLength": std_length,
-                "averageWidthToLengthRatio": avg_ratio
-            }
-        }
-
-        # Gerar imagem com contornos para visualização
-        for leaf in leaves:
-            cv2.polylines(image, [leaf], True, (0, 0, 255), 2)
-        for sq in squares:
-            cv2.polylines(image, [sq], True, (0, 255, 0), 2)
-
-        # Converter imagem processada para base64
-        _, buffer = cv2.imencode('.png', image)
-        processed_image_base64 = base64.b64encode(buffer).decode('utf-8')
-
-        # Adicionar imagem processada ao resultado
-        result["processedImage"] = processed_image_base64
-
-        # --- INÍCIO DO LOG PARA O TERMINAL ---
-        # Imprime um resumo legível no terminal (stderr) sem afetar a saída JSON (stdout).
-        print("--- LOG DA ANÁLISE (python_service.py) ---", file=sys.stderr)
-        print(f"Número de folhas detectadas: {num_leaves}", file=sys.stderr)
-        if squares:
-            print(f"Quadrado de referência detectado. Fator de escala linear: {scaling_factor_linear:.6f}", file=sys.stderr)
-        else:
-            print("AVISO: Nenhum quadrado de referência detectado. Medidas em pixels.", file=sys.stderr)
+            processed_image = None
+            if overlay not in ('none', 'deferred'):
+                # Converter imagem processada para base64
+                image, squares, leaves = overlay_region(image, measurements.squares, measurements.leaves, measurements.region)
+                buffer = render_overlay(drawable(image, image_data), squares, leaves, overlay, overlay_max_side, overlay_quality)
+                with stage("overlayBase64"):
+                    processed_image = base64.b64encode(buffer).decode('utf-8')
 
-        for metric in leaf_metrics:
-            print(f"\nFolha {metric['id']}:", file=sys.stderr)
-            print(f"  - Área: {metric['area']:.4f} cm²", file=sys.stderr) # 4 casas decimais
-            print(f"  - Perímetro: {metric['perimeter']:.4f} cm", file=sys.stderr) # 4 casas decimais
-            print(f"  - Largura: {metric['width']:.4f} cm", file=sys.stderr) # 4 casas decimais
-            print(f"  - Comprimento: {metric['length']:.5f} cm", file=sys.stderr) # 5 casas decimais
+        return {"measurements": measurements, "processedImage": processed_image, "timings": timings}
+
+    except Exception as e:
+        return error_payload(e)
+
+def calibrate(measurements, real_area_square=1.0, reference_index=0, verbose=None, leaf_stats=None):
+    """Converte as medidas em pixels para cm/cm² usando o quadrado de referência.
+
+    Custa O(folhas) e não usa o OpenCV, por isso pode ser repetida com outro real_area_square
+    ou outro quadrado de referência (reference_index, 0 = primeiro detectado, como no C++)
+    sem reprocessar a imagem. verbose (padrão: VERBOSE_LOG) imprime o log legível no stderr.
+    leaf_stats (um running_stats.LeafStats) acumula as medidas desta imagem às de outras,
+    para estatísticas de um lote inteiro.
+    """
+    leaves = measurements.leaves
+    has_reference = bool(measurements.squares)
+    if has_reference and not 0 <= reference_index < len(measurements.squares):
+        raise ValueError(f"Quadrado de referência inválido: {reference_index + 1} (detectados: {len(measurements.squares)})")
+
+    # Lógica de calibração e escala
+    scaling_factor_area = 1.0
+    scaling_factor_linear = 1.0
+    if has_reference:
+        # --- LÓGICA DE ESCALA 100% ALINHADA COM O C++ ---
+        # 1. Fator de escala LINEAR (baseado no PERÍMETRO)
+        pixels_per_square = measurements.square_perimeters_px[reference_index]
+        real_side_square = np.sqrt(real_area_square)
+        scaling_factor_linear = real_side_square / (pixels_per_square / 4.0)
+
+        # 2. Fator de escala de ÁREA (baseado na ÁREA DO CONTORNO)
+        pixels_area_square = measurements.square_areas_px[reference_index]
+        if pixels_area_square > 0:
+            scaling_factor_area = real_area_square / pixels_area_square
+    # Sem quadrado de referência as medidas ficam em pixels; o aviso sai no log (verbose)
+
+    # Calcular métricas para cada folha (após a calibração). As estatísticas agregadas são
+    # acumuladas na mesma passada, sem listas intermediárias
+    leaf_metrics = []
+    image_stats = LeafStats(quantiles=leaf_stats.quantiles if leaf_stats is not None else False)
+    image_stats.images = 1
+
+    # Ordenar folhas por área (da maior para a menor) para consistência
+    # leaves.sort(key=cv2.contourArea, reverse=True) # Removido para alinhar com a lógica C++ que não ordena explicitamente aqui
+
+    for i in range(len(leaves)):
+        # Medidas em pixels
+        area_px = measurements.areas_px[i]
+        perimeter_px = measurements.perimeters_px[i]
+        w_px, l_px = measurements.extents_px[i]
+
+        # Aplica o fator de escala linear (calculado via perímetro para alinhar com o C++)
+        area_cm = area_px * scaling_factor_area
+        perimeter_cm = perimeter_px * scaling_factor_linear
+        width_cm = min(w_px, l_px) * scaling_factor_linear
+        length_cm = max(w_px, l_px) * scaling_factor_linear
+        ratio = width_cm / length_cm if length_cm != 0 else 0
+
+        # Adiciona as métricas calculadas
+        image_stats.add(area_cm, perimeter_cm, width_cm, length_cm, ratio)
+
+        leaf_metrics.append({
+            "id": i + 1, # ID da folha
+            "area": round(area_cm, 4), # 4 casas decimais
+            "perimeter": round(perimeter_cm, 4), # 4 casas decimais
+            "width": round(width_cm, 4), # 4 casas decimais
+            "length": round(length_cm, 5), # 5 casas decimais
+            "widthToLengthRatio": round(ratio, 6)
+        })
+
+    if leaf_stats is not None:
+        leaf_stats.merge(image_stats)
+
+    # Criar resultado da análise
+    result = {
+        "numberOfLeaves": len(leaves),
+        "leaves": leaf_metrics,
+        "aggregatedMetrics": image_stats.aggregated_metrics(),
+        "referenceSquares": measurements.reference_squares(),
+        "referenceSquareId": reference_index + 1 if has_reference else None
+    }
+    if measurements.region is not None:
+        # Recorte analisado; os contornos e a imagem processada se referem a ele
+        x, y, w, h = measurements.region
+        result["roi"] = {"x": x, "y": y, "width": w, "height": h}
+
+    if verbose is None:
+        verbose = VERBOSE_LOG
+    if verbose:
+        print_analysis_log(result, has_reference, scaling_factor_linear)
+
+    return result
+
+def print_analysis_log(result, has_reference, scaling_factor_linear):
+    leaf_metrics = result["leaves"]
+    num_leaves = result["numberOfLeaves"]
+    total_area = result["aggregatedMetrics"]["totalArea"]
+    avg_area = result["aggregatedMetrics"]["averageArea"]
+
+    # --- INÍCIO DO LOG PARA O TERMINAL ---
+    # Imprime um resumo legível no terminal (stderr) sem afetar a saída JSON (stdout).
+    print("--- LOG DA ANÁLISE (python_service.py) ---", file=sys.stderr)
+    print(f"Número de folhas detectadas: {num_leaves}", file=sys.stderr)
+    if has_reference:
+        print(f"Quadrado de referência detectado. Fator de escala linear: {scaling_factor_linear:.6f}", file=sys.stderr)
+    else:
+        print("AVISO: Nenhum quadrado de referência detectado. Medidas em pixels.", file=sys.stderr)
+
+    for metric in leaf_metrics:
+        print(f"\nFolha {metric['id']}:", file=sys.stderr)
+        print(f"  - Área: {metric['area']:.4f} cm²", file=sys.stderr) # 4 casas decimais
+        print(f"  - Perímetro: {metric['perimeter']:.4f} cm", file=sys.stderr) # 4 casas decimais
+        print(f"  - Largura: {metric['width']:.4f} cm", file=sys.stderr) # 4 casas decimais
+        print(f"  - Comprimento: {metric['length']:.5f} cm", file=sys.stderr) # 5 casas decimais
+
+    if num_leaves > 0:
+        print("\nResultados Agregados:", file=sys.stderr)
+        print(f"  - Soma das Áreas: {total_area:.4f} cm²", file=sys.stderr) # 4 casas decimais
+        print(f"  - Média da Área: {avg_area:.4f} cm²", file=sys.stderr) # 4 casas decimais
+    print("--- FIM DO LOG ---", file=sys.stderr, flush=True)
+    # --- FIM DO LOG ---
+
+def analyze_image(base64_image, real_area_square=1.0, overlay='png', overlay_max_side=None, overlay_quality=None, cache=None, run=None, reference_index=0, detection='full',
+                  decode_max_side=None, timings=False, leaf_layout='rows', as_parts=False, roi=None, analysis_max_side=None,
+                  contours='none', contour_epsilon=None):
+    # base64_image também pode ser um ndarray já decodificado (BGR ou cinza, 8 bits): quem já
+    # tem os pixels não precisa codificar a imagem só para a análise decodificá-la de novo
+    with instrumentation.collect(instrumentation.current()):
+        if isinstance(base64_image, np.ndarray):
+            image_data = base64_image
+        else:
+            try:
+                # Decodificar a imagem base64
+                with stage("base64Decode"):
+                    image_data = base64.b64decode(base64_image)
+            except Exception as e:
+                return error_parts(e) if as_parts else error_result(e)
+        return analyze_image_bytes(image_data, real_area_square, overlay, overlay_max_side, overlay_quality, cache, run,
+                                   reference_index, detection, decode_max_side, timings, leaf_layout, as_parts, roi,
+                                   analysis_max_side, contours, contour_epsilon)
+
+def analyze_image_bytes(image_data, real_area_square=1.0, overlay='png', overlay_max_side=None, overlay_quality=None, cache=None, run=None, reference_index=0, detection='full',
+                        decode_max_side=None, timings=False, leaf_layout='rows', as_parts=False, roi=None, analysis_max_side=None,
+                        contours='none', contour_epsilon=None):
+    """Analisa uma imagem JPEG/PNG/TIFF já em bytes (sem a etapa de base64).
+
+    image_data também pode ser um buffer ou um ndarray (ver image_source.load_image). Cada opção
+    é descrita onde é implementada: overlay em OVERLAY_MODES, detection em
+    analysis_core.DETECTION_MODES, roi e analysis_max_side em analysis_core.detect_in_region,
+    leaf_layout em serialization.to_columns e contours em contour_vectors. cache é um
+    ResultCache e run(fn, *args) executa a etapa com OpenCV (por padrão neste processo).
+    Retorna a string JSON do resultado ou, com as_parts=True, a lista de partes cuja
+    concatenação é essa string; timings=True acrescenta o campo "timings".
+    """
+    with instrumentation.collect(instrumentation.current()) as collected:
+        parts = _analyze_image_bytes(image_data, real_area_square, overlay, overlay_max_side, overlay_quality,
+                                     cache, run, reference_index, detection, decode_max_side, leaf_layout, roi,
+                                     analysis_max_side, contours, contour_epsilon)
+    if timings:
+        serialization.insert_field(parts, "timings", collected.as_dict())
+    return parts if as_parts else ''.join(parts)
+
+def _analyze_image_bytes(image_data, real_area_square, overlay, overlay_max_side, overlay_quality, cache, run,
+                         reference_index, detection, decode_max_side, leaf_layout, roi, analysis_max_side, contours,
+                         contour_epsilon):
+    instrumentation.size("input", image_data.nbytes if isinstance(image_data, np.ndarray) else len(image_data))
+    if overlay not in OVERLAY_MODES:
+        return error_parts(ValueError(f"Modo de imagem processada inválido: {overlay}"))
+    if detection not in DETECTION_MODES:
+        return error_parts(ValueError(f"Modo de detecção inválido: {detection}"))
+    if leaf_layout not in LEAF_LAYOUTS:
+        return error_parts(ValueError(f"Formato das folhas inválido: {leaf_layout}"))
+    if contours not in CONTOUR_FORMATS:
+        return error_parts(ValueError(f"Formato de contornos inválido: {contours}"))
+    try:
+        check_region_options(roi, decode_max_side)
+    except ValueError as e:
+        return error_parts(e)
+
+    renders_overlay = overlay not in ('none', 'deferred')
+    overlay_key = (overlay, overlay_max_side, overlay_quality)
+    key = analysis_cache_key(cache, image_data, detection, decode_max_side, roi, analysis_max_side) if cache is not None else None
+    entry = cache.get(key) if cache is not None else None
+    if cache is not None:
+        instrumentation.count("cacheHits" if entry is not None else "cacheMisses", 1)
+
+    if entry is None or (renders_overlay and overlay_key not in entry["overlays"]):
+        measured = (run or _run_here)(measure_image_bytes, image_data, entry["measurements"] if entry else None,
+                                      overlay, overlay_max_side, overlay_quality, detection, decode_max_side, roi,
+                                      analysis_max_side)
+        if "error" in measured:
+            return [json.dumps(measured)[:-1], '}']
+        instrumentation.current().merge(measured["timings"])
+        if entry is None:
+            entry = {"measurements": measured["measurements"], "overlays": {}}
+        if renders_overlay:
+            entry["overlays"][overlay_key] = measured["processedImage"]
+        if cache is not None:
+            cache.put(key, entry, cache_entry_nbytes(entry))
 
-        if num_leaves > 0:
-            print("\nResultados Agregados:", file=sys.stderr)
-            print(f"  - Soma das Áreas: {total_area:.4f} cm²", file=sys.stderr) # 4 casas decimais
-            print(f"  - Média da Área: {avg_area:.4f} cm²", file=sys.stderr) # 4 casas decimais
-        print("--- FIM DO LOG ---", file=sys.stderr, flush=True)
-        # --- FIM DO LOG ---
+    try:
+        with stage("calibrate"):
+            result = calibrate(entry["measurements"], real_area_square, reference_index)
+        if cache is not None:
+            result["imageHash"] = key
+        if contours != 'none':
+            # Os contornos vêm das medidas (do cache, se for o caso): não precisam do pool
+            result["contours"] = contour_vectors(entry["measurements"], contours, contour_epsilon)
+        apply_leaf_layout(result, leaf_layout)
+
+        # Adicionar imagem processada ao resultado. A string base64 entra como uma parte
+        # separada da resposta, sem passar pelo codificador JSON.
+        overlay_fields = []
+        if renders_overlay:
+            overlay_fields.append(("processedImage", serialization.string_value(entry["overlays"][overlay_key])))
+            overlay_fields.append(("processedImageMimeType", serialization.string_value(OVERLAY_FORMATS[overlay][1])))
+        else:
+            result["processedImage"] = None
 
-        return json.dumps(result)
+        with stage("jsonDump"):
+            parts = serialization.object_parts(result, overlay_fields)
+        instrumentation.size("response", sum(map(len, parts)))
+        return parts
 
     except Exception as e:
-        # Adiciona um log detalhado em caso de erro para facilitar a depuração.
-        # Isso garante que, se o script falhar, a causa do erro seja impressa no terminal.
-        import traceback
-        print("--- ERRO DURANTE A EXECUÇÃO DO SCRIPT PYTHON ---", file=sys.stderr)
-        print(f"Exceção: {str(e)}", file=sys.stderr, flush=True)
-        traceback.print_exc(file=sys.stderr)
-        return json.dumps({"error": f"Erro no servidor Python: {str(e)}"})
+        return error_parts(e)
+
+def apply_leaf_layout(result, leaf_layout):
+    # 'rows' é a lista de folhas original; 'columns' troca pelas listas por campo
+    if leaf_layout == 'columns':
+        result["leaves"] = serialization.to_columns(result["leaves"])
+        result["leafLayout"] = 'columns'
+    return result
+
+def recalibrate_cached(cache, image_hash, real_area_square=1.0, reference_index=0, leaf_layout='rows'):
+    """Recalibra uma imagem já analisada, a partir das medidas em pixels guardadas no cache.
+
+    Retorna a string JSON do resultado (sem a imagem processada) ou None se a imagem não
+    estiver mais no cache.
+    """
+    entry = cache.get(image_hash) if is_cache_key(image_hash) else None
+    if entry is None:
+        return None
+    try:
+        if leaf_layout not in LEAF_LAYOUTS:
+            raise ValueError(f"Formato das folhas inválido: {leaf_layout}")
+        result = calibrate(entry["measurements"], real_area_square, reference_index)
+        result["imageHash"] = image_hash
+        apply_leaf_layout(result, leaf_layout)
+        result["processedImage"] = None
+        return serialization.dumps(result)
+    except Exception as e:
+        return error_result(e)
+
+def check_region_options(roi, decode_max_side):
+    # Valida a região; ela é dada em pixels da imagem original, então não combina com a
+    # decodificação reduzida (analysis_max_side faz a redução só dentro da região)
+    parse_roi(roi)
+    if roi is not None and decode_max_side:
+        raise ValueError("'roi' não pode ser usado com 'decode_max_side'; use 'analysis_max_side'")
+
+# Formato das chaves produzidas por analysis_cache_key: o hash blake2b de 20 bytes em hexadecimal,
+# seguido de sufixos como -4000x3000x3, -tiled, -d1600, -roi<hash> e -a2000
+CACHE_KEY_PATTERN = re.compile(r'[0-9a-f]{40}(-[a-z0-9]+)*')
+
+def is_cache_key(value):
+    return isinstance(value, str) and CACHE_KEY_PATTERN.fullmatch(value) is not None
+
+def analysis_cache_key(cache, image_data, detection='full', decode_max_side=None, roi=None, analysis_max_side=None):
+    # Os contornos do modo 'tiled' e da decodificação reduzida podem diferir um pouco dos do
+    # padrão, então cada combinação tem sua própria entrada; o padrão mantém a chave original
+    # (o hash dos bytes)
+    if isinstance(image_data, np.ndarray):
+        key = cache.key(np.ascontiguousarray(image_data)) + '-' + 'x'.join(map(str, image_data.shape))
+    else:
+        key = cache.key(image_data)
+    if detection != 'full':
+        key += f"-{detection}"
+    if decode_max_side:
+        key += f"-d{int(decode_max_side)}"
+    return key + roi_key(roi, analysis_max_side)
+
+def _run_here(fn, *args):
+    return fn(*args)
+
+def cache_entry_nbytes(entry):
+    # Tamanho aproximado de uma entrada do cache: contornos, listas de medidas e imagens processadas
+    measurements = entry["measurements"]
+    contours = measurements.squares + measurements.leaves
+    size = sum(c.nbytes for c in contours) + 64 * len(measurements.leaves)
+    size += sum(len(image) for image in entry["overlays"].values())
+    return size
+
+def error_result(e):
+    return json.dumps(error_payload(e))
+
+def error_parts(e):
+    # error_result em partes (o '}' final separado, como em serialization.object_parts)
+    return [error_result(e)[:-1], '}']
+
+def error_payload(e):
+    # Adiciona um log detalhado em caso de erro para facilitar a depuração.
+    # Isso garante que, se o script falhar, a causa do erro seja impressa no terminal.
+    import traceback
+    print("--- ERRO DURANTE A EXECUÇÃO DO SCRIPT PYTHON ---", file=sys.stderr)
+    print(f"Exceção: {str(e)}", file=sys.stderr, flush=True)
+    traceback.print_exc(file=sys.stderr)
+    return {"error": f"Erro no servidor Python: {str(e)}"}
+
+def serve_stdio(stdin=None, stdout=None):
+    """Modo persistente (--serve-stdio): um pedido por linha na entrada, um resultado por linha na saída.
+
+    Cada linha é um JSON {"id", "base64_image" ou "path", "real_area_square", "overlay",
+    "overlay_max_side", "overlay_quality", "reference_square_id", "detection", "decode_max_side",
+    "timings", "leaf_layout", "roi", "analysis_max_side", "contours", "contour_epsilon"}
+    ou simplesmente o caminho de uma imagem. Arquivos são mapeados com mmap em vez de lidos; um
+    arquivo raw sem cabeçalho é aceito com "raw_shape": [altura, largura, canais] (e "raw_offset"). Cada resposta é {"id": ..., "result": {...}}, na mesma ordem dos pedidos,
+    escrita e descarregada assim que fica pronta. O processo host paga a inicialização
+    (cv2, numpy) uma única vez; imagens repetidas são respondidas pelo cache em memória.
+    Um host que mantenha vários destes processos deve dividir os núcleos entre eles com
+    LIMA_CV2_THREADS (por padrão o OpenCV usa todos).
+    """
+    from result_cache import cache_from_env
+    from thread_budget import configure_worker, plan_from_env
+
+    _, cv2_threads, blas_threads = plan_from_env(workers=1)
+    configure_worker(cv2_threads, blas_threads)
+
+    stdin = stdin or sys.stdin
+    stdout = stdout or sys.stdout
+    cache = cache_from_env()
+
+    for line in stdin:
+        line = line.strip()
+        if not line:
+            continue
+        request_id = None
+        image_data = mapping = None
+        try:
+            if line.startswith('{'):
+                req = json.loads(line)
+                request_id = req.get('id')
+            else:
+                req = {"path": line}
+                request_id = line
+
+            if 'base64_image' in req:
+                image_data = base64.b64decode(req['base64_image'])
+            elif 'raw_shape' in req:
+                height, width, channels = (list(req['raw_shape']) + [1])[:3]
+                mapping = map_file(req['path'])
+                image_data = raw_pixels(mapping, width, height, channels, int(req.get('raw_offset', 0)))
+            elif 'path' in req:
+                image_data = mapping = map_file(req['path'])
+            else:
+                raise ValueError("Pedido sem 'base64_image' nem 'path'")
+
+            square_id = req.get('reference_square_id')
+            result = analyze_image_bytes(
+                image_data,
+                float(req.get('real_area_square', 1.0)),
+                req.get('overlay', 'png'),
+                req.get('overlay_max_side'),
+                req.get('overlay_quality'),
+                cache=cache,
+                reference_index=int(square_id) - 1 if square_id is not None else 0,
+                detection=req.get('detection', 'full'),
+                decode_max_side=req.get('decode_max_side'),
+                timings=bool(req.get('timings')),
+                leaf_layout=req.get('leaf_layout', 'rows'),
+                roi=req.get('roi'),
+                analysis_max_side=req.get('analysis_max_side'),
+                contours=req.get('contours', 'none'),
+                contour_epsilon=req.get('contour_epsilon'),
+                as_parts=True,
+            )
+        except Exception as e:
+            result = error_parts(e)
+        finally:
+            # O arquivo é desmapeado a cada pedido: um processo de longa duração não acumula
+            # mapeamentos à espera do coletor de lixo
+            image_data = None
+            close_mapping(mapping)
+
+        # O resultado já está serializado; as partes são escritas direto, sem montar uma
+        # string com a resposta inteira
+        stdout.write('{"id": %s, "result": ' % json.dumps(request_id))
+        stdout.writelines(result)
+        stdout.write('}\n')
+        stdout.flush()
 
 # Função principal para processar argumentos da linha de comando
 if __name__ == "__main__":
-    if len(sys.argv) > 1:
+    if len(sys.argv) > 1 and sys.argv[1] == '--serve-stdio':
+        serve_stdio()
+    elif len(sys.argv) > 1:
         # Ler a imagem base64 do primeiro argumento
         base64_image = sys.argv[1]
 
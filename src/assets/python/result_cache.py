@@ -0,0 +1,146 @@
+# result_cache.py
+# Cache dos resultados da análise, endereçado pelo conteúdo da imagem (hash dos bytes).
+# Reenvios da mesma foto (novas tentativas, reabertura do histórico ou apenas outro
+# real_area_square) reaproveitam as medidas em pixels sem passar pelo OpenCV novamente.
+# Cada entrada guarda as medidas e as imagens processadas já geradas (uma por formato e tamanho).
+# A chave volta ao cliente como "imageHash", que /recalibrate usa para recalibrar com outro
+# real_area_square ou quadrado de referência sem reenviar a foto (python_service.recalibrate_cached).
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+
+class ResultCache:
+    """Cache LRU limitado por número de entradas e por bytes, com camada opcional em disco.
+
+    As entradas são objetos quaisquer que possam ser serializados com pickle; o tamanho de cada
+    uma é informado por quem chama put(). Com disk_dir, toda entrada gravada também vai para
+    o disco, e uma falta na memória é procurada lá antes de ser considerada uma falta de fato.
+    Assim o cache sobrevive a reinícios do servidor e pode ser compartilhado entre processos.
+    Os arquivos são pickles: disk_dir precisa ser um diretório de confiança, gravável só pelo
+    servidor. Chaves com separadores de caminho ou '..' são recusadas (get() as trata como falta).
+    """
+
+    def __init__(self, max_entries=256, max_bytes=256 * 1024 * 1024, disk_dir=None, disk_max_entries=4096):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_entries = disk_max_entries
+        self._entries = OrderedDict()  # chave -> (entrada, tamanho)
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @staticmethod
+    def key(image_data):
+        return hashlib.blake2b(image_data, digest_size=20).hexdigest()
+
+    def get(self, key):
+        if not self.safe_key(key):
+            return None
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return item[0]
+
+        entry = self._load(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if entry is not None:
+            self._store(key, entry[0], entry[1])
+            return entry[0]
+        return None
+
+    def put(self, key, entry, size):
+        if not self.safe_key(key):
+            raise ValueError(f"Chave de cache inválida: {key!r}")
+        self._store(key, entry, size)
+        self._save(key, entry, size)
+
+    def _store(self, key, entry, size):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old[1]
+            self._entries[key] = (entry, size)
+            self._size += size
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+
+    @staticmethod
+    def safe_key(key):
+        # A chave vira nome de arquivo na camada em disco: nada de separadores nem '..', para que
+        # uma chave vinda do cliente (ex.: o imageHash de /recalibrate) não aponte para fora dela
+        return bool(isinstance(key, str) and key and '..' not in key and '/' not in key and os.sep not in key
+                and not (os.altsep and os.altsep in key) and '\0' not in key)
+
+    def _path(self, key):
+        if not self.safe_key(key):
+            raise ValueError(f"Chave de cache inválida: {key!r}")
+        return os.path.join(self.disk_dir, key + '.pkl')
+
+    def _load(self, key):
+        # O arquivo é lido com pickle, que pode executar código: o diretório do cache deve ser
+        # gravável só pelo servidor, e chaves que não são nomes de arquivo simples nem são abertas
+        if not self.disk_dir or not self.safe_key(key):
+            return None
+        try:
+            with open(self._path(key), 'rb') as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # Arquivo corrompido ou de outra versão: trata como falta
+            return None
+
+    def _save(self, key, entry, size):
+        if not self.disk_dir:
+            return
+        # Escreve em um arquivo temporário e renomeia, para que leitores nunca vejam arquivos pela metade
+        tmp_path = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump((entry, size), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self._path(key))
+        self._prune_disk()
+
+    def _prune_disk(self):
+        # Remove os arquivos menos recentes quando a camada em disco passa do limite
+        files = [f for f in os.scandir(self.disk_dir) if f.name.endswith('.pkl')]
+        if len(files) <= self.disk_max_entries:
+            return
+        files.sort(key=lambda f: f.stat().st_mtime)
+        for f in files[:len(files) - self.disk_max_entries]:
+            try:
+                os.remove(f.path)
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._size, "hits": self.hits, "misses": self.misses}
+
+
+def cache_from_env():
+    """Cria o cache a partir de LIMA_CACHE_ENTRIES, LIMA_CACHE_MB e LIMA_CACHE_DIR (camada em disco)."""
+    max_entries = int(os.environ.get('LIMA_CACHE_ENTRIES', 256))
+    max_bytes = int(float(os.environ.get('LIMA_CACHE_MB', 256)) * 1024 * 1024)
+    disk_dir = os.environ.get('LIMA_CACHE_DIR') or None
+    return ResultCache(max_entries=max_entries, max_bytes=max_bytes, disk_dir=disk_dir)
@@ -0,0 +1,187 @@
+# running_stats.py
+# Estatísticas das medidas das folhas calculadas em uma única passada (contagem, soma, média e
+# variância de Welford, mínimo e máximo, e quantis aproximados opcionais). Os acumuladores podem
+# ser combinados (merge), então servem tanto para os "aggregatedMetrics" de uma imagem quanto
+# para somar várias imagens de um lote sem guardar cada folha na memória.
+import math
+
+
+class QuantileSketch:
+    """Quantis aproximados com erro relativo limitado (relative_accuracy, padrão 1%).
+
+    Cada valor positivo cai em uma faixa logarítmica: o quantil devolvido difere do valor exato
+    em no máximo relative_accuracy (em proporção). A memória cresce com o log da amplitude dos
+    valores, não com a quantidade deles. Zeros (e valores negativos) são contados à parte.
+    """
+
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.buckets = {}  # índice da faixa -> quantidade
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, value):
+        self.count += 1
+        if value <= 0:
+            self.zero_count += 1
+            return
+        index = math.ceil(math.log(value) / self._log_gamma)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Só é possível combinar sketches com a mesma precisão")
+        for index, n in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + n
+        self.zero_count += other.zero_count
+        self.count += other.count
+
+    def quantile(self, q):
+        """Valor aproximado do quantil q (0 a 1); None se não há valores."""
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                # Ponto da faixa (gamma^(i-1), gamma^i] com o mesmo erro relativo para os dois extremos
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+
+class RunningStats:
+    """Contagem, soma, média e variância (Welford), mínimo e máximo de uma série de valores.
+
+    A variância é a populacional (como np.std, ddof=0). Com quantiles=True também mantém um
+    QuantileSketch. Dois acumuladores são combinados com merge() (fórmula de Chan et al.) sem
+    perda de precisão em relação a acumular todos os valores em um só.
+    """
+
+    QUANTILES = (0.1, 0.5, 0.9)
+
+    def __init__(self, quantiles=False):
+        self.count = 0
+        self.total = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+        self.min = None
+        self.max = None
+        self.sketch = QuantileSketch() if quantiles else None
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        delta = value - self._mean
+        self._mean += delta / self.count
+        self._m2 += delta * (value - self._mean)
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        if self.sketch is not None:
+            self.sketch.add(value)
+
+    def extend(self, values):
+        for value in values:
+            self.add(value)
+        return self
+
+    def merge(self, other):
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.count, self.total, self._mean, self._m2 = other.count, other.total, other._mean, other._m2
+            self.min, self.max = other.min, other.max
+        else:
+            count = self.count + other.count
+            delta = other._mean - self._mean
+            self._mean += delta * other.count / count
+            self._m2 += other._m2 + delta * delta * self.count * other.count / count
+            self.count = count
+            self.total += other.total
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+        if self.sketch is not None and other.sketch is not None:
+            self.sketch.merge(other.sketch)
+        return self
+
+    # Sem valores, média e desvio são 0 (como nos "aggregatedMetrics" de uma imagem sem folhas)
+    @property
+    def mean(self):
+        return self._mean if self.count else 0
+
+    @property
+    def variance(self):
+        return self._m2 / self.count if self.count else 0
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance) if self.count else 0
+
+    def quantile(self, q):
+        if self.sketch is None:
+            raise ValueError("Acumulador criado sem quantis (quantiles=True)")
+        value = self.sketch.quantile(q)
+        # O valor aproximado nunca sai do intervalo observado
+        return min(max(value, self.min), self.max) if value is not None else None
+
+    def as_dict(self):
+        summary = {"count": self.count, "total": self.total, "mean": self.mean, "std": self.std,
+                   "min": self.min, "max": self.max}
+        if self.sketch is not None:
+            for q in self.QUANTILES:
+                summary[f"p{round(q * 100)}"] = self.quantile(q)
+        return summary
+
+
+class LeafStats:
+    """Um RunningStats por medida das folhas (mesmos nomes dos campos de "leaves")."""
+
+    FIELDS = ("area", "perimeter", "width", "length", "widthToLengthRatio")
+
+    def __init__(self, quantiles=False):
+        self.quantiles = quantiles
+        self.fields = {field: RunningStats(quantiles) for field in self.FIELDS}
+        self.images = 0
+
+    @property
+    def count(self):
+        return self.fields["area"].count
+
+    def add(self, area, perimeter, width, length, ratio):
+        for field, value in zip(self.FIELDS, (area, perimeter, width, length, ratio)):
+            self.fields[field].add(value)
+
+    def merge(self, other):
+        for field in self.FIELDS:
+            self.fields[field].merge(other.fields[field])
+        self.images += other.images
+        return self
+
+    def aggregated_metrics(self):
+        """Os "aggregatedMetrics" do resultado da análise."""
+        area, perimeter, width, length, ratio = (self.fields[field] for field in self.FIELDS)
+        return {
+            "totalArea": area.total,
+            "averageArea": area.mean,
+            "standardDeviationArea": area.std,
+            "averagePerimeter": perimeter.mean,
+            "standardDeviationPerimeter": perimeter.std,
+            "averageWidth": width.mean,
+            "standardDeviationWidth": width.std,
+            "averageLength": length.mean,
+            "standardDeviationLength": length.std,
+            "averageWidthToLengthRatio": ratio.mean,
+        }
+
+    def summary(self):
+        """Resumo de várias imagens: número de imagens e de folhas e as estatísticas de cada medida."""
+        summary = {"numberOfImages": self.images, "numberOfLeaves": self.count}
+        for field in self.FIELDS:
+            summary[field] = self.fields[field].as_dict()
+        return summary
@@ -0,0 +1,87 @@
+# serialization.py
+# Serialização JSON dos resultados da análise.
+#
+# Usa o orjson quando instalado (várias vezes mais rápido e entende escalares do NumPy) e o
+# json da biblioteca padrão caso contrário; LIMA_JSON_BACKEND=json força a biblioteca padrão.
+# A resposta é montada em partes: o resultado pequeno é serializado normalmente e a string
+# base64 da imagem processada (vários MB) entra como uma parte separada, sem ser percorrida
+# pelo codificador JSON nem copiada para dentro de outra string.
+import json
+import os
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if os.environ.get('LIMA_JSON_BACKEND', 'auto') == 'json':
+    orjson = None
+
+BACKEND = 'orjson' if orjson is not None else 'json'
+
+# Campos por folha na forma colunar (leaf_layout='columns'), na ordem da forma por linhas
+LEAF_FIELDS = ("id", "area", "perimeter", "width", "length", "widthToLengthRatio")
+LEAF_LAYOUTS = ('rows', 'columns')
+
+
+def _default(obj):
+    # Escalares e arrays do NumPy para o json da biblioteca padrão
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f"Objeto do tipo {type(obj).__name__} não é serializável em JSON")
+
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+    def dumps(obj):
+        """Serializa obj em uma string JSON."""
+        return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS).decode('utf-8')
+else:
+    def dumps(obj):
+        """Serializa obj em uma string JSON."""
+        return json.dumps(obj, default=_default)
+
+
+def object_parts(obj, raw_fields=()):
+    """Serializa o dict obj em uma lista de strings cuja concatenação é o objeto JSON.
+
+    raw_fields são pares (nome, partes) acrescentados ao final do objeto sem passar pelo
+    codificador: partes é uma lista de strings que já formam um valor JSON válido (ex.:
+    ['"', base64, '"']). A string grande fica como um item da lista, então quem escreve a
+    resposta (Response do Flask, stdout) a envia sem montar uma cópia do documento inteiro.
+    """
+    head = dumps(obj)
+    parts = [head[:-1]]
+    separator = ', ' if len(head) > 2 else ''
+    for name, raw in raw_fields:
+        parts.append(f'{separator}"{name}": ')
+        parts.extend(raw)
+        separator = ', '
+    parts.append('}')
+    return parts
+
+
+def string_value(text):
+    # Partes de um valor string JSON cujo conteúdo não precisa de escape (base64, ids, URLs)
+    return ['"', text, '"']
+
+
+def insert_field(parts, name, value):
+    """Acrescenta um campo (serializado normalmente) ao objeto em partes, antes do '}' final."""
+    separator = '' if parts[0] == '{' and len(parts) == 2 else ', '
+    parts[-1:-1] = [f'{separator}"{name}": ', dumps(value)]
+    return parts
+
+
+def to_columns(leaves):
+    """Converte a lista de folhas ({"id", "area", ...} por folha) em um dict de listas.
+
+    Para muitas folhas a forma colunar é bem menor (os nomes dos campos não se repetem) e mais
+    rápida de serializar e de ler no cliente.
+    """
+    return {field: [leaf[field] for leaf in leaves] for field in LEAF_FIELDS}
@@ -1,16 +1,241 @@
 # server.py
-from flask import Flask, request, Response
+from flask import Flask, g, request, Response, stream_with_context
 from flask_cors import CORS
+import atexit
+import base64
+import functools
 import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+# O log legível de cada análise (prints no stderr) fica desligado no servidor, a menos que
+# LIMA_VERBOSE_LOG=1; os processos do pool herdam a variável
+os.environ.setdefault('LIMA_VERBOSE_LOG', '0')
 
 # Importa a função de análise do seu script principal
-from python_service import analyze_image
+import instrumentation
+from instrumentation import Counter, Gauge, Histogram, Registry, stage
+from python_service import CONTOUR_FORMATS, DETECTION_MODES, OVERLAY_FORMATS, OVERLAY_MODES, analysis_cache_key, analyze_image_bytes, apply_leaf_layout, check_region_options, error_result, is_cache_key, recalibrate_cached, render_overlay_bytes
+from serialization import LEAF_LAYOUTS, dumps, insert_field
+from frame_stream import FrameStream
+from job_store import DONE, FAILED, RUNNING, JobStoreFullError, job_store_from_env
+from result_cache import cache_from_env
+from worker_pool import JobTimeoutError, PoolFullError, PoolUnavailableError, pool_from_env
+
+# Quantidade máxima de imagens aceitas em uma única requisição de lote
+MAX_BATCH_SIZE = int(os.environ.get('LIMA_MAX_BATCH_SIZE', 500))
+# Quantos uploads ficam guardados para gerar a imagem processada depois (modo 'deferred')
+MAX_DEFERRED_OVERLAYS = int(os.environ.get('LIMA_MAX_DEFERRED_OVERLAYS', 32))
 
 app = Flask(__name__)
 # Habilita o CORS para permitir que seu app Ionic se conecte
 CORS(app)
 
+# Todas as análises rodam neste pool de processos (configurado por LIMA_WORKERS,
+# LIMA_MAX_PENDING, LIMA_JOB_TIMEOUT, LIMA_CV2_THREADS e LIMA_BLAS_THREADS), nunca na
+# thread da requisição. Uploads e imagens processadas vão e voltam por memória compartilhada
+# (LIMA_SHM*, ver shm_transport.py).
+pool = pool_from_env()
+atexit.register(pool.shutdown, False)
+
+# Medidas em pixels e imagens processadas já calculadas, pelo hash dos bytes da imagem
+# (LIMA_CACHE_ENTRIES, LIMA_CACHE_MB e, opcionalmente, LIMA_CACHE_DIR para a camada em disco).
+# O cache fica neste processo: um reenvio da mesma foto nem chega ao pool.
+cache = cache_from_env()
+
+# Trabalhos assíncronos (POST /jobs): estado em memória com expiração (LIMA_JOB_TTL,
+# LIMA_MAX_JOBS). As threads só esperam pelo pool, onde a análise de fato roda.
+jobs = job_store_from_env()
+job_executor = ThreadPoolExecutor(max_workers=pool.workers, thread_name_prefix='lima-job')
+atexit.register(job_executor.shutdown, wait=False, cancel_futures=True)
+
+# Métricas expostas em /metrics (formato de texto do Prometheus)
+metrics = Registry()
+request_seconds = metrics.register(Histogram(
+    'lima_request_duration_seconds', 'Tempo total de cada requisição', labels=('endpoint',)))
+requests_total = metrics.register(Counter(
+    'lima_requests_total', 'Requisições atendidas', labels=('endpoint', 'status')))
+stage_seconds = metrics.register(Histogram(
+    'lima_stage_duration_seconds', 'Tempo de cada etapa da análise', labels=('stage',)))
+analysis_counts = metrics.register(Counter(
+    'lima_analysis_objects_total', 'Contornos, folhas, quadrados e acertos/faltas do cache', labels=('kind',)))
+payload_bytes = metrics.register(Counter(
+    'lima_payload_bytes_total', 'Bytes de entrada, da imagem processada e das respostas', labels=('kind',)))
+metrics.register(Gauge('lima_cache_entries', 'Entradas no cache de resultados', lambda: cache.stats()["entries"]))
+metrics.register(Gauge('lima_cache_bytes', 'Bytes ocupados pelo cache de resultados', lambda: cache.stats()["bytes"]))
+metrics.register(Gauge('lima_pool_workers', 'Processos do pool de análise', lambda: pool.workers))
+metrics.register(Gauge('lima_pool_cv2_threads', 'Threads do OpenCV por processo do pool', lambda: pool.cv2_threads))
+metrics.register(Gauge('lima_pool_blas_threads', 'Threads do BLAS por processo do pool', lambda: pool.blas_threads))
+metrics.register(Gauge('lima_shm_segments', 'Segmentos de memória compartilhada do pool',
+                       lambda: pool.segments.stats()["segments"] if pool.segments is not None else 0))
+metrics.register(Gauge('lima_shm_bytes', 'Bytes dos segmentos de memória compartilhada do pool',
+                       lambda: pool.segments.stats()["bytes"] if pool.segments is not None else 0))
+metrics.register(Gauge('lima_jobs_active', 'Trabalhos assíncronos na fila ou em execução',
+                       lambda: sum(n for status, n in jobs.stats().items() if status not in (DONE, FAILED))))
+
+def observe_timings(timings):
+    # Soma as medições de uma análise às métricas agregadas
+    for name, seconds in timings.stages.items():
+        stage_seconds.observe(name, value=seconds)
+    for name, value in timings.counts.items():
+        analysis_counts.inc(name, value=value)
+    for name, value in timings.sizes.items():
+        payload_bytes.inc(name, value=value)
+
+def instrumented(view):
+    # Coleta os tempos das etapas durante a requisição (inclusive a decodificação do base64
+    # feita aqui no servidor) e os registra nas métricas
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        with instrumentation.collect() as timings:
+            response = view(*args, **kwargs)
+        observe_timings(timings)
+        return response
+    return wrapper
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+def observe_request(start, status):
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'desconhecido'
+    request_seconds.observe(endpoint, value=time.perf_counter() - start)
+    requests_total.inc(endpoint, str(status))
+
+@app.after_request
+def record_request_metrics(response):
+    # Respostas em fluxo tiram request_start de g e registram o tempo quando terminam
+    start = g.pop('request_start', None)
+    if start is not None:
+        observe_request(start, response.status_code)
+    return response
+
+def blocking_run(fn, *args):
+    # Como pool.run, mas espera por uma vaga na fila em vez de recusar (usado pelo lote)
+    return pool.wait(pool.submit(fn, *args, block=True, timeout=pool.job_timeout))
+
+def json_error(message, status, headers=None):
+    return Response(json.dumps({"error": message}), status=status, mimetype='application/json', headers=headers)
+
+# Uploads do modo 'deferred', do mais antigo para o mais recente: {id: (bytes da imagem, detecção,
+# decode_max_side, roi, analysis_max_side)}; a imagem processada precisa usar a mesma detecção,
+# resolução e região da análise
+_deferred_images = OrderedDict()
+_deferred_lock = threading.Lock()
+
+def store_deferred_image(image_data, *region_args):
+    job_id = uuid.uuid4().hex
+    with _deferred_lock:
+        _deferred_images[job_id] = (image_data,) + region_args
+        while len(_deferred_images) > MAX_DEFERRED_OVERLAYS:
+            _deferred_images.popitem(last=False)
+    return job_id
+
+def analysis_options(source):
+    # Lê as opções da análise (imagem processada, contornos, quadrado de referência e detecção) de um dict (JSON)
+    # ou MultiDict (formulário/query string). Valores de tipo errado (ex.: "reference_square_id": {})
+    # são recusados com ValueError, como os valores inválidos: viram 400 ou o erro de um item do lote
+    try:
+        return _analysis_options(source)
+    except TypeError as e:
+        raise ValueError(f"Opção com tipo inválido: {e}")
+
+def _analysis_options(source):
+    contours = source.get('contours', 'none')
+    if contours not in CONTOUR_FORMATS:
+        raise ValueError(f"'contours' deve ser um de: {', '.join(CONTOUR_FORMATS)}")
+    # Quem pede os contornos desenha a imagem no cliente: por padrão ela não é gerada
+    overlay = source.get('overlay', 'png' if contours == 'none' else 'none')
+    if overlay not in OVERLAY_MODES:
+        raise ValueError(f"'overlay' deve ser um de: {', '.join(OVERLAY_MODES)}")
+    detection = source.get('detection', 'full')
+    if detection not in DETECTION_MODES:
+        raise ValueError(f"'detection' deve ser um de: {', '.join(DETECTION_MODES)}")
+    leaf_layout = leaf_layout_option(source)
+    max_side = source.get('overlay_max_side')
+    quality = source.get('overlay_quality')
+    decode_max_side = source.get('decode_max_side')
+    decode_max_side = int(decode_max_side) if decode_max_side not in (None, '') else None
+    analysis_max_side = source.get('analysis_max_side')
+    roi = source.get('roi')
+    if isinstance(roi, str):
+        # Em formulário ou query string a região vem como JSON: roi=[x,y,w,h] ou roi=[[x,y],...]
+        try:
+            roi = json.loads(roi) if roi else None
+        except ValueError as e:
+            raise ValueError(f"'roi' não é um JSON válido: {e}")
+    check_region_options(roi, decode_max_side)
+    timings = source.get('timings', False)
+    epsilon = source.get('contour_epsilon')
+    return {
+        "overlay": overlay,
+        "overlay_max_side": int(max_side) if max_side not in (None, '') else None,
+        "overlay_quality": int(quality) if quality not in (None, '') else None,
+        "reference_index": reference_index(source),
+        "detection": detection,
+        "decode_max_side": decode_max_side,
+        # Região de interesse e redução da região antes da detecção (ver analyze_image_bytes)
+        "roi": roi,
+        "analysis_max_side": int(analysis_max_side) if analysis_max_side not in (None, '') else None,
+        # Inclui no resultado os tempos de cada etapa, contagens e tamanhos ("timings")
+        "timings": timings is True or str(timings).lower() in ('1', 'true'),
+        "leaf_layout": leaf_layout,
+        # Contornos simplificados no resultado (ver contour_vectors.py)
+        "contours": contours,
+        "contour_epsilon": float(epsilon) if epsilon not in (None, '') else None,
+    }
+
+def leaf_layout_option(source):
+    # 'columns' devolve "leaves" como listas por campo (ver serialization.to_columns)
+    leaf_layout = source.get('leaf_layout', 'rows')
+    if leaf_layout not in LEAF_LAYOUTS:
+        raise ValueError(f"'leaf_layout' deve ser um de: {', '.join(LEAF_LAYOUTS)}")
+    return leaf_layout
+
+def region_args(options):
+    # Opções que definem os contornos, na ordem de analysis_cache_key e render_overlay_bytes
+    return options["detection"], options["decode_max_side"], options["roi"], options["analysis_max_side"]
+
+def reference_index(source):
+    # "reference_square_id" segue os ids de "referenceSquares" na resposta (começa em 1)
+    square_id = source.get('reference_square_id')
+    return int(square_id) - 1 if square_id not in (None, '') else 0
+
+def run_single_analysis(image_data, scale_area, options):
+    # Executa uma análise: o cache é consultado aqui e só as faltas vão para o pool.
+    # No modo 'deferred' a imagem não é gerada agora: o upload fica guardado e o resultado
+    # informa o id para buscá-la em /analyze/<id>/image.
+    try:
+        parts = analyze_image_bytes(image_data, scale_area, cache=cache, run=pool.run, as_parts=True, **options)
+    except (PoolFullError, PoolUnavailableError, JobTimeoutError) as e:
+        return pool_error_response(e)
+
+    if options["overlay"] == 'deferred':
+        # Sem a imagem embutida o resultado é pequeno, então decodificá-lo aqui é barato
+        if "error" not in json.loads(''.join(parts)):
+            job_id = store_deferred_image(image_data, *region_args(options))
+            insert_field(parts, "overlayJobId", job_id)
+            insert_field(parts, "processedImageUrl", f"/analyze/{job_id}/image")
+
+    # A resposta é enviada parte por parte: a string base64 da imagem processada não é
+    # copiada para dentro de uma string com o documento inteiro
+    return Response(parts, status=200, mimetype='application/json')
+
+def pool_error_response(error):
+    # Converte as falhas do pool em respostas HTTP de contrapressão
+    if isinstance(error, PoolFullError):
+        return json_error(str(error), 429, headers={"Retry-After": "1"})
+    if isinstance(error, JobTimeoutError):
+        return json_error(str(error), 504)
+    return json_error(f"Serviço de análise indisponível: {error}", 503, headers={"Retry-After": "5"})
+
 @app.route('/analyze', methods=['POST'])
+@instrumented
 def analyze_endpoint():
     print("\n>>> Requisição de análise recebida do aplicativo! <<<", flush=True)
 
@@ -18,15 +243,408 @@ def analyze_endpoint():
     if not data or 'base64_image' not in data:
         return Response(json.dumps({"error": "Nenhuma imagem em base64 fornecida"}), status=400, mimetype='application/json')
 
-    base64_image = data['base64_image']
     scale_area = data.get('real_area_square', 1.0)
+    try:
+        options = analysis_options(data)
+    except ValueError as e:
+        return json_error(str(e), 400)
 
-    # A função analyze_image já retorna uma string JSON, então podemos retorná-la diretamente
-    result_json_string = analyze_image(base64_image, scale_area)
+    # Decodifica o base64 aqui: o cache usa o hash dos bytes (o mesmo de /analyze/raw) e o pool
+    # recebe ~25% menos dados do que com o texto base64
+    try:
+        with stage("base64Decode"):
+            image_data = base64.b64decode(data['base64_image'])
+    except Exception as e:
+        return Response(error_result(e), status=200, mimetype='application/json')
 
+    # A função analyze_image_bytes já retorna o JSON serializado, então podemos retorná-lo diretamente
+    return run_single_analysis(image_data, scale_area, options)
+
+@app.route('/analyze/raw', methods=['POST'])
+@instrumented
+def analyze_raw_endpoint():
+    # Recebe os bytes JPEG/PNG sem base64: multipart/form-data (campo "image") ou o corpo
+    # inteiro como application/octet-stream / image/*. A área do quadrado vem no formulário
+    # ou na query string (?real_area_square=...).
+    print("\n>>> Requisição de análise (binária) recebida do aplicativo! <<<", flush=True)
+
+    image_data, scale_area, option_source = read_binary_upload()
+    if not image_data:
+        return json_error("Nenhuma imagem fornecida", 400)
+    try:
+        options = analysis_options(option_source)
+    except ValueError as e:
+        return json_error(str(e), 400)
+
+    return run_single_analysis(image_data, scale_area, options)
+
+def read_binary_upload():
+    # Lê uma imagem enviada sem base64: multipart/form-data (campo "image") ou o corpo inteiro.
+    # Retorna (bytes ou None, real_area_square, origem das opções)
+    if request.mimetype == 'multipart/form-data':
+        upload = request.files.get('image')
+        image_data = upload.stream.read() if upload is not None else None
+        scale_area = request.form.get('real_area_square', type=float)
+        # Opções podem vir tanto nos campos do formulário quanto na query string
+        option_source = request.values
+    else:
+        # Lê o corpo uma única vez, sem guardá-lo também no cache do Werkzeug
+        image_data = request.get_data(cache=False)
+        scale_area = None
+        option_source = request.args
+    if scale_area is None:
+        scale_area = request.args.get('real_area_square', 1.0, type=float)
+    return image_data, scale_area, option_source
+
+@app.route('/recalibrate', methods=['POST'])
+def recalibrate_endpoint():
+    # Recalcula as medidas de uma imagem já analisada com outra área de referência e/ou outro
+    # quadrado de referência, usando as medidas em pixels do cache (sem reenviar a imagem).
+    # Corpo: {"imageHash": ..., "real_area_square": ..., "reference_square_id": ..., "leaf_layout": ...}
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not data.get('imageHash'):
+        return json_error("Nenhum 'imageHash' fornecido", 400)
+    if not is_cache_key(data['imageHash']):
+        # Só hashes no formato do cache chegam a ele (a chave vira nome de arquivo no disco)
+        return json_error("Imagem não encontrada no cache; envie-a novamente para /analyze", 404)
+    try:
+        scale_area = float(data.get('real_area_square', 1.0))
+        index = reference_index(data)
+        leaf_layout = leaf_layout_option(data)
+    except (TypeError, ValueError) as e:
+        return json_error(str(e), 400)
+
+    result_json_string = recalibrate_cached(cache, data['imageHash'], scale_area, index, leaf_layout)
+    if result_json_string is None:
+        return json_error("Imagem não encontrada no cache; envie-a novamente para /analyze", 404)
     return Response(result_json_string, status=200, mimetype='application/json')
 
+@app.route('/analyze/<job_id>/image', methods=['GET'])
+def deferred_image_endpoint(job_id):
+    # Gera sob demanda a imagem processada de uma análise feita com overlay='deferred'.
+    # Aceita ?format=png|jpeg|webp, ?max_side=... e ?quality=...; a resposta é a imagem binária.
+    with _deferred_lock:
+        stored = _deferred_images.get(job_id)
+    if stored is None:
+        return json_error("Imagem não encontrada ou expirada", 404)
+    image_data, *stored_region = stored
+
+    fmt = request.args.get('format', 'png')
+    if fmt not in OVERLAY_FORMATS:
+        return json_error(f"'format' deve ser um de: {', '.join(OVERLAY_FORMATS)}", 400)
+    max_side = request.args.get('max_side', type=int)
+    quality = request.args.get('quality', type=int)
+
+    # Reaproveita os contornos do cache, se a imagem ainda estiver lá
+    entry = cache.get(analysis_cache_key(cache, image_data, *stored_region))
+    measurements = entry["measurements"] if entry is not None else None
+
+    try:
+        buffer = pool.run(render_overlay_bytes, image_data, fmt, max_side, quality, measurements, *stored_region)
+    except (PoolFullError, PoolUnavailableError, JobTimeoutError) as e:
+        return pool_error_response(e)
+    if buffer is None:
+        return json_error("Não foi possível decodificar a imagem", 422)
+
+    return Response(buffer, status=200, mimetype=OVERLAY_FORMATS[fmt][1])
+
+@app.route('/analyze/batch', methods=['POST'])
+def analyze_batch_endpoint():
+    # Corpo esperado: {"images": [{"base64_image": ..., "real_area_square": ..., "id": ...}, ...]}
+    # O "real_area_square" de nível superior é usado para itens que não informam o próprio.
+    # Sem "overlay" (no lote ou no item) a imagem processada não é gerada: um PNG de vários MB por
+    # imagem multiplicado pelo lote inteiro não caberia na memória do servidor.
+    data = request.get_json(silent=True)
+    images = data.get('images') if isinstance(data, dict) else None
+    if not isinstance(images, list) or not images:
+        return json_error("Nenhuma lista de imagens fornecida", 400)
+    if len(images) > MAX_BATCH_SIZE:
+        return json_error(f"Lote excede o limite de {MAX_BATCH_SIZE} imagens", 413)
+
+    print(f"\n>>> Requisição de lote recebida: {len(images)} imagens <<<", flush=True)
+    default_area = data.get('real_area_square', 1.0)
+    data = {'overlay': 'none', **data}
+    try:
+        default_options = analysis_options(data)
+    except ValueError as e:
+        return json_error(str(e), 400)
+    if default_options["overlay"] == 'deferred':
+        return json_error("O modo 'deferred' não é suportado em lote", 400)
+
+    # Um lote mantém no máximo `pool.workers` imagens em andamento, esperando por vagas na fila
+    # em vez de recusá-las, e deixa o restante da fila livre para as requisições individuais.
+    # Imagens já presentes no cache são respondidas sem ocupar o pool.
+    @instrumented
+    def analyze_item(item):
+        # Retorna o resultado em partes (ver analyze_image_bytes com as_parts=True)
+        if not isinstance(item, dict) or 'base64_image' not in item:
+            return [json.dumps({"error": "Nenhuma imagem em base64 fornecida"})]
+        scale_area = item.get('real_area_square', default_area)
+        try:
+            # Opções do item sobrepõem as do lote
+            options = analysis_options({**data, **item})
+            if options["overlay"] == 'deferred':
+                raise ValueError("O modo 'deferred' não é suportado em lote")
+            with stage("base64Decode"):
+                image_data = base64.b64decode(item['base64_image'])
+        except ValueError as e:
+            # binascii.Error (base64 inválido) também é um ValueError
+            return [json.dumps({"error": str(e)})]
+        try:
+            return analyze_image_bytes(image_data, scale_area, cache=cache, run=blocking_run, as_parts=True, **options)
+        except (PoolFullError, PoolUnavailableError, JobTimeoutError) as e:
+            return [json.dumps({"error": str(e)})]
+        except Exception as e:
+            return [json.dumps({"error": f"Erro no servidor Python: {str(e)}"})]
+
+    def item_body(index, result_parts):
+        # Cada resultado já está serializado; as partes entram no corpo sem decodificar novamente.
+        # Erros são reportados por imagem, sem derrubar o lote inteiro.
+        item_id = images[index].get('id', index) if isinstance(images[index], dict) else index
+        yield '%s{"index": %d, "id": %s, "result": ' % (', ' if index else '', index, json.dumps(item_id))
+        yield from result_parts
+        yield '}'
+
+    # Como em /analyze/stream, o tempo da requisição é registrado quando o corpo termina
+    start = g.pop('request_start')
+
+    def generate():
+        # Os resultados são escritos na ordem das imagens assim que ficam prontos: no máximo
+        # 2 * pool.workers ficam na memória ao mesmo tempo, e não os do lote inteiro
+        try:
+            yield '{"count": %d, "results": [' % len(images)
+            with ThreadPoolExecutor(max_workers=pool.workers) as threads:
+                in_flight = deque()
+                for index, item in enumerate(images):
+                    in_flight.append((index, threads.submit(analyze_item, item)))
+                    if len(in_flight) >= 2 * pool.workers:
+                        done_index, future = in_flight.popleft()
+                        yield from item_body(done_index, future.result())
+                while in_flight:
+                    done_index, future = in_flight.popleft()
+                    yield from item_body(done_index, future.result())
+            yield ']}'
+        finally:
+            observe_request(start, 200)
+
+    return Response(stream_with_context(generate()), status=200, mimetype='application/json')
+
+def body_lines(stream, chunk_size=1 << 16):
+    # Linhas do corpo lidas em blocos, cada uma entregue assim que o '\n' chega. Iterar o
+    # request.stream diretamente lê byte a byte, lento demais para quadros de centenas de KB
+    buffer = bytearray()
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        scan = len(buffer)
+        buffer += chunk
+        start = 0
+        end = buffer.find(b'\n', scan)
+        while end != -1:
+            yield bytes(buffer[start:end])
+            start = end + 1
+            end = buffer.find(b'\n', start)
+        del buffer[:start]
+    if buffer:
+        yield bytes(buffer)
+
+def binary_frames(stream):
+    # Quadros binários: 4 bytes (big-endian) com o tamanho, seguidos dos bytes JPEG/PNG. Cada
+    # leitura pede exatamente o que falta do quadro, então ele é analisado assim que chega
+    while True:
+        header = read_exactly(stream, 4)
+        if len(header) < 4:
+            return
+        # Um quadro truncado no fim do corpo segue adiante e falha na decodificação
+        yield read_exactly(stream, int.from_bytes(header, 'big'))
+
+def read_exactly(stream, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return bytes(data)
+
+@app.route('/analyze/stream', methods=['POST'])
+def analyze_stream_endpoint():
+    # Sequência de quadros da câmera (ver frame_stream.py), enviada de uma vez ou aos poucos
+    # (Transfer-Encoding: chunked). O corpo é NDJSON, um quadro por linha ({"base64_image": ...,
+    # "id": ...}), ou, com Content-Type application/octet-stream, quadros binários precedidos do
+    # tamanho (ver binary_frames). A resposta é NDJSON, uma linha por quadro escrita assim que ele
+    # é analisado: {"index", "id", "frame": {...}, "result": {...}} ou {"index", "id", "error"}.
+    # Opções na query string: real_area_square, reference_square_id, leaf_layout,
+    # scene_tolerance, mask_tolerance e keyframe_interval.
+    #
+    # Em NDJSON o fim de uma linha só é visto quando o servidor entrega o bloco lido (o de
+    # desenvolvimento do Werkzeug espera completar 64 KB), então a resposta de um quadro pode
+    # esperar os bytes do seguinte; para a câmera ao vivo use os quadros binários ou o modo de
+    # produção (asgi_server.py), que entrega cada linha assim que ela chega.
+    print("\n>>> Sequência de quadros recebida do aplicativo! <<<", flush=True)
+    try:
+        stream, leaf_layout = frame_stream_from_args(request.args)
+    except ValueError as e:
+        return json_error(str(e), 400)
+
+    binary = request.mimetype == 'application/octet-stream'
+    frames = binary_frames(request.stream) if binary else (line for line in body_lines(request.stream) if line.strip())
+
+    # O after_request roda antes do primeiro quadro: o tempo da requisição é registrado quando o
+    # fluxo termina (ou o cliente desconecta)
+    start = g.pop('request_start')
+
+    def generate():
+        try:
+            for index, frame in enumerate(frames):
+                yield stream_frame_line(stream, index, frame, binary, leaf_layout)
+        finally:
+            observe_request(start, 200)
+
+    return Response(stream_with_context(generate()), status=200, mimetype='application/x-ndjson')
+
+def frame_stream_from_args(args):
+    # Opções de /analyze/stream na query string (MultiDict); devolve (FrameStream, leaf_layout)
+    leaf_layout = leaf_layout_option(args)
+    tolerances = {name: convert(args[name]) for name, convert in
+                  (('scene_tolerance', float), ('mask_tolerance', float), ('keyframe_interval', int)) if name in args}
+    # Os quadros de uma sequência são analisados um de cada vez, esperando por vagas no pool
+    stream = FrameStream(args.get('real_area_square', 1.0, type=float), reference_index(args), run=blocking_run,
+                         **tolerances)
+    return stream, leaf_layout
+
+def stream_frame_line(stream, index, frame, binary, leaf_layout):
+    # Analisa um quadro da sequência e devolve a sua linha NDJSON da resposta
+    frame_id = index
+    try:
+        if binary:
+            image_data = frame
+        else:
+            frame = json.loads(frame)
+            frame_id = frame.get('id', index)
+            with stage("base64Decode"):
+                image_data = base64.b64decode(frame['base64_image'])
+        output = stream.process(image_data)
+        if output["result"] is not None:
+            output["result"] = apply_leaf_layout(dict(output["result"]), leaf_layout)
+    except KeyError:
+        output = {"error": "Quadro sem 'base64_image'"}
+    except Exception as e:
+        # JSON ou base64 inválido, quadro que não decodifica, pool cheio ou indisponível:
+        # o erro é reportado neste quadro e a sequência continua
+        output = {"error": str(e)}
+    return dumps({"index": index, "id": frame_id, **output}) + '\n'
+
+@app.route('/jobs', methods=['POST'])
+def create_job_endpoint():
+    # Aceita o mesmo corpo de /analyze (JSON com base64_image) ou de /analyze/raw (bytes ou
+    # multipart) e responde 202 na hora, com o id do trabalho. A imagem é enviada uma única
+    # vez; o cliente consulta GET /jobs/<id> até o estado ser 'done' ou 'error'.
+    if request.is_json:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or 'base64_image' not in data:
+            return json_error("Nenhuma imagem em base64 fornecida", 400)
+        scale_area = data.get('real_area_square', 1.0)
+        option_source = data
+        try:
+            image_data = base64.b64decode(data['base64_image'])
+        except ValueError as e:
+            return json_error(f"Base64 inválido: {e}", 400)
+    else:
+        image_data, scale_area, option_source = read_binary_upload()
+    if not image_data:
+        return json_error("Nenhuma imagem fornecida", 400)
+
+    try:
+        options = analysis_options(option_source)
+        if options["overlay"] == 'deferred':
+            raise ValueError("Use overlay=png|jpeg|webp|none: a imagem do trabalho fica em /jobs/<id>/image")
+    except ValueError as e:
+        return json_error(str(e), 400)
+
+    try:
+        job_id = jobs.create()
+    except JobStoreFullError as e:
+        return json_error(str(e), 429, headers={"Retry-After": "5"})
+    job_executor.submit(run_job, job_id, image_data, scale_area, options)
+
+    print(f"\n>>> Trabalho {job_id} recebido <<<", flush=True)
+    body = {"jobId": job_id, "status": "queued", "statusUrl": f"/jobs/{job_id}"}
+    return Response(json.dumps(body), status=202, mimetype='application/json',
+                    headers={"Location": f"/jobs/{job_id}"})
+
+def run_job(job_id, image_data, scale_area, options):
+    # Executado nas threads de job_executor. A análise em si roda no pool (esperando por uma
+    # vaga, como no lote); a imagem processada é gerada em seguida, em binário, a partir das
+    # medidas que ficaram no cache, e guardada para GET /jobs/<id>/image.
+    jobs.update(job_id, status=RUNNING)
+    fmt = options["overlay"]
+    try:
+        with instrumentation.collect() as timings:
+            result_json_string = analyze_image_bytes(image_data, scale_area, cache=cache, run=blocking_run,
+                                                     **dict(options, overlay='none'))
+            if "error" in json.loads(result_json_string):
+                jobs.update(job_id, status=FAILED, result=result_json_string)
+                return
+            image = None
+            if fmt != 'none':
+                entry = cache.get(analysis_cache_key(cache, image_data, *region_args(options)))
+                image = blocking_run(render_overlay_bytes, image_data, fmt, options["overlay_max_side"],
+                                     options["overlay_quality"], entry["measurements"] if entry else None,
+                                     *region_args(options))
+        observe_timings(timings)
+        jobs.update(job_id, status=DONE, result=result_json_string, image=image,
+                    imageMimeType=OVERLAY_FORMATS[fmt][1] if image is not None else None)
+    except (PoolFullError, PoolUnavailableError, JobTimeoutError) as e:
+        jobs.update(job_id, status=FAILED, result=json.dumps({"error": str(e)}))
+    except Exception as e:
+        jobs.update(job_id, status=FAILED, result=error_result(e))
+
+def iso_time(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat() if timestamp is not None else None
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status_endpoint(job_id):
+    # Consulta barata: o estado do trabalho e, quando terminado, o resultado (sem a imagem
+    # processada, que fica em "processedImageUrl")
+    job = jobs.get(job_id)
+    if job is None:
+        return json_error("Trabalho não encontrado ou expirado", 404)
+
+    status = {
+        "jobId": job_id,
+        "status": job["status"],
+        "createdAt": iso_time(job["createdAt"]),
+        "startedAt": iso_time(job["startedAt"]),
+        "finishedAt": iso_time(job["finishedAt"]),
+        "processedImageUrl": f"/jobs/{job_id}/image" if job.get("image") is not None else None,
+    }
+    body = json.dumps(status)
+    if job.get("result") is not None:
+        # O resultado já é uma string JSON; é embutido sem decodificar novamente
+        body = body[:-1] + ', "result": ' + job["result"] + '}'
+    return Response(body, status=200, mimetype='application/json')
+
+@app.route('/jobs/<job_id>/image', methods=['GET'])
+def job_image_endpoint(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return json_error("Trabalho não encontrado ou expirado", 404)
+    if job["status"] not in (DONE, FAILED):
+        return json_error("Trabalho ainda em andamento", 409, headers={"Retry-After": "2"})
+    if job.get("image") is None:
+        return json_error("Este trabalho não tem imagem processada", 404)
+    return Response(job["image"], status=200, mimetype=job["imageMimeType"])
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), status=200, mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
     print(">>> Servidor de análise L.I.M.A. rodando em http://127.0.0.1:5000 <<<")
+    print(f">>> Análises executadas em {pool.workers} processos (fila máxima: {pool.max_pending}; "
+          f"{pool.cv2_threads} threads do OpenCV e {pool.blas_threads} do BLAS por processo). <<<")
     print(">>> Deixe este terminal aberto e inicie o aplicativo Ionic em outro terminal. <<<")
+    print(">>> Servidor de desenvolvimento; em produção use: python asgi_server.py <<<")
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,303 @@
+# shm_transport.py
+# Passagem de buffers grandes entre o servidor e os processos do pool por memória compartilhada
+# (multiprocessing.shared_memory), em vez de serializá-los com pickle pela fila do
+# ProcessPoolExecutor. Com pickle, os bytes JPEG/PNG do upload (ou um ndarray já decodificado) são
+# copiados para a fila, lidos pelo processo de trabalho e copiados de novo ao desserializar; a
+# imagem processada faz o mesmo caminho de volta.
+#
+# Com o transporte, o servidor grava os argumentos grandes em um segmento e só um descritor
+# pequeno (SharedBuffer: nome, posição, tamanho) atravessa a fila. O processo de trabalho lê os
+# bytes direto do segmento (memoryview / ndarray sem cópia) e grava no mesmo segmento o
+# resultado grande (bytes ou a string base64 da imagem processada), que o servidor copia uma
+# única vez para a resposta.
+#
+# Os segmentos pertencem ao servidor: são criados sob demanda até o limite de memória,
+# reaproveitados entre trabalhos e só voltam ao pool quando o trabalho termina de fato (com
+# resultado, erro ou a morte do processo), nunca quando alguém desiste de esperar por ele. Um
+# processo de trabalho que morre não deixa segmentos para trás; o servidor os remove ao
+# encerrar o pool e, se ele mesmo morrer, o resource_tracker do multiprocessing os remove.
+#
+# Variáveis de ambiente: LIMA_SHM (0 desliga), LIMA_SHM_SEGMENT_MB (tamanho de cada segmento;
+# uma foto de 12 MP com a imagem processada em PNG cabe em 32 MB), LIMA_SHM_MB (total de
+# memória compartilhada do pool) e LIMA_SHM_MIN_KB (argumentos menores seguem por pickle).
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+DEFAULT_SEGMENT_MB = 32
+DEFAULT_MIN_KB = 64
+
+
+class SharedBuffer:
+    """Descritor de um buffer dentro de um segmento: é o que atravessa a fila do pool."""
+
+    __slots__ = ('segment', 'offset', 'nbytes', 'kind', 'shape', 'dtype')
+
+    def __init__(self, segment, offset, nbytes, kind, shape=None, dtype=None):
+        self.segment = segment      # nome do segmento
+        self.offset = offset
+        self.nbytes = nbytes
+        self.kind = kind            # 'bytes', 'str' (ASCII) ou 'ndarray'
+        self.shape = shape
+        self.dtype = dtype
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+
+class SegmentPool:
+    """Segmentos de memória compartilhada reaproveitados entre trabalhos (no servidor).
+
+    acquire() devolve um segmento livre de ao menos nbytes (ou cria um, se o total de
+    max_bytes permitir) e None quando não há memória: o trabalho segue então por pickle.
+    """
+
+    def __init__(self, segment_bytes=DEFAULT_SEGMENT_MB << 20, max_bytes=None, min_bytes=DEFAULT_MIN_KB << 10):
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes if max_bytes is not None else 4 * segment_bytes
+        self.min_bytes = min_bytes
+        self._free = []
+        self._all = {}
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def acquire(self, nbytes):
+        with self._lock:
+            if self._closed:
+                return None
+            fitting = [s for s in self._free if s.size >= nbytes]
+            if fitting:
+                segment = min(fitting, key=lambda s: s.size)
+                self._free.remove(segment)
+                return segment
+            # Segmentos maiores que o padrão só para uploads maiores que ele
+            size = max(self.segment_bytes, -(-nbytes // (1 << 20)) << 20)
+            total = sum(s.size for s in self._all.values())
+            while total + size > self.max_bytes and self._free:
+                # Troca segmentos livres pequenos demais por um do tamanho pedido
+                self._discard(self._free.pop(0))
+                total = sum(s.size for s in self._all.values())
+            if total + size > self.max_bytes:
+                return None
+            segment = shared_memory.SharedMemory(create=True, size=size)
+            self._all[segment.name] = segment
+            return segment
+
+    def release(self, segment):
+        with self._lock:
+            if self._closed or segment.name not in self._all:
+                self._discard(segment)
+            else:
+                self._free.append(segment)
+
+    def _discard(self, segment):
+        self._all.pop(segment.name, None)
+        segment.close()
+        try:
+            segment.unlink()
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        """Remove todos os segmentos; os que estão em uso são removidos ao serem devolvidos."""
+        with self._lock:
+            self._closed = True
+            for segment in self._free:
+                self._discard(segment)
+            self._free = []
+
+    def stats(self):
+        with self._lock:
+            return {"segments": len(self._all), "free": len(self._free),
+                    "bytes": sum(s.size for s in self._all.values())}
+
+
+def segment_pool_from_env(max_pending):
+    """SegmentPool com LIMA_SHM_SEGMENT_MB, LIMA_SHM_MB e LIMA_SHM_MIN_KB, ou None sem o transporte.
+
+    Por padrão o total é de um segmento por trabalho pendente, limitado a metade do espaço livre
+    em /dev/shm: gravar além do que o tmpfs comporta derrubaria o processo (SIGBUS).
+    """
+    if shared_memory is None or os.environ.get('LIMA_SHM', '1') == '0':
+        return None
+    segment_bytes = int(os.environ.get('LIMA_SHM_SEGMENT_MB', DEFAULT_SEGMENT_MB)) << 20
+    max_bytes = int(os.environ.get('LIMA_SHM_MB', 0)) << 20 or max_pending * segment_bytes
+    try:
+        stat = os.statvfs('/dev/shm')
+        max_bytes = min(max_bytes, stat.f_bavail * stat.f_frsize // 2)
+    except OSError:
+        pass
+    if max_bytes < segment_bytes:
+        return None
+    return SegmentPool(segment_bytes, max_bytes, int(os.environ.get('LIMA_SHM_MIN_KB', DEFAULT_MIN_KB)) << 10)
+
+
+def _is_large(value, min_bytes):
+    if isinstance(value, np.ndarray):
+        return value.nbytes >= min_bytes and value.dtype.hasobject is False
+    return isinstance(value, (bytes, bytearray, memoryview)) and memoryview(value).nbytes >= min_bytes
+
+
+def share_args(args, segments):
+    """Grava os argumentos grandes em um segmento; devolve (argumentos, segmento ou None).
+
+    Os argumentos grandes viram SharedBuffer; sem argumentos grandes ou sem memória disponível
+    os argumentos voltam como estão (e seguem por pickle).
+    """
+    large = [i for i, value in enumerate(args) if _is_large(value, segments.min_bytes)]
+    if not large:
+        return args, None
+    sizes = {i: (args[i].nbytes if isinstance(args[i], np.ndarray) else memoryview(args[i]).nbytes) for i in large}
+    segment = segments.acquire(sum(sizes.values()))
+    if segment is None:
+        return args, None
+    args = list(args)
+    offset = 0
+    for i in large:
+        value = args[i]
+        nbytes = sizes[i]
+        if isinstance(value, np.ndarray):
+            target = np.ndarray(value.shape, value.dtype, buffer=segment.buf, offset=offset)
+            target[...] = value
+            args[i] = SharedBuffer(segment.name, offset, nbytes, 'ndarray', value.shape, value.dtype.str)
+            del target
+        else:
+            segment.buf[offset:offset + nbytes] = memoryview(value).cast('B')
+            args[i] = SharedBuffer(segment.name, offset, nbytes, 'bytes')
+        offset += nbytes
+    return tuple(args), segment
+
+
+# --- No processo de trabalho ---
+
+# Segmentos já abertos neste processo: os mesmos voltam a cada trabalho, então o mapeamento é
+# reaproveitado em vez de refeito (limitado para não prender segmentos que o servidor descartou)
+_attached = OrderedDict()
+_MAX_ATTACHED = 16
+
+
+def _attach(name):
+    segment = _attached.pop(name, None)
+    if segment is None:
+        segment = shared_memory.SharedMemory(name=name)
+        while len(_attached) >= _MAX_ATTACHED:
+            _, old = _attached.popitem(last=False)
+            try:
+                old.close()
+            except BufferError:
+                # Ainda há views do segmento vivas; o mapeamento some junto com elas
+                pass
+    _attached[name] = segment
+    return segment
+
+
+def _resolve(value):
+    if not isinstance(value, SharedBuffer):
+        return value
+    buf = _attach(value.segment).buf
+    if value.kind == 'ndarray':
+        return np.ndarray(value.shape, np.dtype(value.dtype), buffer=buf, offset=value.offset)
+    return buf[value.offset:value.offset + value.nbytes]
+
+
+def _store(value, segment, offset, min_bytes):
+    # Um resultado grande volta pelo segmento se couber nele; senão segue por pickle
+    if isinstance(value, str):
+        if len(value) < min_bytes or not value.isascii() or offset + len(value) > segment.size:
+            return value, offset
+        segment.buf[offset:offset + len(value)] = value.encode('ascii')
+        return SharedBuffer(segment.name, offset, len(value), 'str'), offset + len(value)
+    if isinstance(value, (bytes, bytearray, memoryview, np.ndarray)) and _is_large(value, min_bytes):
+        data = memoryview(value).cast('B') if not isinstance(value, np.ndarray) else memoryview(np.ascontiguousarray(value)).cast('B')
+        if offset + data.nbytes > segment.size:
+            return value, offset
+        segment.buf[offset:offset + data.nbytes] = data
+        if isinstance(value, np.ndarray):
+            return SharedBuffer(segment.name, offset, data.nbytes, 'ndarray', value.shape, value.dtype.str), offset + data.nbytes
+        return SharedBuffer(segment.name, offset, data.nbytes, 'bytes'), offset + data.nbytes
+    return value, offset
+
+
+def run_shared(fn, segment_name, min_bytes, args, kwargs):
+    """Executa fn(*args) no processo de trabalho, com os SharedBuffer trocados pelos dados.
+
+    O resultado (ou, num dict, cada valor) grande é gravado no início do segmento, que os
+    argumentos já não usam; o servidor o lê com collect_result().
+    """
+    result = fn(*[_resolve(value) for value in args], **kwargs)
+    segment = _attach(segment_name)
+    if isinstance(result, dict):
+        offset = 0
+        shared = {}
+        for key, value in result.items():
+            shared[key], offset = _store(value, segment, offset, min_bytes)
+        return shared
+    return _store(result, segment, 0, min_bytes)[0]
+
+
+# --- De volta ao servidor ---
+
+def _collect(value, segment):
+    if not isinstance(value, SharedBuffer):
+        return value
+    view = segment.buf[value.offset:value.offset + value.nbytes]
+    try:
+        if value.kind == 'str':
+            return str(view, 'ascii')
+        if value.kind == 'ndarray':
+            return np.frombuffer(view, np.dtype(value.dtype)).reshape(value.shape).copy()
+        return bytes(view)
+    finally:
+        view.release()
+
+
+def collect_result(result, segment):
+    """Copia para fora do segmento os valores que o processo de trabalho gravou nele."""
+    if isinstance(result, dict):
+        return {key: _collect(value, segment) for key, value in result.items()}
+    return _collect(result, segment)
+
+
+def shared_future(inner, segment, segments):
+    """Future que termina quando o resultado já foi copiado do segmento e ele foi devolvido.
+
+    O segmento volta ao pool só quando o trabalho termina de fato (inclusive com a morte do
+    processo): cancelar ou desistir de esperar pelo Future devolvido não o libera antes da hora,
+    porque o processo ainda pode estar escrevendo nele.
+    """
+    outer = Future()
+
+    def finish(done):
+        try:
+            if done.cancelled():
+                outer.cancel()
+                return
+            error = done.exception()
+            result = None if error is not None else collect_result(done.result(), segment)
+        except BaseException as e:
+            error = e
+        finally:
+            segments.release(segment)
+        if outer.cancelled():
+            return
+        if error is not None:
+            outer.set_exception(error)
+        else:
+            outer.set_result(result)
+
+    # Cancelar o Future externo tenta tirar o trabalho da fila
+    outer.add_done_callback(lambda f: inner.cancel() if f.cancelled() else None)
+    inner.add_done_callback(finish)
+    return outer
@@ -0,0 +1,28 @@
+# Os testes importam os módulos do serviço direto desta pasta (src/assets/python)
+import base64
+import os
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('LIMA_WORKERS', '1')
+os.environ.setdefault('LIMA_VERBOSE_LOG', '0')
+
+
+@pytest.fixture(scope='session')
+def client():
+    import server
+    yield server.app.test_client()
+    server.pool.shutdown()
+
+
+@pytest.fixture(scope='session')
+def sheet_base64():
+    # Papel branco com um quadrado de referência e uma folha
+    image = np.full((300, 400, 3), 255, np.uint8)
+    cv2.rectangle(image, (20, 20), (80, 80), (0, 0, 0), -1)
+    cv2.ellipse(image, (250, 150), (80, 40), 30, 0, 360, (40, 120, 40), -1)
+    return base64.b64encode(cv2.imencode('.png', image)[1].tobytes()).decode()
@@ -0,0 +1,54 @@
+# Na retomada, summary.json continua descrevendo todas as imagens do diretório de saída, e não
+# só as processadas na última execução
+import json
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+import batch_analyze
+
+
+def write_sheets(directory, count):
+    # Papel branco com um quadrado de referência e uma folha de tamanho diferente em cada imagem
+    for i in range(count):
+        image = np.full((300, 400, 3), 255, np.uint8)
+        cv2.rectangle(image, (20, 20), (80, 80), (0, 0, 0), -1)
+        cv2.ellipse(image, (250, 150), (50 + 10 * i, 30), 30, 0, 360, (40, 120, 40), -1)
+        cv2.imwrite(os.path.join(directory, f'folha{i}.png'), image)
+
+
+def read_summary(out):
+    with open(os.path.join(out, 'summary.json'), encoding='utf-8') as f:
+        return json.load(f)
+
+
+@pytest.mark.parametrize('fmt', ['csv', 'parquet'])
+def test_resume_summary_covers_previous_images(tmp_path, fmt):
+    if fmt == 'parquet':
+        pytest.importorskip('pyarrow')
+    images = tmp_path / 'imagens'
+    images.mkdir()
+    write_sheets(str(images), 4)
+    out = str(tmp_path / 'resultados')
+    argv = [str(images), '--out', out, '--format', fmt, '--workers', '1']
+
+    batch_analyze.main(argv)
+    full = read_summary(out)
+    assert full["numberOfImages"] == 4
+    assert full["numberOfLeaves"] == 4
+
+    # Uma imagem nova: a segunda execução só processa ela, mas o resumo cobre as cinco
+    write_sheets(str(images), 5)
+    batch_analyze.main(argv)
+    resumed = read_summary(out)
+    assert resumed["numberOfImages"] == 5
+    assert resumed["numberOfLeaves"] == 5
+
+    batch_analyze.main(argv + ['--no-resume'])
+    fresh = read_summary(out)
+    assert fresh["numberOfImages"] == 5
+    for field in ("area", "perimeter", "width", "length"):
+        assert resumed[field]["total"] == pytest.approx(fresh[field]["total"], rel=1e-4)
+        assert resumed[field]["std"] == pytest.approx(fresh[field]["std"], rel=1e-3)
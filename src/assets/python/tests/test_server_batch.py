@@ -0,0 +1,55 @@
+# O lote não gera a imagem processada sem um "overlay" explícito e escreve os resultados à
+# medida que ficam prontos, na ordem das imagens
+import json
+
+import server
+
+
+def test_batch_skips_processed_image_by_default(client, sheet_base64):
+    items = [{"base64_image": sheet_base64, "id": "padrao"},
+             {"base64_image": sheet_base64, "id": "png", "overlay": "png"}]
+    response = client.post('/analyze/batch', json={"images": items})
+
+    assert response.status_code == 200
+    default, png = response.get_json()["results"]
+    assert default["result"]["processedImage"] is None
+    assert png["result"]["processedImage"]
+
+
+def test_batch_overlay_option_applies_to_all_items(client, sheet_base64):
+    items = [{"base64_image": sheet_base64}, {"base64_image": sheet_base64, "overlay": "none"}]
+    response = client.post('/analyze/batch', json={"images": items, "overlay": "jpeg"})
+
+    first, second = response.get_json()["results"]
+    assert first["result"]["processedImageMimeType"] == 'image/jpeg'
+    assert second["result"]["processedImage"] is None
+
+
+def test_batch_streams_results_in_order(client, sheet_base64, monkeypatch):
+    started = []
+    analyze = server.analyze_image_bytes
+
+    def counting_analyze(*args, **kwargs):
+        started.append(1)
+        return analyze(*args, **kwargs)
+
+    monkeypatch.setattr(server, 'analyze_image_bytes', counting_analyze)
+    count = 4 * server.pool.workers + 1
+    items = [{"base64_image": sheet_base64, "id": f"img{i}"} for i in range(count)]
+    items.insert(2, {"id": "sem-imagem"})
+    response = client.post('/analyze/batch', json={"images": items}, buffered=False)
+
+    # Ao chegar o primeiro resultado, só a primeira janela de imagens foi enviada para análise
+    chunks = iter(response.response)
+    head = b''
+    while b'"result": ' not in head:
+        head += next(chunks)
+    assert len(started) <= 2 * server.pool.workers
+    body = json.loads(head + b''.join(chunks))
+    response.close()
+
+    assert body["count"] == count + 1
+    assert [r["id"] for r in body["results"]] == [item["id"] for item in items]
+    assert [r["index"] for r in body["results"]] == list(range(count + 1))
+    assert "error" in body["results"][2]["result"]
+    assert all(r["result"]["numberOfLeaves"] == 1 for i, r in enumerate(body["results"]) if i != 2)
@@ -0,0 +1,33 @@
+# Opções com tipo errado são recusadas como opções inválidas: 400 em /analyze e /jobs e erro só
+# do item no lote, sem derrubar as demais imagens
+import pytest
+
+
+BAD_OPTIONS = [{"reference_square_id": {}}, {"overlay_max_side": [1]}, {"contour_epsilon": []}]
+
+
+def test_batch_reports_bad_option_type_per_item(client, sheet_base64):
+    image = sheet_base64
+    items = [{"base64_image": image, "id": "ok", "overlay": "none"}]
+    items += [{"base64_image": image, "id": f"bad{i}", "overlay": "none", **options} for i, options in enumerate(BAD_OPTIONS)]
+    response = client.post('/analyze/batch', json={"images": items})
+
+    assert response.status_code == 200
+    results = response.get_json()["results"]
+    assert results[0]["result"]["numberOfLeaves"] == 1
+    for result in results[1:]:
+        assert "error" in result["result"]
+
+
+@pytest.mark.parametrize('options', BAD_OPTIONS)
+def test_analyze_rejects_bad_option_type(client, sheet_base64, options):
+    response = client.post('/analyze', json={"base64_image": sheet_base64, **options})
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+
+
+@pytest.mark.parametrize('options', BAD_OPTIONS)
+def test_jobs_rejects_bad_option_type(client, sheet_base64, options):
+    response = client.post('/jobs', json={"base64_image": sheet_base64, **options})
+    assert response.status_code == 400
+    assert "error" in response.get_json()
@@ -0,0 +1,26 @@
+# O tempo de /analyze/stream é registrado quando o fluxo termina, e não quando o after_request
+# devolve a resposta (antes do primeiro quadro ser analisado)
+import time
+
+import server
+
+
+def stream_series():
+    return server.request_seconds._series.get(('/analyze/stream',), [None, 0.0, 0])
+
+
+def test_stream_latency_covers_the_frames(client, monkeypatch):
+    def slow_frame(stream, index, frame, binary, leaf_layout):
+        time.sleep(0.2)
+        return '{"index": %d}\n' % index
+
+    monkeypatch.setattr(server, 'stream_frame_line', slow_frame)
+    _, total_before, count_before = stream_series()
+
+    response = client.post('/analyze/stream', data=b'{"id": 1}\n{"id": 2}\n', content_type='application/x-ndjson')
+    assert response.status_code == 200
+    assert response.get_data(as_text=True).count('\n') == 2
+
+    _, total, count = stream_series()
+    assert count == count_before + 1
+    assert total - total_before >= 0.4
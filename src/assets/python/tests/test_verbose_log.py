@@ -0,0 +1,29 @@
+# Com o log desligado (verbose=False, LIMA_VERBOSE_LOG=0) a análise não escreve no stderr, nem
+# o aviso de imagem sem quadrado de referência
+import cv2
+import numpy as np
+
+from python_service import analyze_image_bytes, calibrate, measure_image
+
+
+def leaf_without_reference():
+    image = np.full((300, 400, 3), 255, np.uint8)
+    cv2.ellipse(image, (250, 150), (80, 40), 30, 0, 360, (40, 120, 40), -1)
+    return image
+
+
+def test_no_reference_warning_only_in_verbose_log(capsys):
+    measurements = measure_image(leaf_without_reference())
+    assert not measurements.squares
+
+    calibrate(measurements, verbose=False)
+    assert capsys.readouterr().err == ''
+
+    calibrate(measurements, verbose=True)
+    assert 'AVISO: Nenhum quadrado de referência' in capsys.readouterr().err
+
+
+def test_quiet_analysis_writes_nothing_to_stderr(capsys):
+    image = cv2.imencode('.png', leaf_without_reference())[1].tobytes()
+    analyze_image_bytes(image, 1.0, 'none')
+    assert capsys.readouterr().err == ''
@@ -0,0 +1,68 @@
+# thread_budget.py
+# Quantas threads cada processo de análise pode usar. O OpenCV paraleliza internamente
+# cvtColor, threshold, findContours e imencode, e o BLAS do NumPy cria as suas próprias
+# threads; com vários processos no pool, cada um usando todos os núcleos, as threads
+# disputam a CPU e a latência das requisições simultâneas piora. Por padrão os núcleos
+# disponíveis são divididos entre os processos (OpenCV) e o BLAS fica com uma thread.
+#
+# Variáveis de ambiente: LIMA_CV2_THREADS e LIMA_BLAS_THREADS (0 ou ausente = automático).
+import os
+
+import cv2
+
+try:
+    import threadpoolctl
+except ImportError:
+    threadpoolctl = None
+
+# Lidas pelas bibliotecas BLAS/OpenMP quando são carregadas (ao importar o NumPy)
+BLAS_ENV_VARS = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+                 'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS')
+
+
+def available_cpus():
+    """Núcleos que este processo pode usar (respeita a afinidade de CPU, ex.: em contêineres)."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def plan_threads(workers=None, cv2_threads=None, blas_threads=None):
+    """Divide os núcleos entre os processos.
+
+    Devolve (workers, cv2_threads, blas_threads). Sem valores explícitos: um processo por
+    núcleo, núcleos // workers threads do OpenCV por processo (ao menos 1) e 1 thread de BLAS
+    (a PCA multiplica matrizes Nx2, pequenas demais para ganhar com threads).
+    """
+    cpus = available_cpus()
+    workers = max(1, workers or cpus)
+    cv2_threads = max(1, cv2_threads or cpus // workers)
+    blas_threads = max(1, blas_threads or 1)
+    return workers, cv2_threads, blas_threads
+
+
+def plan_from_env(workers=None):
+    """plan_threads com LIMA_CV2_THREADS e LIMA_BLAS_THREADS."""
+    cv2_threads = int(os.environ.get('LIMA_CV2_THREADS', 0)) or None
+    blas_threads = int(os.environ.get('LIMA_BLAS_THREADS', 0)) or None
+    return plan_threads(workers, cv2_threads, blas_threads)
+
+
+def limit_blas_env(blas_threads):
+    # As bibliotecas BLAS leem estas variáveis só ao serem carregadas, então isto vale para os
+    # processos criados depois (que herdam o ambiente), não para o processo atual. Valores já
+    # definidos pelo usuário são mantidos.
+    for name in BLAS_ENV_VARS:
+        os.environ.setdefault(name, str(blas_threads))
+
+
+def configure_worker(cv2_threads, blas_threads):
+    """Aplica o orçamento no processo atual (usado como initializer dos pools de processos).
+
+    O limite do BLAS em um processo que já carregou o NumPy só é aplicado com o threadpoolctl
+    instalado; sem ele vale o limit_blas_env() feito antes de criar o processo.
+    """
+    cv2.setNumThreads(cv2_threads)
+    if threadpoolctl is not None:
+        threadpoolctl.threadpool_limits(blas_threads)
@@ -0,0 +1,152 @@
+# worker_pool.py
+# Pool de processos usado pelo servidor para executar as análises fora da thread da requisição.
+# O OpenCV e o NumPy rodam em processos separados, então uma imagem grande não bloqueia
+# as demais requisições nem disputa o GIL do servidor Flask.
+# O servidor passa AnalysisPool.run como o `run` de analyze_image_bytes: só a etapa com OpenCV
+# vai para o pool, e PoolFullError, PoolUnavailableError e JobTimeoutError chegam a quem chamou.
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from shm_transport import run_shared, segment_pool_from_env, share_args, shared_future
+from thread_budget import configure_worker, limit_blas_env, plan_from_env, plan_threads
+
+
+class PoolFullError(Exception):
+    """A fila de trabalhos atingiu o limite configurado (max_pending)."""
+
+
+class PoolUnavailableError(Exception):
+    """O pool foi encerrado ou um processo de trabalho morreu durante a execução."""
+
+
+class JobTimeoutError(Exception):
+    """O trabalho não terminou dentro do tempo limite."""
+
+
+class AnalysisPool:
+    """Pool de N processos com fila limitada e tempo limite por trabalho.
+
+    max_pending conta os trabalhos em execução e os que aguardam na fila. Quando o limite é
+    atingido, submit() falha imediatamente com PoolFullError (ou espera, se block=True), o que
+    permite ao servidor responder 429 em vez de acumular uploads na memória.
+
+    O tempo limite é aplicado à espera pelo resultado: o ProcessPoolExecutor não consegue
+    interromper um trabalho já em execução, então a vaga dele continua ocupada até o processo
+    terminar. Assim a contrapressão reflete a carga real dos processos.
+
+    Cada processo usa cv2_threads threads do OpenCV e blas_threads do BLAS; por padrão os
+    núcleos são divididos entre os processos (ver thread_budget.plan_threads).
+
+    Com shm=True, argumentos e resultados grandes (bytes da imagem, ndarrays, a imagem
+    processada) passam por segmentos de memória compartilhada reaproveitados, e só descritores
+    pequenos atravessam a fila (ver shm_transport.py; LIMA_SHM=0 desliga).
+    """
+
+    def __init__(self, workers=None, max_pending=None, job_timeout=None, cv2_threads=None, blas_threads=None,
+                 shm=False):
+        self.workers, self.cv2_threads, self.blas_threads = plan_threads(workers, cv2_threads, blas_threads)
+        self.max_pending = max(self.workers, max_pending or self.workers * 2)
+        self.job_timeout = job_timeout
+        self.segments = segment_pool_from_env(self.max_pending) if shm else None
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._closed = False
+
+    def _get_executor(self):
+        # Criado sob demanda para não iniciar processos ao apenas importar o módulo.
+        # Usa 'spawn' porque o servidor é multi-thread e 'fork' copiaria locks em uso.
+        with self._lock:
+            if self._closed:
+                raise PoolUnavailableError("Pool de análise encerrado")
+            if self._executor is None:
+                limit_blas_env(self.blas_threads)
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'),
+                                                     initializer=configure_worker,
+                                                     initargs=(self.cv2_threads, self.blas_threads))
+            return self._executor
+
+    def _reset(self, executor):
+        # Um processo que morre (ex.: falha dentro do OpenCV) quebra o executor inteiro;
+        # descarta-o para que o próximo trabalho crie um pool novo.
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, fn, *args, block=False, timeout=None, **kwargs):
+        if block:
+            acquired = self._slots.acquire(timeout=timeout)
+        else:
+            acquired = self._slots.acquire(blocking=False)
+        if not acquired:
+            raise PoolFullError(f"Fila de análise cheia ({self.max_pending} trabalhos pendentes)")
+
+        segment = None
+        try:
+            executor = self._get_executor()
+            if self.segments is not None:
+                args, segment = share_args(args, self.segments)
+            if segment is not None:
+                future = executor.submit(run_shared, fn, segment.name, self.segments.min_bytes, args, kwargs)
+            else:
+                future = executor.submit(fn, *args, **kwargs)
+        except BrokenProcessPool as e:
+            self._abort_submit(segment)
+            self._reset(executor)
+            raise PoolUnavailableError(str(e))
+        except (PoolUnavailableError, RuntimeError) as e:
+            # RuntimeError: submit após shutdown()
+            self._abort_submit(segment)
+            raise PoolUnavailableError(str(e))
+
+        future.add_done_callback(lambda _: self._slots.release())
+        if segment is not None:
+            # O resultado é copiado do segmento e ele volta ao pool quando o trabalho termina
+            future = shared_future(future, segment, self.segments)
+        future.executor = executor
+        return future
+
+    def _abort_submit(self, segment):
+        self._slots.release()
+        if segment is not None:
+            self.segments.release(segment)
+
+    def wait(self, future, timeout=None):
+        timeout = self.job_timeout if timeout is None else timeout
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            # Só tem efeito se o trabalho ainda estiver na fila
+            future.cancel()
+            raise JobTimeoutError(f"Análise excedeu o tempo limite de {timeout} s")
+        except BrokenProcessPool as e:
+            self._reset(future.executor)
+            raise PoolUnavailableError(str(e))
+
+    def run(self, fn, *args, **kwargs):
+        return self.wait(self.submit(fn, *args, **kwargs))
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            self._closed = True
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+        if self.segments is not None:
+            self.segments.close()
+
+
+def pool_from_env():
+    """Cria o pool a partir das variáveis LIMA_WORKERS, LIMA_MAX_PENDING, LIMA_JOB_TIMEOUT,
+    LIMA_CV2_THREADS e LIMA_BLAS_THREADS, com o transporte por memória compartilhada
+    (LIMA_SHM, LIMA_SHM_SEGMENT_MB, LIMA_SHM_MB e LIMA_SHM_MIN_KB)."""
+    workers, cv2_threads, blas_threads = plan_from_env(int(os.environ.get('LIMA_WORKERS', 0)) or None)
+    max_pending = int(os.environ.get('LIMA_MAX_PENDING', 0)) or None
+    job_timeout = float(os.environ.get('LIMA_JOB_TIMEOUT', 120)) or None
+    return AnalysisPool(workers=workers, max_pending=max_pending, job_timeout=job_timeout,
+                        cv2_threads=cv2_threads, blas_threads=blas_threads, shm=True)